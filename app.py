@@ -1,93 +1,150 @@
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import PlainTextResponse
-import os, tempfile, shutil
-from typing import Dict, Any, List
-from orchestrator import handle_request
-from storage.log_store_file import FileLogStore
+from fastapi.responses import PlainTextResponse, Response, JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+import asyncio, os, tempfile, shutil
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Tuple
+from jobs import get_job_store
+from storage.factory import get_log_store
+from storage.artifact_store import get_artifact_store
+from uploads import ingest_multipart, UploadLimitError
+import sandbox_pool, llm_client, metrics, budget, fetch_cache, warmup
 
 # Strict by default; set STRICT_FIELD_NAME=false to auto-accept common aliases
 STRICT_FIELD_NAME = os.getenv("STRICT_FIELD_NAME", "true").lower() not in {"0", "false", "no"}
 
-app = FastAPI(title="LLM Orchestrated Q&A API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await sandbox_pool.startup()
+    await fetch_cache.startup()
+    await get_log_store().init()
+    await budget.load_history(get_log_store())
+    get_artifact_store().start_gc()
+    await get_job_store().start()
+    warmup.start()  # background; /ready flips once it is done
+    try:
+        yield
+    finally:
+        # Drain in order: jobs (bounded by SHUTDOWN_GRACE_SEC), sandboxes, then stores
+        await warmup.stop()
+        await get_job_store().close()
+        await sandbox_pool.shutdown()
+        await get_artifact_store().close()
+        await fetch_cache.shutdown()
+        await llm_client.aclose()
+        await get_log_store().close()
+        metrics.mark_process_dead()
+
+app = FastAPI(title="LLM Orchestrated Q&A API", lifespan=lifespan)
 
 @app.get("/health")
 def health():
     return {"ok": True}
 
-def _is_upload_like(v: Any) -> bool:
-    # Duck-typing avoids FastAPI/Starlette class mismatches
-    return hasattr(v, "filename") and hasattr(v, "file") and callable(getattr(v, "read", None))
-
-@app.post("/api/", response_class=PlainTextResponse)
-async def api_entry(request: Request):
-    form = await request.form()
+@app.get("/ready")
+def ready():
+    state = warmup.status()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
 
-    # Collect only file parts (robustly, keeps duplicates if any)
-    raw_items = list(form.multi_items())
-    uploads: Dict[str, Any] = {k: v for k, v in raw_items if _is_upload_like(v)}
-
-    if "questions.txt" not in uploads:
-        # Helpful debug so you can see what actually arrived
-        try:
-            print("DEBUG form keys:", list(form.keys()))
-            print("DEBUG file-like keys:", [k for k, v in raw_items if _is_upload_like(v)])
-        except Exception:
-            pass
-
-        seen = list(uploads.keys())
-        msg = (
-            "questions.txt is required; field name must be exactly 'questions.txt'. "
-            f"Received file fields: {seen or '[]'}. "
-            "Example: curl -F \"questions.txt=@question.txt\" https://<host>/api/"
-        )
-        if not STRICT_FIELD_NAME:
-            # Optional automatic recovery for common mistakes
-            fallback_key = next((k for k in seen if k.lower() in {"file", "question", "questions"}), None)
-            if fallback_key:
-                uploads["questions.txt"] = uploads.pop(fallback_key)
-            else:
-                raise HTTPException(status_code=400, detail=msg)
-        else:
-            raise HTTPException(status_code=400, detail=msg)
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE_LATEST)
 
+async def _accept(request: Request) -> Tuple[str, List[Dict[str, Any]], str]:
+    """Parse the multipart upload into a fresh job dir -> (task_text, attachments, job_dir).
+    The caller owns job_dir on success; it is removed here on failure."""
     # Prepare job dir
     job_dir = tempfile.mkdtemp(prefix="job_")
     attach_dir = os.path.join(job_dir, "attachments")
     os.makedirs(attach_dir, exist_ok=True)
-    saved: List[Dict[str, Any]] = []
 
     try:
-        # Persist files
-        for field, up in uploads.items():
-            data = await up.read()
-            fname = getattr(up, "filename", None) or field
-            path = os.path.join(attach_dir, fname)
-            with open(path, "wb") as f:
-                f.write(data)
-            saved.append({
-                "field": field,
-                "filename": fname,
-                "path": path,
-                "content_type": getattr(up, "content_type", None),
-            })
+        # Stream file parts straight to disk (hashed, size-limited, deduplicated)
+        try:
+            saved = await ingest_multipart(request.headers, request.stream(), attach_dir)
+        except UploadLimitError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+
+        # Keep only the last part per field name (as a form dict would)
+        uploads: Dict[str, Dict[str, Any]] = {item["field"]: item for item in saved}
+
+        if "questions.txt" not in uploads:
+            seen = list(uploads.keys())
+            msg = (
+                "questions.txt is required; field name must be exactly 'questions.txt'. "
+                f"Received file fields: {seen or '[]'}. "
+                "Example: curl -F \"questions.txt=@question.txt\" https://<host>/api/"
+            )
+            if not STRICT_FIELD_NAME:
+                # Optional automatic recovery for common mistakes
+                fallback_key = next((k for k in seen if k.lower() in {"file", "question", "questions"}), None)
+                if fallback_key:
+                    uploads["questions.txt"] = uploads.pop(fallback_key)
+                    uploads["questions.txt"]["field"] = "questions.txt"
+                else:
+                    raise HTTPException(status_code=400, detail=msg)
+            else:
+                raise HTTPException(status_code=400, detail=msg)
+        saved = list(uploads.values())
 
         # Read questions content from the required field
-        qpath = next(item["path"] for item in saved if item["field"] == "questions.txt")
+        qpath = uploads["questions.txt"]["path"]
         with open(qpath, "rb") as f:
             task_text = f.read().decode("utf-8", "replace")
-
-        logger = FileLogStore()
-        result = await handle_request(task_text, saved, job_dir, logger)
-        return PlainTextResponse(result)
+        return task_text, saved, job_dir
 
     except HTTPException:
+        shutil.rmtree(job_dir, ignore_errors=True)
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"failure: {e}")
-    finally:
         shutil.rmtree(job_dir, ignore_errors=True)
+        raise HTTPException(status_code=500, detail=f"failure: {e}")
+
+def _accepted(job) -> JSONResponse:
+    return JSONResponse({"job_id": job.id, "status": job.status, "status_url": f"/jobs/{job.id}",
+                         "events_url": f"/jobs/{job.id}/events"}, status_code=202, headers={"Location": f"/jobs/{job.id}"})
+
+@app.post("/api/", response_class=PlainTextResponse)
+async def api_entry(request: Request):
+    task_text, saved, job_dir = await _accept(request)
+    store = get_job_store()
+    job = store.submit(task_text, saved, job_dir, get_log_store())
+    if request.query_params.get("async", "").lower() in {"1", "true", "yes"}:
+        return _accepted(job)
+    try:
+        # The job runs in its own task: if this connection drops, the result is still at /jobs/{id}
+        result = await asyncio.shield(job.wait())
+    except RuntimeError as e:
+        await store.discard(job.id)
+        raise HTTPException(status_code=500, detail=str(e))
+    # delivered: don't keep the payload (PNG data URIs and all) around for JOBS_RESULT_TTL_SEC
+    return PlainTextResponse(result, headers={"X-Job-Id": job.id}, background=BackgroundTask(store.discard, job.id))
 
 # Accept POST /api (no trailing slash) to avoid redirect-induced 405s
 @app.post("/api", include_in_schema=False)
 async def api_entry_alias(request: Request):
     return await api_entry(request)
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: Request):
+    task_text, saved, job_dir = await _accept(request)
+    return _accepted(get_job_store().submit(task_text, saved, job_dir, get_log_store()))
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    view = await get_job_store().view(job_id)
+    if view is None:
+        raise HTTPException(status_code=404, detail="unknown or expired job id")
+    return view
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    try:
+        after = int(request.headers.get("last-event-id") or 0)
+    except ValueError:
+        after = 0
+    stream = await get_job_store().stream(job_id, after)
+    if stream is None:
+        raise HTTPException(status_code=404, detail="unknown or expired job id")
+    return StreamingResponse(stream, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
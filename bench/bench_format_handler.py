@@ -0,0 +1,126 @@
+# bench/bench_format_handler.py
+# Micro-benchmark: format_handler.validate_and_coerce against the previous
+# regex + json.loads + full base64 decode implementation (kept below as legacy_*).
+#
+#   python bench/bench_format_handler.py [--repeat 20] [--out fmt_bench.json]
+import argparse, base64, io, json, os, random, re, sys, timeit
+from typing import Any, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from format_handler import validate_and_coerce, ValidationError
+
+# -------- previous implementation --------
+def _legacy_coerce_value(v, etype: Dict[str, Any]):
+    t = etype.get("type","string")
+    if t == "string":
+        return str(v)
+    if t == "int":
+        try: return int(v)
+        except: return 0
+    if t == "float":
+        decimals = etype.get("decimals")
+        try:
+            fv = float(v)
+            if decimals is not None:
+                return round(fv, int(decimals))
+            return fv
+        except:
+            return 0.0 if decimals is None else round(0.0, int(decimals))
+    if t == "boolean":
+        return bool(v)
+    if t == "data_uri_png":
+        return str(v)
+    return v
+
+def legacy_validate_and_coerce(stdout_text: str, spec: Dict[str, Any]) -> str:
+    container = spec.get("container", "text")
+    s = stdout_text.strip()
+    if container == "text":
+        return s if s else "N/A"
+    if container == "json_array":
+        m = re.search(r"(\[.*\])", s, flags=re.S)
+        if not m: raise ValidationError("No JSON array found in output")
+        try:
+            arr = json.loads(m.group(1))
+        except Exception as e:
+            raise ValidationError(f"Invalid JSON array: {e}")
+        if not isinstance(arr, list):
+            raise ValidationError("Not a JSON array")
+        target_len = spec.get("length")
+        if target_len is not None and len(arr) != target_len:
+            if len(arr) > target_len:
+                arr = arr[:target_len]
+            else:
+                arr.extend(["N/A"] * (target_len - len(arr)))
+        elems = spec.get("elements") or []
+        if elems and len(arr) == len(elems):
+            arr = [_legacy_coerce_value(v, et) for v, et in zip(arr, elems)]
+        for i, et in enumerate(spec.get("elements") or []):
+            if et.get("type") == "data_uri_png":
+                if not (isinstance(arr[i], str) and arr[i].startswith("data:image/png;base64,")):
+                    raise ValidationError("Expected PNG data URI")
+                raw = base64.b64decode(arr[i].split(",",1)[1])
+                maxb = et.get("max_bytes", 100000)
+                if len(raw) > maxb:
+                    raise ValidationError(f"PNG too large: {len(raw)} > {maxb}")
+        return json.dumps(arr, ensure_ascii=False)
+    raise ValidationError(f"Unsupported container: {container}")
+
+# -------- workloads --------
+def png_uri(nbytes: int) -> str:
+    # PNG signature + filler: only size and header matter to the validators
+    raw = b"\x89PNG\r\n\x1a\n" + random.randbytes(nbytes - 8)
+    return "data:image/png;base64," + base64.b64encode(raw).decode()
+
+def workloads() -> Dict[str, tuple]:
+    random.seed(0)
+    spec = {"container": "json_array", "length": 4, "elements": [
+        {"type": "int"}, {"type": "string"}, {"type": "float", "decimals": 6},
+        {"type": "data_uri_png", "max_bytes": 100000}]}
+    answer = json.dumps([42, "Titanic", 0.4857, png_uri(90_000)])
+    log_lines = "".join(f"step {i}: rows={i * 7} cols=['a', 'b']\n" for i in range(60_000))
+    numpy_lines = "".join(f"weights [{i}. {i + 1}. {i + 2}.]\n" for i in range(40_000))
+    return {
+        "small": (spec, answer),
+        "3mb_log_then_answer": (spec, log_lines + answer + "\n"),
+        "numpy_reprs_then_answer": (spec, numpy_lines + answer + "\n"),
+        "large_png_only": (spec, json.dumps([1, "x", 0.1, png_uri(99_000)])),
+    }
+
+def run(repeat: int) -> Dict[str, Any]:
+    results = {}
+    for name, (spec, out) in workloads().items():
+        legacy_ok = True
+        try:
+            assert validate_and_coerce(out, spec) == legacy_validate_and_coerce(out, spec)
+        except ValidationError:
+            legacy_ok = False  # old greedy regex can't isolate the answer
+            validate_and_coerce(out, spec)
+        new = min(timeit.repeat(lambda: validate_and_coerce(out, spec), number=1, repeat=repeat))
+        old = min(timeit.repeat(lambda: _swallow(legacy_validate_and_coerce, out, spec), number=1, repeat=repeat))
+        results[name] = {"bytes": len(out), "legacy_ms": round(old * 1e3, 3), "new_ms": round(new * 1e3, 3),
+                         "speedup": round(old / new, 2) if new else None, "legacy_valid": legacy_ok}
+    return results
+
+def _swallow(fn, *args):
+    try:
+        return fn(*args)
+    except ValidationError:
+        return None
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="validate_and_coerce micro-benchmark")
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--out", default=None)
+    args = ap.parse_args(argv)
+    results = run(args.repeat)
+    for name, r in results.items():
+        print(f"{name:<24} {r['bytes']:>10} B  legacy {r['legacy_ms']:>9.3f} ms  new {r['new_ms']:>9.3f} ms  "
+              f"x{r['speedup']}{'' if r['legacy_valid'] else '  (legacy rejects)'}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+# bench/fake_llm.py
+# Offline stand-in for the OpenAI Responses API (POST /v1/responses) used by the
+# benchmark. Replies are routed on the prompt: planner -> canned plan JSON,
+# code generator -> canned script, data loader (DECOMPOSE=true) -> canned loader,
+# formatter -> echo. Latency is configurable. FakeResponsesServer underneath is
+# the generic endpoint the tests use as well.
+#
+#   python bench/fake_llm.py --port 8765 --latency 0.5 --jitter 0.2
+import argparse, json, random, re, threading, time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Optional, Tuple
+
+DEFAULT_PLAN = {
+    "inputs": {"attachments_needed": ["*"], "external_sources": []},
+    "steps": [{"id": "S1", "op": "PREP", "desc": "load attachments"},
+              {"id": "S2", "op": "FORMAT", "desc": "print payload"}],
+    "assumptions": [],
+}
+
+# Shared loader for per-question decomposition: copies the attachment sizes into shared/.
+LOADER_CODE = '''\
+import json, os
+import pandas as pd
+os.makedirs("shared", exist_ok=True)
+sizes = {n: os.path.getsize(os.path.join("attachments", n)) for n in sorted(os.listdir("attachments"))}
+pd.DataFrame({"name": list(sizes), "bytes": list(sizes.values())}).to_pickle("shared/sizes.pkl")
+print(json.dumps([{"file": "shared/sizes.pkl", "description": "attachment sizes; columns name:str, bytes:int"}]))
+'''
+
+# Reads every attachment (so upload size matters), then prints an answer shaped
+# like the FormatSpec. __SPEC__ is replaced with the spec JSON from the prompt.
+DEFAULT_CODE = '''\
+import json, os
+spec = json.loads(__SPEC__)
+total = 0
+for name in sorted(os.listdir("attachments")):
+    with open(os.path.join("attachments", name), "rb") as f:
+        total += len(f.read())
+if spec.get("container") == "json_array":
+    out = []
+    for et in spec.get("elements") or [{"type": "string"}] * (spec.get("length") or 1):
+        t = et.get("type")
+        if t == "float": out.append(round(total / 1000.0, et.get("decimals") or 6))
+        elif t == "int": out.append(total)
+        elif t == "data_uri_png":
+            out.append("data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII=")
+        else: out.append(str(total))
+    print(json.dumps(out))
+else:
+    print(total)
+'''
+
+BROKEN_CODE = 'raise SystemExit("benchmark: injected failure")'
+
+def _spec_from_prompt(prompt: str) -> str:
+    m = re.search(r"FormatSpec[^\n]*\n(\{.*?\})\n", prompt, flags=re.S)
+    return m.group(1) if m else '{"container": "text"}'
+
+def response_body(text: str, model: str = "fake-model", input_tokens: int = 10, output_tokens: int = 5) -> dict:
+    return {
+        "id": "resp_fake", "object": "response", "created_at": int(time.time()),
+        "model": model, "status": "completed",
+        "output": [{
+            "type": "message", "id": "msg_fake", "role": "assistant", "status": "completed",
+            "content": [{"type": "output_text", "text": text, "annotations": []}],
+        }],
+        "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                  "total_tokens": input_tokens + output_tokens,
+                  "input_tokens_details": {"cached_tokens": 0},
+                  "output_tokens_details": {"reasoning_tokens": 0}},
+        "parallel_tool_calls": False, "tool_choice": "auto", "tools": [],
+    }
+
+class FakeResponsesServer:
+    """POST /v1/responses on 127.0.0.1. `reply(request_json) -> str` supplies output_text;
+    `statuses` is a queue of HTTP status codes served before normal replies (e.g. [429, 503]);
+    each call sleeps `delay` +- `jitter` seconds. Also used by the tests."""
+
+    def __init__(self, reply: Callable[[dict], str], statuses: Optional[List[int]] = None,
+                 delay: float = 0.0, jitter: float = 0.0, port: int = 0):
+        self.reply = reply
+        self.statuses = list(statuses or [])
+        self.delay = delay
+        self.jitter = jitter
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            def log_message(self, *a): pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                with server._lock:
+                    server.calls += 1
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                    status = server.statuses.pop(0) if server.statuses else 200
+                try:
+                    delay = max(0.0, server.delay + random.uniform(-server.jitter, server.jitter))
+                    if delay:
+                        time.sleep(delay)
+                    if status != 200:
+                        payload = {"error": {"message": "fake error", "type": "server_error", "code": None}}
+                    else:
+                        text = server.reply(body)
+                        payload = response_body(text, body.get("model", "fake-model"), *server.usage(body, text))
+                    data = json.dumps(payload).encode("utf-8")
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    if status == 429:
+                        self.send_header("Retry-After", "0")
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+
+    def usage(self, body: dict, text: str) -> Tuple[int, int]:
+        return 10, 5
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def _prompt(body: dict) -> str:
+    return body.get("input") if isinstance(body.get("input"), str) else json.dumps(body.get("input"))
+
+class FakeLLM(FakeResponsesServer):
+    """Benchmark replies routed on the prompt; `by_kind` counts calls per kind."""
+
+    def __init__(self, port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 plan: Optional[dict] = None, code: Optional[str] = None, fail_rate: float = 0.0):
+        super().__init__(lambda body: self.route(_prompt(body)), delay=latency, jitter=jitter, port=port)
+        self.plan = plan or DEFAULT_PLAN
+        self.code = code or DEFAULT_CODE
+        self.fail_rate = fail_rate
+        self.by_kind: Counter = Counter()
+
+    def usage(self, body: dict, text: str) -> Tuple[int, int]:
+        return max(1, len(_prompt(body)) // 4), max(1, len(text) // 4)
+
+    def route(self, prompt: str) -> str:
+        if "You are a planner agent" in prompt:
+            kind, text = "plan", json.dumps(self.plan)
+        elif "You are a data-loading agent" in prompt:
+            kind, text = "loader", LOADER_CODE
+        elif "You are a code generation agent" in prompt:
+            repair = "PREVIOUS STDERR:" in prompt
+            broken = not repair and random.random() < self.fail_rate
+            kind = "code"
+            text = BROKEN_CODE if broken else self.code.replace("__SPEC__", json.dumps(_spec_from_prompt(prompt)))
+        else:
+            kind, text = "answer", prompt[-200:]
+        with self._lock:
+            self.by_kind[kind] += 1
+        return text
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Offline fake OpenAI Responses endpoint")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency", type=float, default=0.0)
+    ap.add_argument("--jitter", type=float, default=0.0)
+    ap.add_argument("--fail-rate", type=float, default=0.0)
+    args = ap.parse_args()
+    srv = FakeLLM(args.port, args.latency, args.jitter, fail_rate=args.fail_rate)
+    print(f"fake Responses API on {srv.base_url}")
+    srv.httpd.serve_forever()
@@ -0,0 +1,99 @@
+# bench/import_profile.py
+# Import-time report for cold starts: runs `python -X importtime -c "import app"`
+# in fresh interpreters, keeps the fastest run per module, and writes a JSON
+# report (total, top modules by cumulative and self time, and whether modules
+# that should load lazily were imported) that can be diffed between versions.
+#
+#   python bench/import_profile.py [--module app] [--repeat 5] [--top 25] \
+#       [--lazy openai,PIL,pandas] [--out import_profile.json] [--compare previous.json]
+import argparse, json, os, re, subprocess, sys
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)\s*$")
+
+def parse_importtime(stderr: str) -> Dict[str, Dict[str, int]]:
+    """module -> {"self_us", "cumulative_us", "depth"} from -X importtime output."""
+    out = {}
+    for line in stderr.splitlines():
+        m = _LINE.match(line)
+        if m:
+            out[m.group(4)] = {"self_us": int(m.group(1)), "cumulative_us": int(m.group(2)),
+                               "depth": len(m.group(3)) // 2}
+    return out
+
+def profile_once(module: str) -> Dict[str, Dict[str, int]]:
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT,
+                          capture_output=True, text=True, env={**os.environ, "PYTHONDONTWRITEBYTECODE": ""})
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    return parse_importtime(proc.stderr)
+
+def merge_fastest(runs: List[Dict[str, Dict[str, int]]]) -> Dict[str, Dict[str, int]]:
+    # the first run also pays for .pyc compilation; keep each module's fastest run
+    merged: Dict[str, Dict[str, int]] = {}
+    for run in runs:
+        for name, row in run.items():
+            if name not in merged or row["cumulative_us"] < merged[name]["cumulative_us"]:
+                merged[name] = row
+    return merged
+
+def report(rows: Dict[str, Dict[str, int]], module: str, top: int, lazy: List[str]) -> dict:
+    def ranked(key: str) -> List[dict]:
+        best = sorted(rows.items(), key=lambda kv: kv[1][key], reverse=True)[:top]
+        return [{"module": n, "ms": round(r[key] / 1000, 2)} for n, r in best]
+    root = rows.get(module, {})
+    return {
+        "module": module,
+        "total_ms": round(root.get("cumulative_us", 0) / 1000, 2),
+        "modules": len(rows),
+        "top_cumulative": ranked("cumulative_us"),
+        "top_self": ranked("self_us"),
+        "lazy_imported": {m: any(n == m or n.startswith(m + ".") for n in rows) for m in lazy},
+    }
+
+def compare(new: dict, old: dict) -> List[str]:
+    rows = []
+    a, b = new.get("total_ms"), old.get("total_ms")
+    if a is not None and b:
+        rows.append(f"{'total_ms':<40} {b:>10.2f} -> {a:>10.2f}  {(a - b) / b * 100:+.1f}%")
+    before = {r["module"]: r["ms"] for r in old.get("top_cumulative", [])}
+    for r in new.get("top_cumulative", []):
+        if r["module"] not in before:
+            rows.append(f"{r['module']:<40} {'(new)':>10} -> {r['ms']:>10.2f}")
+    for m, imported in new.get("lazy_imported", {}).items():
+        if imported and not old.get("lazy_imported", {}).get(m):
+            rows.append(f"{m:<40} now imported eagerly")
+    return rows
+
+def main(argv=None) -> dict:
+    ap = argparse.ArgumentParser(description="Import-time profile of the app's cold start")
+    ap.add_argument("--module", default="app")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--top", type=int, default=25)
+    ap.add_argument("--lazy", default="openai,PIL,pandas,tiktoken",
+                    help="comma list of modules that should not load at import time")
+    ap.add_argument("--out", default="import_profile.json")
+    ap.add_argument("--compare", default=None, help="previous report JSON to diff against")
+    args = ap.parse_args(argv)
+
+    rows = merge_fastest([profile_once(args.module) for _ in range(max(args.repeat, 1))])
+    rep = report(rows, args.module, args.top, [m for m in args.lazy.split(",") if m])
+    with open(args.out, "w") as f:
+        json.dump(rep, f, indent=2)
+    print(f"import {args.module}: {rep['total_ms']:.1f} ms, {rep['modules']} modules")
+    for r in rep["top_cumulative"][:10]:
+        print(f"  {r['ms']:>9.2f} ms  {r['module']}")
+    eager = [m for m, v in rep["lazy_imported"].items() if v]
+    if eager:
+        print("  imported eagerly: " + ", ".join(eager))
+    if args.compare:
+        with open(args.compare) as f:
+            old: Optional[dict] = json.load(f)
+        for line in compare(rep, old):
+            print(line)
+    return rep
+
+if __name__ == "__main__":
+    main()
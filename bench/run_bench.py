@@ -0,0 +1,267 @@
+# bench/run_bench.py
+# Offline end-to-end load benchmark for POST /api/. Starts bench/fake_llm.py in
+# process and the app under uvicorn (pointed at the fake via OPENAI_BASE_URL),
+# drives concurrent multipart uploads of varied sizes, scrapes /metrics before
+# and after, and writes a JSON report that can be diffed between versions.
+#
+#   python bench/run_bench.py --requests 40 --concurrency 8 --sizes 1k,256k,4m \
+#       --llm-latency 0.3 --out bench_results.json [--compare previous.json]
+import argparse, asyncio, json, os, random, re, shutil, socket, subprocess, sys, tempfile, time
+from typing import Dict, List, Optional, Tuple
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_llm import FakeLLM
+
+TASK = """Answer the following questions and respond with a JSON array of strings containing the answer.
+
+1. How many bytes were uploaded?
+2. What is the row count?
+3. What is the correlation between a and b?
+"""
+
+PHASES = ["format_spec", "plan", "codegen1", "run1", "validate1", "codegen2", "run2", "validate2", "fallback_dummy"]
+
+def parse_size(s: str) -> int:
+    m = re.fullmatch(r"(\d+)([kmg]?)", s.strip().lower())
+    if not m:
+        raise ValueError(f"bad size: {s}")
+    return int(m.group(1)) * {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}[m.group(2)]
+
+def make_csv(size: int) -> bytes:
+    rows = ["a,b"]
+    n = 3
+    while n < size:
+        r = f"{random.randint(0, 999)},{random.random():.6f}"
+        rows.append(r)
+        n += len(r) + 1
+    return ("\n".join(rows) + "\n").encode()
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+# -------- Prometheus text parsing --------
+def parse_metrics(text: str) -> Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float]:
+    out = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        m = re.match(r"([a-zA-Z_:][\w:]*)(\{(.*)\})?\s+(\S+)$", line)
+        if not m:
+            continue
+        labels = tuple(sorted(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', m.group(3) or "")))
+        out[(m.group(1), labels)] = float(m.group(4))
+    return out
+
+def delta(after: dict, before: dict) -> dict:
+    return {k: v - before.get(k, 0.0) for k, v in after.items()}
+
+def histogram(samples: dict, name: str, **match) -> List[Tuple[float, float]]:
+    """Cumulative (le, count) buckets of `name`, summed over series matching the labels."""
+    acc: Dict[float, float] = {}
+    for (metric, labels), v in samples.items():
+        if metric != f"{name}_bucket":
+            continue
+        d = dict(labels)
+        if any(d.get(k) != str(val) for k, val in match.items()):
+            continue
+        le = float("inf") if d["le"] == "+Inf" else float(d["le"])
+        acc[le] = acc.get(le, 0.0) + v
+    return sorted(acc.items())
+
+def quantile(buckets: List[Tuple[float, float]], q: float) -> Optional[float]:
+    """histogram_quantile(): linear interpolation inside the bucket holding rank q."""
+    if not buckets or buckets[-1][1] <= 0:
+        return None
+    rank = q * buckets[-1][1]
+    prev_le, prev_c = 0.0, 0.0
+    for le, c in buckets:
+        if c >= rank:
+            if le == float("inf"):
+                return prev_le
+            if c == prev_c:
+                return le
+            return prev_le + (le - prev_le) * (rank - prev_c) / (c - prev_c)
+        prev_le, prev_c = le, c
+    return prev_le
+
+def summarize(buckets) -> dict:
+    count = buckets[-1][1] if buckets else 0
+    return {"count": int(count), **{f"p{int(q * 100)}": _r(quantile(buckets, q)) for q in (0.5, 0.95, 0.99)}}
+
+def _r(v):
+    return None if v is None else round(v, 4)
+
+def pct(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    v = sorted(values)
+    return v[min(len(v) - 1, int(round(q * (len(v) - 1))))]
+
+def vm_hwm(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+# -------- driver --------
+async def drive(base: str, n: int, concurrency: int, payloads: List[Tuple[int, bytes]], timeout: float) -> List[dict]:
+    sem = asyncio.Semaphore(concurrency)
+    results: List[dict] = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base, timeout=timeout, limits=limits) as client:
+        async def one(i: int):
+            size, data = payloads[i % len(payloads)]
+            files = {"questions.txt": ("questions.txt", TASK.encode()), "data.csv": ("data.csv", data)}
+            async with sem:
+                t0 = time.perf_counter()
+                try:
+                    r = await client.post("/api/", files=files)
+                    status = r.status_code
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                results.append({"size": size, "status": status, "sec": time.perf_counter() - t0})
+        await asyncio.gather(*[one(i) for i in range(n)])
+    return results
+
+def run(args) -> dict:
+    sizes = [parse_size(s) for s in args.sizes.split(",")]
+    payloads = [(s, make_csv(s)) for s in sizes]
+    fake = FakeLLM(latency=args.llm_latency, jitter=args.llm_jitter, fail_rate=args.fail_rate).start()
+    work = tempfile.mkdtemp(prefix="bench_")
+    port = args.port or free_port()
+    env = {
+        **os.environ,
+        "OPENAI_BASE_URL": fake.base_url, "OPENAI_API_KEY": "sk-bench",
+        "LOG_DIR": os.path.join(work, "logs"), "RUNS_DIR": os.path.join(work, "runs"),
+        "UPLOAD_CAS_DIR": os.path.join(work, "cas"),
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    base = f"http://127.0.0.1:{port}"
+    t_start = time.perf_counter()
+    try:
+        deadline = time.time() + 120
+        live_sec = None
+        while True:
+            try:
+                # /health answers once the app is up; /ready once it has pre-warmed
+                if live_sec is None and httpx.get(base + "/health", timeout=1).status_code == 200:
+                    live_sec = time.perf_counter() - t_start
+                if live_sec is not None and httpx.get(base + "/ready", timeout=1).status_code == 200:
+                    ready_sec = time.perf_counter() - t_start
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.time() > deadline or server.poll() is not None:
+                raise RuntimeError("app did not start")
+            time.sleep(0.05)
+        time.sleep(args.warmup)
+
+        before = parse_metrics(httpx.get(base + "/metrics").text)
+        t0 = time.perf_counter()
+        results = asyncio.run(drive(base, args.requests, args.concurrency, payloads, args.timeout))
+        wall = time.perf_counter() - t0
+        after = parse_metrics(httpx.get(base + "/metrics").text)
+        hwm = vm_hwm(server.pid)
+    finally:
+        server.terminate()
+        try: server.wait(10)
+        except subprocess.TimeoutExpired: server.kill()
+        fake.stop()
+        shutil.rmtree(work, ignore_errors=True)
+
+    d = delta(after, before)
+    lat = [r["sec"] for r in results if r["status"] == 200]
+    fallbacks = d.get(("tds_fallback_dummy_total", ()), 0.0)
+    by_size = {}
+    for s in sizes:
+        v = [r["sec"] for r in results if r["size"] == s and r["status"] == 200]
+        by_size[str(s)] = {"count": len(v), "p50": _r(pct(v, 0.5)), "p95": _r(pct(v, 0.95)), "p99": _r(pct(v, 0.99))}
+    rss = histogram(d, "tds_sandbox_peak_rss_bytes")
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "git": _git_rev(),
+            "args": vars(args),
+        },
+        "requests": len(results),
+        "ok": len(lat),
+        "errors": len(results) - len(lat),
+        "startup": {"live_sec": _r(live_sec), "ready_sec": _r(ready_sec)},
+        "wall_sec": round(wall, 3),
+        "requests_per_sec": round(len(results) / wall, 3) if wall else None,
+        "latency": {"p50": _r(pct(lat, 0.5)), "p95": _r(pct(lat, 0.95)), "p99": _r(pct(lat, 0.99)), "max": _r(max(lat) if lat else None)},
+        "latency_by_size": by_size,
+        "phases": {p: summarize(histogram(d, "tds_phase_seconds", phase=p)) for p in PHASES},
+        "sandbox_spawn": {path: summarize(histogram(d, "tds_sandbox_spawn_seconds", path=path)) for path in ("warm", "cold")},
+        "sandbox_peak_rss_p99_bytes": _r(quantile(rss, 0.99)),
+        "server_rss_high_water_bytes": hwm,
+        "fallback_rate": round(fallbacks / len(results), 4) if results else None,
+        "llm_calls": dict(fake.by_kind),
+    }
+
+def _git_rev() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+def compare(new: dict, old: dict) -> List[str]:
+    rows = []
+    def line(label, a, b):
+        if a is None or b is None:
+            return
+        change = f"{(a - b) / b * 100:+.1f}%" if b else "n/a"
+        rows.append(f"{label:<28} {b:>12.4f} -> {a:>12.4f}  {change}")
+    line("requests_per_sec", new.get("requests_per_sec"), old.get("requests_per_sec"))
+    for q in ("p50", "p95", "p99"):
+        line(f"latency.{q}", new["latency"].get(q), old["latency"].get(q))
+    for p in PHASES:
+        for q in ("p50", "p99"):
+            line(f"{p}.{q}", new["phases"].get(p, {}).get(q), old.get("phases", {}).get(p, {}).get(q))
+    for k in ("live_sec", "ready_sec"):
+        line(f"startup.{k}", new.get("startup", {}).get(k), old.get("startup", {}).get(k))
+    line("fallback_rate", new.get("fallback_rate"), old.get("fallback_rate"))
+    line("server_rss_high_water_bytes", new.get("server_rss_high_water_bytes"), old.get("server_rss_high_water_bytes"))
+    return rows
+
+def main(argv=None) -> dict:
+    ap = argparse.ArgumentParser(description="Offline load benchmark for POST /api/")
+    ap.add_argument("--requests", type=int, default=40)
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--sizes", default="1k,256k,4m", help="comma list of attachment sizes (k/m/g suffixes)")
+    ap.add_argument("--llm-latency", type=float, default=0.3)
+    ap.add_argument("--llm-jitter", type=float, default=0.1)
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="share of first scripts that fail (exercises repair)")
+    ap.add_argument("--timeout", type=float, default=300.0)
+    ap.add_argument("--warmup", type=float, default=0.0, help="extra seconds to wait after /ready")
+    ap.add_argument("--port", type=int, default=0)
+    ap.add_argument("--out", default="bench_results.json")
+    ap.add_argument("--compare", default=None, help="previous results JSON to diff against")
+    ap.add_argument("--max-fallback-rate", type=float, default=None,
+                    help="exit non-zero when the share of dummy answers exceeds this")
+    args = ap.parse_args(argv)
+
+    report = run(args)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps({k: report[k] for k in ("requests", "ok", "requests_per_sec", "latency", "fallback_rate")}, indent=2))
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print("\n".join(compare(report, json.load(f))))
+    if args.max_fallback_rate is not None and (report["fallback_rate"] or 0) > args.max_fallback_rate:
+        raise SystemExit(f"fallback_rate {report['fallback_rate']} exceeds {args.max_fallback_rate}")
+    return report
+
+if __name__ == "__main__":
+    main()
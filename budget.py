@@ -0,0 +1,128 @@
+# budget.py
+# Adaptive per-phase time budgets. Keeps a rolling window of observed phase
+# durations (fed from the same entries that go to the log store, and reloaded
+# from it at startup) and splits the time left before CLIENT_RESPOND_SEC
+# between the remaining phases, holding back a repair round when history
+# says first attempts fail often enough to need one.
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+from config import (
+    PLAN_SEC, CODEGEN1_SEC, RUN1_SEC, REPAIR_CODEGEN_SEC, REPAIR_RUN_SEC,
+    BUDGET_ADAPTIVE, BUDGET_QUANTILE, BUDGET_MARGIN, BUDGET_WINDOW, BUDGET_MIN_SAMPLES,
+    BUDGET_REPAIR_MIN_PROB, BUDGET_MIN_SEC, BUDGET_HISTORY_LOAD,
+)
+
+FIRST = ("plan", "codegen1", "run1")
+REPAIR = ("codegen2", "run2")
+STATIC = {"plan": PLAN_SEC, "codegen1": CODEGEN1_SEC, "run1": RUN1_SEC,
+          "codegen2": REPAIR_CODEGEN_SEC, "run2": REPAIR_RUN_SEC}
+# Floors of the static scheme (min(cap, max(floor, remaining)))
+STATIC_FLOOR = {"plan": 3, "codegen1": 5, "run1": 10, "codegen2": 5, "run2": 10}
+
+def quantile(values: List[float], q: float) -> float:
+    v = sorted(values)
+    pos = q * (len(v) - 1)
+    lo = int(pos)
+    hi = min(lo + 1, len(v) - 1)
+    return v[lo] + (v[hi] - v[lo]) * (pos - lo)
+
+class BudgetAllocator:
+    def __init__(self, adaptive: bool = BUDGET_ADAPTIVE, q: float = BUDGET_QUANTILE, margin: float = BUDGET_MARGIN,
+                 window: int = BUDGET_WINDOW, min_samples: int = BUDGET_MIN_SAMPLES,
+                 repair_min_prob: float = BUDGET_REPAIR_MIN_PROB, min_sec: float = BUDGET_MIN_SEC):
+        self.adaptive = adaptive
+        self.q = q
+        self.margin = margin
+        self.min_samples = min_samples
+        self.repair_min_prob = repair_min_prob
+        self.min_sec = min_sec
+        self.samples: Dict[str, Deque[float]] = {p: deque(maxlen=window) for p in STATIC}
+        self.first_ok: Deque[bool] = deque(maxlen=window)  # did the first attempt validate?
+
+    # -------- history --------
+    def observe(self, entry: Dict[str, Any]) -> None:
+        phase = entry.get("phase")
+        sec = entry.get("sec")
+        if phase in self.samples and isinstance(sec, (int, float)) and not entry.get("cached"):
+            self.samples[phase].append(float(sec))
+        if phase == "run1" and entry.get("ok") is False:
+            self.first_ok.append(False)
+        elif phase == "validate1" and "result" in entry:
+            self.first_ok.append(entry["result"] == "ok")
+
+    def load(self, entries: Iterable[Dict[str, Any]]) -> None:
+        for e in entries:
+            self.observe(e)
+
+    def need(self, phase: str) -> Tuple[float, str]:
+        s = self.samples[phase]
+        if len(s) < self.min_samples:
+            return float(STATIC[phase]), "static"
+        return max(self.min_sec, quantile(list(s), self.q) * self.margin), "history"
+
+    def p_repair(self) -> Optional[float]:
+        if len(self.first_ok) < self.min_samples:
+            return None
+        return 1.0 - sum(self.first_ok) / len(self.first_ok)
+
+    # -------- allocation --------
+    def allocate(self, phase: str, remaining: float) -> Dict[str, Any]:
+        """Timeout for `phase` given `remaining` seconds to the client deadline.
+
+        Every phase still ahead in the current attempt is expected to need need(p);
+        slack beyond those needs (and the repair reserve) is shared pro rata. If the
+        reserve does not fit, the current attempt keeps its needs and the reserve
+        shrinks; if even the needs do not fit, they are scaled down together."""
+        if not self.adaptive:
+            budget = min(STATIC[phase], max(STATIC_FLOOR[phase], remaining))
+            return {"budget": round(budget, 3), "remaining": round(remaining, 3), "source": "static"}
+
+        seq = FIRST[FIRST.index(phase):] if phase in FIRST else REPAIR[REPAIR.index(phase):]
+        needs = {p: self.need(p) for p in seq}
+        total = sum(n for n, _src in needs.values())
+        mine, source = needs[phase]
+        p_rep = self.p_repair()
+        reserve = 0.0
+        if phase in FIRST and (p_rep is None or p_rep >= self.repair_min_prob):
+            reserve = sum(self.need(p)[0] for p in REPAIR)
+        pool = max(remaining - reserve, min(remaining, total))
+        budget = max(self.min_sec, min(remaining, pool * mine / total if total else pool))
+        return {
+            "budget": round(budget, 3), "remaining": round(remaining, 3), "need": round(mine, 3),
+            "reserve": round(min(reserve, max(0.0, remaining - total)), 3),
+            "p_repair": None if p_rep is None else round(p_rep, 3), "source": source,
+        }
+
+class ObservingLogger:
+    """Log-store proxy that also feeds every saved entry to the allocator."""
+
+    def __init__(self, inner, allocator: BudgetAllocator):
+        self.inner = inner
+        self.allocator = allocator
+
+    async def init(self) -> None:
+        await self.inner.init()
+
+    async def save(self, req_id: str, entry: Dict[str, Any]) -> None:
+        self.allocator.observe(entry)
+        await self.inner.save(req_id, entry)
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+_allocator: Optional[BudgetAllocator] = None
+
+def get_allocator() -> BudgetAllocator:
+    global _allocator
+    if _allocator is None:
+        _allocator = BudgetAllocator()
+    return _allocator
+
+async def load_history(store, limit: int = BUDGET_HISTORY_LOAD) -> int:
+    """Seed the allocator from the log store's most recent entries; returns how many were read."""
+    recent = getattr(store, "recent", None)
+    if recent is None or limit <= 0:
+        return 0
+    entries = await recent(limit)
+    get_allocator().load(entries)
+    return len(entries)
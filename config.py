@@ -1,4 +1,4 @@
-import os
+import os, tempfile
 
 def getenv(name: str, default=None, cast=str):
     v = os.getenv(name)
@@ -10,11 +10,29 @@ def getenv(name: str, default=None, cast=str):
         return v
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
 
 FAST_MODEL = getenv("FAST_MODEL", "o4-mini")
 REASONING_MODEL = getenv("REASONING_MODEL", "o3")
 CODEGEN_MODEL = getenv("CODEGEN_MODEL", "o4-mini")
 
+# Async LLM client: shared connection pool, in-flight cap, retry with jittered backoff on 429/5xx
+LLM_MAX_CONCURRENCY = getenv("LLM_MAX_CONCURRENCY", 8, int)
+LLM_MAX_CONNECTIONS = getenv("LLM_MAX_CONNECTIONS", 20, int)
+LLM_MAX_RETRIES = getenv("LLM_MAX_RETRIES", 3, int)
+LLM_BACKOFF_BASE_SEC = getenv("LLM_BACKOFF_BASE_SEC", 0.5, float)
+LLM_BACKOFF_MAX_SEC = getenv("LLM_BACKOFF_MAX_SEC", 8.0, float)
+LLM_CONNECT_TIMEOUT_SEC = getenv("LLM_CONNECT_TIMEOUT_SEC", 10.0, float)
+LLM_REQUEST_TIMEOUT_SEC = getenv("LLM_REQUEST_TIMEOUT_SEC", 120.0, float)
+
+# Prompt assembly: token budget per prompt (PROMPT_MAX_TOKENS_BY_MODEL overrides it,
+# "model=tokens,..."); oversized repair stdout/stderr and data summaries are cut to fit,
+# each to at most PROMPT_SECTION_MAX_TOKENS. Counts use tiktoken when installed.
+PROMPT_MAX_TOKENS = getenv("PROMPT_MAX_TOKENS", 16000, int)
+PROMPT_MAX_TOKENS_BY_MODEL = getenv("PROMPT_MAX_TOKENS_BY_MODEL", "")
+PROMPT_SECTION_MAX_TOKENS = getenv("PROMPT_SECTION_MAX_TOKENS", 3000, int)
+PROMPT_SECTION_MIN_TOKENS = getenv("PROMPT_SECTION_MIN_TOKENS", 200, int)
+
 TOTAL_DEADLINE_SEC = getenv("TOTAL_DEADLINE_SEC", 300, int)
 CLIENT_RESPOND_SEC = getenv("CLIENT_RESPOND_SEC", 285, int)
 
@@ -24,15 +42,191 @@ RUN1_SEC = getenv("RUN1_SEC", 90, int)
 REPAIR_CODEGEN_SEC = getenv("REPAIR_CODEGEN_SEC", 35, int)
 REPAIR_RUN_SEC = getenv("REPAIR_RUN_SEC", 70, int)
 
+# Attachment pre-ingestion: tabular files are converted once (sandboxed, within
+# INGEST_SEC) to ingested/<file>.parquet (.pkl without pyarrow) and summarised
+# (columns, dtypes, rows, INGEST_SAMPLE_ROWS sample rows) into the plan/code prompts.
+INGEST_ENABLED = getenv("INGEST_ENABLED", "true").lower() not in {"0", "false", "no"}
+INGEST_SEC = getenv("INGEST_SEC", 20, int)
+INGEST_SAMPLE_ROWS = getenv("INGEST_SAMPLE_ROWS", 3, int)
+INGEST_MAX_FILE_BYTES = getenv("INGEST_MAX_FILE_BYTES", 512 * 1024 * 1024, int)
+INGEST_SUMMARY_MAX_CHARS = getenv("INGEST_SUMMARY_MAX_CHARS", 3000, int)
+
+# Payload validation: a data_uri_png answer over its max_bytes is recompressed
+# in-process (re-encode, palette, then downscale, never below PNG_MIN_SIDE_PX on the
+# short side) before it is rejected; PNG_RECOMPRESS=false rejects it right away.
+PNG_RECOMPRESS = getenv("PNG_RECOMPRESS", "true").lower() not in {"0", "false", "no"}
+PNG_MIN_SIDE_PX = getenv("PNG_MIN_SIDE_PX", 100, int)
+
+# Adaptive phase budgets: the static *_SEC values above are only used until a phase has
+# BUDGET_MIN_SAMPLES durations in history (last BUDGET_WINDOW per phase, reloaded from
+# the log store's last BUDGET_HISTORY_LOAD entries at startup). A phase is expected to
+# need its BUDGET_QUANTILE duration * BUDGET_MARGIN; a repair round is reserved while
+# the observed first-attempt failure rate is >= BUDGET_REPAIR_MIN_PROB.
+BUDGET_ADAPTIVE = getenv("BUDGET_ADAPTIVE", "true").lower() not in {"0", "false", "no"}
+BUDGET_QUANTILE = getenv("BUDGET_QUANTILE", 0.95, float)
+BUDGET_MARGIN = getenv("BUDGET_MARGIN", 1.2, float)
+BUDGET_WINDOW = getenv("BUDGET_WINDOW", 500, int)
+BUDGET_MIN_SAMPLES = getenv("BUDGET_MIN_SAMPLES", 20, int)
+BUDGET_REPAIR_MIN_PROB = getenv("BUDGET_REPAIR_MIN_PROB", 0.05, float)
+BUDGET_MIN_SEC = getenv("BUDGET_MIN_SEC", 2.0, float)
+BUDGET_HISTORY_LOAD = getenv("BUDGET_HISTORY_LOAD", 5000, int)
+
+# Sandbox worker pool: pre-warmed interpreters that fork a child per job.
+# SANDBOX_POOL_SIZE=0 disables the pool; SANDBOX_WARMUP: eager (at startup) | lazy (on first run).
+# SANDBOX_WARM_MODULES defaults to the "Allowed libs" of prompts/code_prompt.txt.
+SANDBOX_POOL_SIZE = getenv("SANDBOX_POOL_SIZE", 2, int)
+SANDBOX_WARMUP = getenv("SANDBOX_WARMUP", "eager")
+SANDBOX_WARM_MODULES = getenv("SANDBOX_WARM_MODULES", "")
+
+# Sandbox output capture: stdout keeps its first and last SANDBOX_STDOUT_MAX_BYTES/2,
+# stderr its first HEAD and last TAIL bytes. SANDBOX_EARLY_COMPLETE=true returns as
+# soon as stdout ends with a payload that validates against the FormatSpec (the
+# script is then killed instead of waiting for its teardown).
+SANDBOX_STDOUT_MAX_BYTES = getenv("SANDBOX_STDOUT_MAX_BYTES", 8 * 1024 * 1024, int)
+SANDBOX_STDERR_HEAD_BYTES = getenv("SANDBOX_STDERR_HEAD_BYTES", 16 * 1024, int)
+SANDBOX_STDERR_TAIL_BYTES = getenv("SANDBOX_STDERR_TAIL_BYTES", 48 * 1024, int)
+SANDBOX_EARLY_COMPLETE = getenv("SANDBOX_EARLY_COMPLETE", "false").lower() not in {"0", "false", "no"}
+
+# Opt-in profiling of generated code: run1/run2 are stack-sampled every
+# SANDBOX_PROFILE_INTERVAL_SEC (plus tracemalloc with SANDBOX_PROFILE_MEMORY, which
+# slows allocation-heavy code); the profile is kept in runs/<req_id>/ and its top
+# SANDBOX_PROFILE_TOP hot spots go into the repair prompt.
+SANDBOX_PROFILE = getenv("SANDBOX_PROFILE", "false").lower() not in {"0", "false", "no"}
+SANDBOX_PROFILE_INTERVAL_SEC = getenv("SANDBOX_PROFILE_INTERVAL_SEC", 0.01, float)
+SANDBOX_PROFILE_MEMORY = getenv("SANDBOX_PROFILE_MEMORY", "false").lower() not in {"0", "false", "no"}
+SANDBOX_PROFILE_TOP = getenv("SANDBOX_PROFILE_TOP", 8, int)
+
+# Per-job sandbox limits, applied in the child before user code runs (0 = unlimited).
+# RLIMIT_NPROC counts every process of the server's user, so it is off by default.
+# SANDBOX_CGROUP_ROOT: a delegated cgroup-v2 directory; each run then gets its own
+# cgroup with memory.max / pids.max / cpu.max (SANDBOX_CGROUP_CPUS cores) and OOM accounting.
+SANDBOX_RLIMIT_AS_MB = getenv("SANDBOX_RLIMIT_AS_MB", 4096, int)
+SANDBOX_RLIMIT_CPU_SEC = getenv("SANDBOX_RLIMIT_CPU_SEC", 300, int)
+SANDBOX_RLIMIT_NOFILE = getenv("SANDBOX_RLIMIT_NOFILE", 1024, int)
+SANDBOX_RLIMIT_FSIZE_MB = getenv("SANDBOX_RLIMIT_FSIZE_MB", 1024, int)
+SANDBOX_RLIMIT_NPROC = getenv("SANDBOX_RLIMIT_NPROC", 0, int)
+SANDBOX_CGROUP_ROOT = getenv("SANDBOX_CGROUP_ROOT", "")
+SANDBOX_CGROUP_MEMORY_MB = getenv("SANDBOX_CGROUP_MEMORY_MB", 2048, int)
+SANDBOX_CGROUP_PIDS_MAX = getenv("SANDBOX_CGROUP_PIDS_MAX", 256, int)
+SANDBOX_CGROUP_CPUS = getenv("SANDBOX_CGROUP_CPUS", 0.0, float)
+
+# Scheduler: sandbox runs and LLM calls are admitted earliest-deadline-first through
+# separate limiters. Sandbox slots = SANDBOX_MAX_CONCURRENCY, or SANDBOX_PER_CPU * cpus if 0
+# (LLM slots = LLM_MAX_CONCURRENCY). With ADMISSION_CONTROL on, a request whose remaining
+# budget is below the expected plan+codegen+run time (+queueing, +ADMISSION_SLACK_SEC)
+# gets the dummy answer right away. Until real hold times are observed, a sandbox slot
+# is assumed to be held for ADMISSION_SEED_FRACTION of RUN1_SEC and an LLM slot for
+# that fraction of the mean of PLAN_SEC and CODEGEN1_SEC.
+SANDBOX_MAX_CONCURRENCY = getenv("SANDBOX_MAX_CONCURRENCY", 0, int)
+SANDBOX_PER_CPU = getenv("SANDBOX_PER_CPU", 1.0, float)
+ADMISSION_CONTROL = getenv("ADMISSION_CONTROL", "true").lower() not in {"0", "false", "no"}
+ADMISSION_SLACK_SEC = getenv("ADMISSION_SLACK_SEC", 0.0, float)
+ADMISSION_SEED_FRACTION = getenv("ADMISSION_SEED_FRACTION", 0.25, float)
+
+# Hedged codegen: HEDGE_K>1 generates K candidate scripts concurrently and races them.
+# Candidate i starts after i*HEDGE_DELAY_SEC (or as soon as a sibling fails).
+# HEDGE_MODELS / HEDGE_TEMPERATURES are comma lists cycled over candidates
+# (empty model = CODEGEN_MODEL, empty temperature = provider default).
+HEDGE_K = getenv("HEDGE_K", 1, int)
+HEDGE_DELAY_SEC = getenv("HEDGE_DELAY_SEC", 0.0, float)
+HEDGE_MODELS = getenv("HEDGE_MODELS", "")
+HEDGE_TEMPERATURES = getenv("HEDGE_TEMPERATURES", "")
+
+# Per-question decomposition (opt-in): a JSON-array task with at least
+# DECOMPOSE_MIN_QUESTIONS numbered questions gets one shared data-loading script,
+# then one small script per question, generated and run concurrently. Only failed
+# questions are repaired; a question still open DECOMPOSE_RESERVE_SEC before the
+# client deadline gets its dummy value. Takes precedence over HEDGE_K.
+DECOMPOSE = getenv("DECOMPOSE", "false").lower() not in {"0", "false", "no"}
+DECOMPOSE_MIN_QUESTIONS = getenv("DECOMPOSE_MIN_QUESTIONS", 2, int)
+DECOMPOSE_RESERVE_SEC = getenv("DECOMPOSE_RESERVE_SEC", 3.0, float)
+
+# Run artifacts (runs/<req_id>): blobs >= ARTIFACT_COMPRESS_MIN_BYTES are gzipped;
+# ARTIFACT_PACK=true writes one runs/<req_id>.tar.gz; ARTIFACT_SAMPLE_SUCCESS_PCT<100 keeps
+# only that share of successful runs (failures are always kept). Retention GC by age/total bytes.
+RUNS_DIR = getenv("RUNS_DIR", "runs")
+ARTIFACT_COMPRESS_MIN_BYTES = getenv("ARTIFACT_COMPRESS_MIN_BYTES", 64 * 1024, int)
+ARTIFACT_PACK = getenv("ARTIFACT_PACK", "false").lower() not in {"0", "false", "no"}
+ARTIFACT_SAMPLE_SUCCESS_PCT = getenv("ARTIFACT_SAMPLE_SUCCESS_PCT", 100.0, float)
+ARTIFACT_RETENTION_SEC = getenv("ARTIFACT_RETENTION_SEC", 7 * 24 * 3600, int)
+ARTIFACT_MAX_BYTES = getenv("ARTIFACT_MAX_BYTES", 1024 * 1024 * 1024, int)
+ARTIFACT_GC_INTERVAL_SEC = getenv("ARTIFACT_GC_INTERVAL_SEC", 600, int)
+
+# Plan/code/payload cache. CACHE_REUSE lists the levels a hit may reuse
+# (plan,code,payload); empty disables the cache and request coalescing.
+CACHE_REUSE = getenv("CACHE_REUSE", "")
+CACHE_MEM_ITEMS = getenv("CACHE_MEM_ITEMS", 256, int)
+CACHE_DIR = getenv("CACHE_DIR", os.path.join(RUNS_DIR, "_cache"))
+CACHE_TTL_SEC = getenv("CACHE_TTL_SEC", 6 * 3600, int)
+CACHE_DISK_MAX_BYTES = getenv("CACHE_DISK_MAX_BYTES", 200 * 1024 * 1024, int)
+
+# Caching forward proxy for sandbox HTTP (HTTP_PROXY in the child env). Responses
+# are kept under FETCH_CACHE_DIR for their Cache-Control/Expires lifetime, else
+# FETCH_CACHE_TTL_SEC, then revalidated with ETag/Last-Modified.
+FETCH_CACHE_ENABLED = getenv("FETCH_CACHE_ENABLED", "true").lower() not in {"0", "false", "no"}
+FETCH_CACHE_DIR = getenv("FETCH_CACHE_DIR", os.path.join(RUNS_DIR, "_fetch"))
+FETCH_CACHE_TTL_SEC = getenv("FETCH_CACHE_TTL_SEC", 3600, int)
+FETCH_CACHE_MIN_TTL_SEC = getenv("FETCH_CACHE_MIN_TTL_SEC", 0, int)
+FETCH_CACHE_MAX_BYTES = getenv("FETCH_CACHE_MAX_BYTES", 500 * 1024 * 1024, int)
+FETCH_CACHE_MAX_OBJECT_BYTES = getenv("FETCH_CACHE_MAX_OBJECT_BYTES", 50 * 1024 * 1024, int)
+FETCH_CACHE_UPSTREAM_TIMEOUT_SEC = getenv("FETCH_CACHE_UPSTREAM_TIMEOUT_SEC", 30.0, float)
+
+# Upload ingestion: per-file / per-request byte limits (413 on overflow) and the
+# content-addressed store of read-only blobs that identical attachments are
+# reflink-cloned from where the filesystem allows it (empty disables).
+UPLOAD_MAX_FILE_BYTES = getenv("UPLOAD_MAX_FILE_BYTES", 256 * 1024 * 1024, int)
+UPLOAD_MAX_REQUEST_BYTES = getenv("UPLOAD_MAX_REQUEST_BYTES", 512 * 1024 * 1024, int)
+UPLOAD_CAS_DIR = getenv("UPLOAD_CAS_DIR", os.path.join(tempfile.gettempdir(), "upload_cas"))
+UPLOAD_CAS_TTL_SEC = getenv("UPLOAD_CAS_TTL_SEC", 3600, int)
+
+# Async job API (POST /jobs, GET /jobs/{id}, GET /jobs/{id}/events): finished jobs are
+# kept JOBS_RESULT_TTL_SEC, at most JOBS_MAX_RESULTS of them; JOBS_MAX_EVENTS progress
+# events per job are replayed to late SSE subscribers.
+JOBS_MAX_RESULTS = getenv("JOBS_MAX_RESULTS", 1000, int)
+JOBS_RESULT_TTL_SEC = getenv("JOBS_RESULT_TTL_SEC", 3600, int)
+JOBS_MAX_EVENTS = getenv("JOBS_MAX_EVENTS", 200, int)
+JOBS_SSE_KEEPALIVE_SEC = getenv("JOBS_SSE_KEEPALIVE_SEC", 15.0, float)
+
+# Multi-process serving (python serve.py): WORKERS uvicorn processes share job state
+# through a SQLite registry in WAL mode (empty JOB_REGISTRY_PATH disables it; other
+# workers follow a job's events by polling every JOBS_POLL_SEC) and, via
+# PROMETHEUS_MULTIPROC_DIR, one /metrics view. Sandbox slots are split between
+# workers. On shutdown in-flight jobs get SHUTDOWN_GRACE_SEC to finish.
+HOST = getenv("HOST", "0.0.0.0")
+PORT = getenv("PORT", 8000, int)
+WORKERS = getenv("WORKERS", 1, int)
+JOB_REGISTRY_PATH = getenv("JOB_REGISTRY_PATH", os.path.join(RUNS_DIR, "_jobs.sqlite3"))
+JOBS_POLL_SEC = getenv("JOBS_POLL_SEC", 0.5, float)
+SHUTDOWN_GRACE_SEC = getenv("SHUTDOWN_GRACE_SEC", 30.0, float)
+
+# Startup pre-warm (LLM connection, sandbox interpreter, dummy PNG) runs in the
+# background after the app starts; GET /ready answers 503 until every step has
+# succeeded within STARTUP_PREWARM_TIMEOUT_SEC (a failed step keeps it 503).
+# GET /health is plain liveness.
+STARTUP_PREWARM = getenv("STARTUP_PREWARM", "true").lower() not in {"0", "false", "no"}
+STARTUP_PREWARM_TIMEOUT_SEC = getenv("STARTUP_PREWARM_TIMEOUT_SEC", 60.0, float)
+
 LOG_BACKEND = getenv("LOG_BACKEND", "file")
 LOG_DIR = getenv("LOG_DIR", "logs")
 LOG_FILE = getenv("LOG_FILE", "app.log")
+# Background-flushed log pipeline: bounded queue, group commit by size/time
+LOG_QUEUE_MAX = getenv("LOG_QUEUE_MAX", 10000, int)
+LOG_BATCH_SIZE = getenv("LOG_BATCH_SIZE", 200, int)
+LOG_FLUSH_SEC = getenv("LOG_FLUSH_SEC", 0.5, float)
+# File backend rotation (gzip-compressed)
+LOG_ROTATE_BYTES = getenv("LOG_ROTATE_BYTES", 10 * 1024 * 1024, int)
+LOG_ROTATE_KEEP = getenv("LOG_ROTATE_KEEP", 5, int)
 
 # S3
 AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_REGION = getenv("AWS_REGION", "us-east-1")
 LOG_S3_BUCKET = os.getenv("LOG_S3_BUCKET")
+LOG_S3_PREFIX = getenv("LOG_S3_PREFIX", "logs")
+LOG_S3_ENDPOINT_URL = os.getenv("LOG_S3_ENDPOINT_URL")
+LOG_S3_GZIP = getenv("LOG_S3_GZIP", "true").lower() not in {"0", "false", "no"}
 
 # DB
 DATABASE_URL = os.getenv("DATABASE_URL")
+LOG_DB_TABLE = getenv("LOG_DB_TABLE", "app_logs")
+LOG_DB_POOL_SIZE = getenv("LOG_DB_POOL_SIZE", 5, int)
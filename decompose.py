@@ -0,0 +1,67 @@
+# decompose.py
+# Per-question decomposition of multi-question tasks (DECOMPOSE=true). The task
+# text is split on the same numbered-question pattern make_format_spec counts, so
+# question i is element i of the FormatSpec. Each question becomes a slot with its
+# own task text and one-element spec; the orchestrator generates, runs and repairs
+# the slots independently and assemble() puts the answers back in order, with the
+# make_dummy_answer value for every slot left unresolved.
+import json
+from typing import Any, Dict, List, Optional, Tuple
+from format_handler import QUESTION_RE, find_last_json_array, make_dummy_answer
+from config import DECOMPOSE_MIN_QUESTIONS
+
+SHARED_DIR = "shared"
+
+def split_questions(task_text: str) -> Tuple[str, List[str]]:
+    """(preamble, questions); each question runs up to the next numbered line."""
+    starts = [m.start() for m in QUESTION_RE.finditer(task_text)]
+    if not starts:
+        return task_text.strip(), []
+    bounds = starts + [len(task_text)]
+    return task_text[:starts[0]].strip(), [task_text[a:b].strip() for a, b in zip(bounds, bounds[1:])]
+
+def applicable(spec: Dict[str, Any], task_text: str) -> bool:
+    n = spec.get("length") or 0
+    return (spec.get("container") == "json_array" and n >= max(DECOMPOSE_MIN_QUESTIONS, 2)
+            and len(split_questions(task_text)[1]) == n)
+
+class Slot:
+    """One numbered question: its task text, one-element spec and outcome (error is
+    the last failed attempt's, if any)."""
+
+    def __init__(self, index: int, task_text: str, spec: Dict[str, Any]):
+        self.index = index
+        self.task_text = task_text
+        self.spec = spec
+        self.value: Any = None
+        self.resolved = False
+        self.attempts = 0
+        self.error: Optional[str] = None
+
+def make_slots(task_text: str, spec: Dict[str, Any]) -> List[Slot]:
+    preamble, questions = split_questions(task_text)
+    elems = spec.get("elements") or [{"type": "string"}] * len(questions)
+    slots = []
+    for i, question in enumerate(questions):
+        text = (f"{preamble}\n\nAnswer ONLY the question below (question {i + 1} of {len(questions)}; "
+                f"the others are answered separately). Print a JSON array with exactly one element: "
+                f"the answer.\n\n{question}")
+        slots.append(Slot(i, text, {"container": "json_array", "length": 1, "elements": [elems[i]]}))
+    return slots
+
+def shared_summary(stdout: str) -> str:
+    """DATA SUMMARY lines for the per-question scripts from the loader's manifest."""
+    manifest = find_last_json_array(stdout or "") or []
+    lines = []
+    for item in manifest:
+        if isinstance(item, dict) and item.get("file"):
+            lines.append(f"- {item['file']}: {item.get('description', '')}".rstrip(": "))
+    if not lines:
+        return ""
+    return ("SHARED DATA (already loaded and cleaned by a previous step; read these with "
+            "pandas.read_pickle instead of fetching or parsing the sources again):\n" + "\n".join(lines))
+
+def assemble(slots: List[Slot], spec: Dict[str, Any]) -> str:
+    """JSON array of slot answers in question order; unresolved slots get their dummy value."""
+    dummy = json.loads(make_dummy_answer(spec))
+    return json.dumps([s.value if s.resolved else dummy[s.index] for s in slots], ensure_ascii=False)
@@ -0,0 +1,66 @@
+# disk_budget.py
+# Size bound for the on-disk caches (result cache tier, fetch cache) without a
+# directory walk per write. The byte total comes from one scan and is then kept
+# up to date by the writers through add(). The tree is walked again only when
+# the total passes max_bytes, or RESCAN_SEC after the last walk, which also
+# catches other workers' writes and expired files. A walk evicts oldest-first
+# down to LOW_WATER of the limit, so the next walk is many writes away.
+import os, threading, time
+from typing import Optional
+
+RESCAN_SEC = 300.0
+LOW_WATER = 0.9
+
+def file_size(path: str) -> int:
+    try:
+        return os.stat(path).st_size
+    except OSError:
+        return 0
+
+class DirBudget:
+    def __init__(self, root: str, max_bytes: int, ttl_sec: Optional[float] = None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl_sec = ttl_sec  # files older than this are dropped by the walk
+        self.total: Optional[int] = None  # unknown until the first walk
+        self.scans = 0
+        self._last_scan = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, delta: int) -> None:
+        """Account for a write that changed the tree by `delta` bytes; walks and
+        evicts when over budget or due for a rescan."""
+        with self._lock:
+            if self.total is not None:
+                self.total += delta
+            if self.total is None or self.total > self.max_bytes or time.monotonic() - self._last_scan > RESCAN_SEC:
+                self._scan()
+
+    def _scan(self) -> None:
+        files = []
+        total = 0
+        now = time.time()
+        for root, _dirs, names in os.walk(self.root):
+            for n in names:
+                p = os.path.join(root, n)
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    continue
+                if self.ttl_sec is not None and now - st.st_mtime > self.ttl_sec:
+                    try: os.remove(p)
+                    except OSError: pass
+                    continue
+                files.append((st.st_mtime, st.st_size, p))
+                total += st.st_size
+        if total > self.max_bytes:
+            files.sort()
+            target = int(self.max_bytes * LOW_WATER)
+            while files and total > target:
+                _, size, p = files.pop(0)
+                try: os.remove(p)
+                except OSError: pass
+                total -= size
+        self.total = total
+        self.scans += 1
+        self._last_scan = time.monotonic()
@@ -1,12 +1,64 @@
 # executor_b64.py
-import asyncio, os, sys, base64
-from typing import Tuple
+import asyncio, os, sys, base64, json, time, uuid
+from typing import Any, Dict, Optional
+from sandbox_pool import get_pool, _killpg, kill_stragglers
+from scheduler import get_scheduler
+from sandbox_io import stdout_buffer, stderr_buffer, pump
+import metrics, fetch_cache, sandbox_limits, sandbox_profiler
+from config import SANDBOX_PROFILE_INTERVAL_SEC, SANDBOX_PROFILE_MEMORY
+from sandbox_limits import RunResult
 
 RUN_FILENAME = "runner_user_code.py"
+STATS_FILENAME = ".sandbox_stats.json"
+HOOK_DIR = os.path.dirname(os.path.abspath(__file__))
 
 WRAP_TEMPLATE = '''\
 # Auto-generated runner: decodes base64 -> user_code_exec.py -> runs it.
-import base64, runpy
+import base64, runpy, atexit, json, os, sys
+
+def _stats():
+    # best-effort resource usage for the executor's metrics
+    try:
+        import resource
+        ru = resource.getrusage(resource.RUSAGE_SELF)
+        rss = ru.ru_maxrss if sys.platform == "darwin" else ru.ru_maxrss * 1024
+        with open("{STATS_FILE}", "w") as f:
+            json.dump({"cpu": ru.ru_utime + ru.ru_stime, "maxrss": rss}, f)
+    except Exception:
+        pass
+atexit.register(_stats)
+
+# per-job limits, applied here rather than in a preexec_fn (unsafe in the threaded server)
+sys.path.insert(0, "{HOOK_DIR}")
+try:
+    import sandbox_limits
+    sandbox_limits.join_cgroup({CGROUP})
+    sandbox_limits.apply_rlimits({LIMITS})
+finally:
+    sys.path.pop(0)
+
+if os.environ.get("FETCH_PROXY"):
+    # route https:// fetches through the caching proxy as well
+    sys.path.insert(0, "{HOOK_DIR}")
+    try:
+        import sandbox_fetch_hook
+        sandbox_fetch_hook.install()
+    except Exception:
+        pass
+    finally:
+        sys.path.pop(0)
+
+if os.environ.get("SANDBOX_PROFILE"):
+    sys.path.insert(0, "{HOOK_DIR}")
+    try:
+        import sandbox_profiler
+        _profiler = sandbox_profiler.from_env()
+        if _profiler is not None:
+            atexit.register(_profiler.stop)
+    except Exception:
+        pass
+    finally:
+        sys.path.pop(0)
 
 USER_FILE = "user_code_exec.py"
 code_b64 = "{USER_CODE_B64}"
@@ -15,28 +67,120 @@ with open(USER_FILE, "wb") as f:
 runpy.run_path(USER_FILE, run_name="__main__")
 '''
 
-async def run_user_code(user_code: str, cwd: str, timeout: int) -> Tuple[bool, str, str]:
+async def run_user_code(user_code: str, cwd: str, timeout: int, complete=None, profile: bool = False) -> RunResult:
+    """Run user_code in a sandbox; stdout/stderr come back size-capped. With
+    `complete` (stdout -> bool), return as soon as stdout satisfies it. The result
+    unpacks as (ok, stdout, stderr); its .usage holds the exit reason and usage.
+    With profile=True the run is sampled and usage["profile"] holds the profile
+    (also after a timeout)."""
     if not user_code.strip():
-        return False, "", "empty code"
+        return RunResult(False, "", "empty code", {"reason": "error"})
+
+    env = sandbox_profiler.env(SANDBOX_PROFILE_INTERVAL_SEC, SANDBOX_PROFILE_MEMORY) if profile else {}
+    async with get_scheduler().sandbox.slot():
+        metrics.SANDBOXES_ACTIVE.inc()
+        try:
+            res = await _run(user_code, cwd, timeout, complete, env)
+        finally:
+            metrics.SANDBOXES_ACTIVE.dec()
+    usage = sandbox_limits.usage_of(res)
+    if profile and isinstance(res, RunResult):
+        usage["profile"] = sandbox_profiler.load(cwd)
+    metrics.SANDBOX_EXITS.labels(usage.get("reason", "error").split(":")[0]).inc()
+    return res
 
+def _read_stats(cwd: str) -> Dict[str, Any]:
+    path = os.path.join(cwd, STATS_FILENAME)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            st = json.load(f)
+        os.remove(path)
+    except (OSError, ValueError):
+        return {}
+    metrics.observe_sandbox("cold", st.get("cpu"), st.get("maxrss"))
+    return st
+
+async def _run(user_code: str, cwd: str, timeout: int, complete=None, env: Optional[Dict[str, str]] = None) -> RunResult:
+    # Fast path: fork from a pre-warmed zygote; cold-spawn if none is free
+    pool = get_pool()
+    if pool is not None:
+        res = await pool.run(user_code, cwd, timeout, complete, env)
+        if res is not None:
+            return res
+
+    limits = sandbox_limits.job_limits()
+    cgroup = sandbox_limits.open_cgroup(uuid.uuid4().hex[:12])
+    try:
+        return await _run_cold(user_code, cwd, timeout, complete, limits, cgroup, env)
+    finally:
+        if cgroup is not None:
+            cgroup.remove()
+
+async def _run_cold(user_code: str, cwd: str, timeout: int, complete, limits: Dict[str, int], cgroup,
+                    env: Optional[Dict[str, str]] = None) -> RunResult:
     code_b64 = base64.b64encode(user_code.encode("utf-8")).decode("ascii")
-    wrapper = WRAP_TEMPLATE.replace("{USER_CODE_B64}", code_b64)
+    wrapper = (WRAP_TEMPLATE.replace("{USER_CODE_B64}", code_b64).replace("{STATS_FILE}", STATS_FILENAME)
+               .replace("{HOOK_DIR}", HOOK_DIR).replace("{LIMITS}", repr(dict(limits or {})))
+               .replace("{CGROUP}", repr(cgroup.path if cgroup is not None else None)))
 
     with open(os.path.join(cwd, RUN_FILENAME), "w", encoding="utf-8") as f:
         f.write(wrapper)
 
+    t_spawn = time.monotonic()
     proc = await asyncio.create_subprocess_exec(
         sys.executable, RUN_FILENAME,
         cwd=cwd,
         stdout=asyncio.subprocess.PIPE,
         stderr=asyncio.subprocess.PIPE,
-        env={**os.environ, "PYTHONUNBUFFERED":"1", "OPENAI_API_KEY":""}
+        env={**os.environ, "PYTHONUNBUFFERED":"1", "OPENAI_API_KEY":"", **fetch_cache.child_env(), **(env or {})},
+        start_new_session=True,  # own process group: a kill also reaches the script's children
     )
+    metrics.SANDBOX_SPAWN_SECONDS.labels("cold").observe(time.monotonic() - t_spawn)
+    out, err = stdout_buffer(), stderr_buffer()
+    early = asyncio.Event()
+    pumps = [asyncio.ensure_future(pump(proc.stdout, out, complete, early)),
+             asyncio.ensure_future(pump(proc.stderr, err))]
+
+    async def _wait() -> bool:
+        exited = asyncio.ensure_future(asyncio.gather(proc.wait(), *pumps))
+        if complete is not None:
+            early_wait = asyncio.ensure_future(early.wait())
+            try:
+                await asyncio.wait({exited, early_wait}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                early_wait.cancel()
+            if not exited.done():
+                exited.cancel()
+                return False
+        await exited
+        return True
+
     try:
-        out, err = await asyncio.wait_for(proc.communicate(), timeout=timeout)
-        ok = (proc.returncode == 0)
-        return ok, (out or b"").decode("utf-8","replace"), (err or b"").decode("utf-8","replace")
+        if not await asyncio.wait_for(_wait(), timeout=timeout):
+            _killpg(proc.pid)  # valid payload already on stdout; don't wait for teardown
+            await proc.wait()
+            metrics.SANDBOX_EARLY_EXITS.inc()
+            return RunResult(True, out.text(), err.text(),
+                             {"reason": "early", "wall": round(time.monotonic() - t_spawn, 3)})
+        kill_stragglers(proc.pid)
+        st = _read_stats(cwd)
+        rc = proc.returncode
+        usage = {"cpu": st.get("cpu"), "maxrss": st.get("maxrss"),
+                 "exit": rc if rc >= 0 else None, "signal": -rc if rc < 0 else None}
+        if cgroup is not None:
+            usage.update({k: v for k, v in cgroup.collect().items() if v is not None})
+        usage["reason"] = sandbox_limits.classify(usage["exit"], usage["signal"], err.text(), usage, limits)
+        usage["wall"] = round(time.monotonic() - t_spawn, 3)
+        return RunResult(rc == 0, out.text(), err.text(), usage)
     except asyncio.TimeoutError:
-        try: proc.kill()
-        except Exception: pass
-        return False, "", "timeout"
+        _killpg(proc.pid)
+        await proc.wait()
+        return RunResult(False, "", "timeout", {"reason": "timeout", "wall": round(time.monotonic() - t_spawn, 3)})
+    except asyncio.CancelledError:
+        _killpg(proc.pid)
+        asyncio.ensure_future(proc.wait())  # reap it without delaying the cancellation
+        raise
+    finally:
+        for t in pumps:
+            if not t.done():
+                t.cancel()
@@ -0,0 +1,412 @@
+# fetch_cache.py
+# Caching forward proxy for sandboxed scripts. Children get HTTP_PROXY (and
+# FETCH_PROXY, used by sandbox_fetch_hook to send https:// requests through us
+# as plain http with an X-Fetch-Scheme header). Responses are stored on disk
+# under FETCH_CACHE_DIR keyed by method + URL + request headers, reused while
+# fresh (Cache-Control / Expires, else FETCH_CACHE_TTL_SEC), revalidated with
+# ETag / Last-Modified once stale, and concurrent identical fetches share one
+# upstream request. Other methods are forwarded with their body and not cached.
+# Responses larger than FETCH_CACHE_MAX_OBJECT_BYTES are streamed through
+# instead of buffered. The proxy URL carries the request id as its username, so
+# hit/miss stats are kept per request.
+import asyncio, base64, contextvars, email.utils, hashlib, json, os, re, time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import quote, unquote
+import httpx
+import metrics
+from disk_budget import DirBudget, file_size
+from config import (
+    FETCH_CACHE_ENABLED, FETCH_CACHE_DIR, FETCH_CACHE_TTL_SEC, FETCH_CACHE_MIN_TTL_SEC,
+    FETCH_CACHE_MAX_BYTES, FETCH_CACHE_MAX_OBJECT_BYTES, FETCH_CACHE_UPSTREAM_TIMEOUT_SEC,
+)
+
+CACHEABLE_STATUS = {200, 203, 300, 301, 308, 404, 410}
+HOP_BY_HOP = {"connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "proxy-connection",
+              "te", "trailer", "transfer-encoding", "upgrade"}
+# request headers that never change the representation (or are handled here)
+UNKEYED = HOP_BY_HOP | {"host", "x-fetch-scheme", "if-none-match", "if-modified-since", "cache-control", "pragma"}
+
+_tag: contextvars.ContextVar[str] = contextvars.ContextVar("fetch_tag", default="")
+
+def set_request_tag(tag: str) -> contextvars.Token:
+    return _tag.set(tag)
+
+def reset_request_tag(token: contextvars.Token) -> None:
+    _tag.reset(token)
+
+def freshness(headers: Dict[str, str], default_ttl: float, min_ttl: float) -> Optional[float]:
+    """Seconds the response stays fresh; None if it must not be stored."""
+    cc = {k.strip().lower(): v for k, _eq, v in (p.partition("=") for p in headers.get("cache-control", "").split(",")) if k.strip()}
+    if "no-store" in cc:
+        return None
+    ttl: Optional[float] = None
+    if "no-cache" in cc:
+        ttl = 0.0
+    else:
+        for k in ("s-maxage", "max-age"):
+            if k in cc:
+                try:
+                    ttl = float(cc[k].strip('"'))
+                    break
+                except ValueError:
+                    pass
+    if ttl is None and "expires" in headers:
+        try:
+            ttl = email.utils.parsedate_to_datetime(headers["expires"]).timestamp() - time.time()
+        except (TypeError, ValueError):
+            ttl = 0.0
+    if ttl is None:
+        ttl = default_ttl
+    return max(ttl, min_ttl, 0.0)
+
+class FetchCache:
+    def __init__(self, cache_dir: str = FETCH_CACHE_DIR, ttl_sec: float = FETCH_CACHE_TTL_SEC,
+                 min_ttl_sec: float = FETCH_CACHE_MIN_TTL_SEC, max_bytes: int = FETCH_CACHE_MAX_BYTES,
+                 max_object_bytes: int = FETCH_CACHE_MAX_OBJECT_BYTES,
+                 upstream_timeout_sec: float = FETCH_CACHE_UPSTREAM_TIMEOUT_SEC, host: str = "127.0.0.1", port: int = 0):
+        self.dir = cache_dir
+        self.ttl_sec = ttl_sec
+        self.min_ttl_sec = min_ttl_sec
+        self.max_bytes = max_bytes
+        self.max_object_bytes = max_object_bytes
+        self.upstream_timeout_sec = upstream_timeout_sec
+        self.host = host
+        self.port = port
+        self.stats: Dict[str, Dict[str, int]] = {}
+        self._budget = DirBudget(cache_dir, max_bytes)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    # -------- lifecycle --------
+    async def start(self) -> None:
+        if self._server is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._client = httpx.AsyncClient(timeout=self.upstream_timeout_sec, follow_redirects=False)
+        self._server = await asyncio.start_server(self._serve, self.host, self.port, limit=2 ** 16)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def running(self) -> bool:
+        return self._server is not None and self._loop is asyncio.get_running_loop()
+
+    def proxy_url(self, tag: str = "") -> str:
+        auth = f"{quote(tag, safe='')}:x@" if tag else ""
+        return f"http://{auth}{self.host}:{self.port}"
+
+    def child_env(self, tag: str = "") -> Dict[str, str]:
+        url = self.proxy_url(tag)
+        return {"FETCH_PROXY": url, "HTTP_PROXY": url, "http_proxy": url}
+
+    # -------- stats --------
+    def _count(self, tag: str, result: str, nbytes: int = 0) -> None:
+        metrics.FETCH_CACHE.labels(result).inc()
+        s = self.stats.setdefault(tag, {})
+        s[result] = s.get(result, 0) + 1
+        s["bytes"] = s.get("bytes", 0) + nbytes
+
+    def pop_stats(self, tag: str) -> Dict[str, int]:
+        return self.stats.pop(tag, {})
+
+    # -------- store --------
+    @staticmethod
+    def key(method: str, url: str, headers: Dict[str, str]) -> str:
+        keyed = sorted((k, v) for k, v in headers.items() if k not in UNKEYED)
+        material = json.dumps([method, url, keyed], ensure_ascii=False)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def _paths(self, key: str) -> Tuple[str, str]:
+        base = os.path.join(self.dir, key[:2], key)
+        return base + ".json", base + ".body"
+
+    def _load(self, key: str) -> Optional[Tuple[Dict[str, Any], bytes]]:
+        meta_path, body_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(body_path, "rb") as f:
+                return meta, f.read()
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, key: str, meta: Dict[str, Any], body: bytes) -> None:
+        meta_path, body_path = self._paths(key)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        delta = 0
+        for path, data in ((body_path, body), (meta_path, json.dumps(meta).encode("utf-8"))):
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            delta -= file_size(path)
+            os.replace(tmp, path)
+            delta += len(data)
+        self._budget.add(delta)  # evicts oldest-first only when over FETCH_CACHE_MAX_BYTES
+
+    # -------- fetch --------
+    async def fetch(self, method: str, url: str, headers: Dict[str, str], tag: str = "",
+                    content: Optional[AsyncIterator[bytes]] = None, sink: Optional["_Stream"] = None,
+                    ) -> Tuple[int, List[Tuple[str, str]], Optional[bytes], str]:
+        """(status, headers, body, result) with result in hit | miss | revalidated |
+        coalesced | stale | bypass. GET/HEAD only are cached; other methods forward
+        `content` as the request body. A response larger than max_object_bytes is
+        not buffered: it goes to `sink` as it arrives and body is None."""
+        if method not in ("GET", "HEAD"):
+            status, hdrs, body = await self._upstream(method, url, headers, sink, content)
+            self._count(tag, "bypass", _size(body, sink))
+            return status, hdrs, body, "bypass"
+        key = self.key("GET", url, headers)
+        fut = self._inflight.get(key)
+        if fut is not None:
+            status, hdrs, body, _result = await asyncio.shield(fut)
+            if body is None:  # the leader streamed it; nothing shared to reuse
+                status, hdrs, body = await self._upstream(method, url, headers, sink)
+            self._count(tag, "coalesced", _size(body, sink))
+            return status, hdrs, body, "coalesced"
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            res = await self._fetch_get(key, url, headers, sink)
+            fut.set_result(res)
+        except BaseException as e:
+            fut.set_exception(e)
+            fut.exception()  # mark retrieved when nobody is waiting
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        status, hdrs, body, result = res
+        self._count(tag, result, _size(body, sink))
+        return res
+
+    async def _fetch_get(self, key: str, url: str, headers: Dict[str, str], sink: Optional["_Stream"] = None):
+        cached = await asyncio.to_thread(self._load, key)
+        cond: Dict[str, str] = {}
+        if cached is not None:
+            meta, body = cached
+            if time.time() < meta["expires"]:
+                return meta["status"], meta["headers"], body, "hit"
+            if meta.get("etag"):
+                cond["if-none-match"] = meta["etag"]
+            if meta.get("last_modified"):
+                cond["if-modified-since"] = meta["last_modified"]
+        try:
+            status, hdrs, new_body = await self._upstream("GET", url, {**headers, **cond}, sink)
+        except httpx.HTTPError:
+            if cached is not None and not (sink and sink.started):
+                return cached[0]["status"], cached[0]["headers"], cached[1], "stale"
+            raise
+        if status == 304 and cached is not None:
+            meta, body = cached
+            fresh_hdrs = {k.lower(): v for k, v in hdrs}
+            ttl = freshness(fresh_hdrs, self.ttl_sec, self.min_ttl_sec)
+            meta["expires"] = time.time() + (ttl or 0.0)
+            await asyncio.to_thread(self._store, key, meta, body)
+            return meta["status"], meta["headers"], body, "revalidated"
+        lower = {k.lower(): v for k, v in hdrs}
+        ttl = freshness(lower, self.ttl_sec, self.min_ttl_sec)
+        if status in CACHEABLE_STATUS and ttl is not None and new_body is not None and len(new_body) <= self.max_object_bytes:
+            meta = {"url": url, "status": status, "headers": hdrs, "stored": time.time(),
+                    "expires": time.time() + ttl, "etag": lower.get("etag"), "last_modified": lower.get("last-modified")}
+            await asyncio.to_thread(self._store, key, meta, new_body)
+        return status, hdrs, new_body, "miss"
+
+    async def _upstream(self, method: str, url: str, headers: Dict[str, str], sink: Optional["_Stream"] = None,
+                        content: Optional[AsyncIterator[bytes]] = None) -> Tuple[int, List[Tuple[str, str]], Optional[bytes]]:
+        # Buffers at most max_object_bytes (what the cache may store); past that the
+        # response is handed to sink chunk by chunk and the body returned is None.
+        # Without a sink (direct callers) the whole body is buffered.
+        drop = HOP_BY_HOP | {"x-fetch-scheme"} | (set() if content is not None else {"content-length"})
+        fwd = {k: v for k, v in headers.items() if k not in drop}
+        async with self._client.stream(method, url, headers=fwd, content=content) as resp:
+            hdrs = [(k, v) for k, v in resp.headers.multi_items() if k.lower() not in HOP_BY_HOP]
+            buf: Optional[List[bytes]] = []
+            size = 0
+            async for chunk in resp.aiter_raw():
+                if buf is None:
+                    await sink.write(chunk)
+                    continue
+                buf.append(chunk)
+                size += len(chunk)
+                if sink is not None and size > self.max_object_bytes:
+                    await sink.start(resp.status_code, hdrs, "bypass" if method not in ("GET", "HEAD") else "miss")
+                    for b in buf:
+                        await sink.write(b)
+                    buf = None
+            return resp.status_code, hdrs, None if buf is None else b"".join(buf)
+
+    # -------- proxy protocol --------
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+            lines = head.decode("latin-1").split("\r\n")
+            method, target, _version = lines[0].split(" ", 2)
+            headers: Dict[str, str] = {}
+            for line in lines[1:]:
+                if ":" in line:
+                    k, v = line.split(":", 1)
+                    headers[k.strip().lower()] = v.strip()
+            tag = self._tag_of(headers.get("proxy-authorization", ""))
+            if method == "CONNECT":
+                await self._tunnel(target, reader, writer, tag)
+                return
+            if not target.startswith("http://"):
+                await self._respond(writer, 400, [], b"absolute http:// URL required", "")
+                return
+            if headers.get("x-fetch-scheme") == "https":
+                target = "https://" + target[len("http://"):]
+            content = None
+            if "content-length" in headers or "chunked" in headers.get("transfer-encoding", "").lower():
+                content = _request_body(reader, headers)
+                if method in ("GET", "HEAD"):
+                    async for _ in content:  # a body on GET/HEAD has no meaning here; drop it
+                        pass
+                    content = None
+            sink = _Stream(writer, head_only=method == "HEAD")
+            try:
+                status, hdrs, body, result = await self.fetch(method, target, headers, tag, content, sink)
+            except (asyncio.IncompleteReadError, asyncio.CancelledError):
+                raise
+            except Exception as e:
+                self._count(tag, "error")
+                if not sink.started:
+                    await self._respond(writer, 502, [], f"upstream error: {type(e).__name__}".encode(), "error")
+                return
+            if body is not None:
+                await self._respond(writer, status, hdrs, b"" if method == "HEAD" else body, result)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, ConnectionError):
+            pass
+        finally:
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _tag_of(proxy_auth: str) -> str:
+        m = re.match(r"(?i)basic\s+(\S+)", proxy_auth)
+        if not m:
+            return ""
+        try:
+            return unquote(base64.b64decode(m.group(1)).decode("utf-8").split(":", 1)[0])
+        except ValueError:
+            return ""
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, headers: List[Tuple[str, str]], body: bytes, result: str) -> None:
+        writer.write(_head(status, headers, result, len(body)) + body)
+        await writer.drain()
+
+    async def _tunnel(self, target: str, reader, writer, tag: str) -> None:
+        # Opaque HTTPS tunnel for clients that bypass sandbox_fetch_hook (not cached)
+        host, _, port = target.rpartition(":")
+        try:
+            up_r, up_w = await asyncio.wait_for(asyncio.open_connection(host, int(port)), self.upstream_timeout_sec)
+        except (OSError, ValueError, asyncio.TimeoutError):
+            writer.write(b"HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\n\r\n")
+            self._count(tag, "error")
+            return
+        self._count(tag, "tunnel")
+        writer.write(b"HTTP/1.1 200 Connection established\r\n\r\n")
+
+        async def pipe(src, dst):
+            try:
+                while data := await src.read(65536):
+                    dst.write(data)
+                    await dst.drain()
+            except (ConnectionError, asyncio.CancelledError):
+                pass
+            finally:
+                try: dst.close()
+                except Exception: pass
+
+        await asyncio.gather(pipe(reader, up_w), pipe(up_r, writer))
+
+def _head(status: int, headers: List[Tuple[str, str]], result: str, length: Optional[int]) -> bytes:
+    # length None: keep the upstream Content-Length if any, else the body ends at close
+    out = [f"HTTP/1.1 {status} {httpx.codes.get_reason_phrase(status) or 'Status'}"]
+    out += [f"{k}: {v}" for k, v in headers if length is None or k.lower() != "content-length"]
+    if length is not None:
+        out.append(f"Content-Length: {length}")
+    out += [f"X-Cache: {result.upper()}", "Connection: close", "", ""]
+    return "\r\n".join(out).encode("latin-1")
+
+class _Stream:
+    """Proxy client connection an oversized upstream response is written to as it arrives."""
+
+    def __init__(self, writer: asyncio.StreamWriter, head_only: bool = False):
+        self.writer = writer
+        self.head_only = head_only  # HEAD is fetched as GET; the client gets no body
+        self.started = False
+        self.nbytes = 0
+
+    async def start(self, status: int, headers: List[Tuple[str, str]], result: str) -> None:
+        self.started = True
+        self.writer.write(_head(status, headers, result, None))
+
+    async def write(self, chunk: bytes) -> None:
+        self.nbytes += len(chunk)
+        if not self.head_only:
+            self.writer.write(chunk)
+            await self.writer.drain()
+
+def _size(body: Optional[bytes], sink: Optional[_Stream]) -> int:
+    return len(body) if body is not None else (sink.nbytes if sink is not None else 0)
+
+async def _request_body(reader: asyncio.StreamReader, headers: Dict[str, str]) -> AsyncIterator[bytes]:
+    """The proxied request's body (Content-Length or chunked), chunk by chunk."""
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        while True:
+            size = int((await reader.readline()).split(b";")[0].strip() or b"0", 16)
+            if size == 0:
+                while (await reader.readline()).strip():  # trailers
+                    pass
+                return
+            yield await reader.readexactly(size)
+            await reader.readexactly(2)
+    left = int(headers.get("content-length") or 0)
+    while left > 0:
+        chunk = await reader.read(min(left, 65536))
+        if not chunk:
+            raise asyncio.IncompleteReadError(b"", left)
+        left -= len(chunk)
+        yield chunk
+
+_cache: Optional[FetchCache] = None
+
+def get_fetch_cache() -> Optional[FetchCache]:
+    global _cache
+    if not FETCH_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = FetchCache()
+    return _cache
+
+def child_env() -> Dict[str, str]:
+    """Proxy settings for a sandbox child, tagged with the current request; {} when
+    the proxy is not running on this loop."""
+    cache = _cache
+    if cache is None or not cache.running:
+        return {}
+    return cache.child_env(_tag.get())
+
+def pop_request_stats(tag: str) -> Dict[str, int]:
+    return _cache.pop_stats(tag) if _cache is not None else {}
+
+async def startup() -> None:
+    cache = get_fetch_cache()
+    if cache is not None:
+        await cache.start()
+
+async def shutdown() -> None:
+    if _cache is not None:
+        await _cache.close()
@@ -1,10 +1,16 @@
-import re, json, base64
-from typing import Dict, Any, List
+import asyncio, re, json, base64, contextvars, io, math
+from functools import lru_cache
+from typing import Dict, Any, List, Callable, Optional, Tuple
+import metrics
+from config import PNG_RECOMPRESS, PNG_MIN_SIDE_PX
 
 # -------- FormatSpec --------
+# A numbered question starts a line: "1. ...", "  2. ..."
+QUESTION_RE = re.compile(r"^\s*\d+\.\s+", re.M)
+
 def make_format_spec(task_text: str) -> Dict[str, Any]:
     t = task_text.lower()
-    qnums = re.findall(r"^\s*\d+\.\s+", task_text, flags=re.M)
+    qnums = QUESTION_RE.findall(task_text)
     qcount = len(qnums) if qnums else None
 
     wants_json_array = ("json array" in t) or ("respond with a json array" in t)
@@ -28,81 +34,285 @@ def make_format_spec(task_text: str) -> Dict[str, Any]:
     return {"container":"text"}
 
 # -------- Validator & Coercion --------
+# Specs are compiled once into a validator (cached by the spec's canonical JSON):
+# per-element coercers are plain closures, the payload is located with a single
+# raw_decode pass, and PNG data URIs are checked without decoding the image.
 class ValidationError(Exception): ...
+
+_DECODER = json.JSONDecoder()
+_PNG_PREFIX = "data:image/png;base64,"
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
 def _is_data_uri_png(s: str) -> bool:
-    return isinstance(s, str) and s.startswith("data:image/png;base64,")
+    return isinstance(s, str) and s.startswith(_PNG_PREFIX)
+
+# "[" that can open a JSON array: followed by a value start or "]"
+_ARRAY_START = re.compile(r'\[\s*[\[\]{"\-0-9tfn]')
+# Failed decodes are tried on a window first: JSONDecodeError counts the newlines
+# before its position, which would make every junk "[" in a large output O(n).
+_WINDOW = 4096
+_TAIL_TRIES = 32
+_OPENERS = re.compile(r"[\[\s]*")
+
+def _decode_at(s: str, i: int):
+    """(value, end) of the JSON value at s[i]; end is -1 if there is none and -2 if
+    it nests too deeply to decode."""
+    window = s[i:i + _WINDOW]
+    try:
+        value, end = _DECODER.raw_decode(window)
+        return value, i + end
+    except json.JSONDecodeError as e:
+        cut = len(window) < len(s) - i
+        if not (cut and (e.pos >= len(window) - 8 or e.msg.startswith("Unterminated string"))):
+            return None, -1
+    except RecursionError:  # e.g. thousands of unclosed "[": no array here
+        return None, -2
+    except ValueError:
+        return None, -1
+    try:  # may only have failed because the window cut it off
+        return _DECODER.raw_decode(s, i)
+    except RecursionError:
+        return None, -2
+    except ValueError:
+        return None, -1
+
+def find_last_json_array(s: str) -> Optional[list]:
+    """Last top-level JSON array in `s`.
+
+    Fast path: the payload is normally printed last, so first look for an array
+    that ends exactly at the end of the output (a few "[" back from the end).
+    Otherwise one forward pass: each decoded array is skipped as a whole."""
+    t = s.rstrip()
+    if t.endswith("]"):
+        i = len(t)
+        for _ in range(_TAIL_TRIES):
+            i = t.rfind("[", 0, i)
+            if i < 0:
+                break
+            value, end = _decode_at(t, i)
+            if end == len(t):
+                return value
+    found = None
+    m = _ARRAY_START.search(s)
+    while m:
+        value, end = _decode_at(s, m.start())
+        if end == -2:
+            # every "[" of this run nests at least as deep: resume at its last one
+            run_end = _OPENERS.match(s, m.start()).end()
+            m = _ARRAY_START.search(s, max(s.rfind("[", m.start(), run_end), m.start() + 1))
+            continue
+        if end < 0:
+            m = _ARRAY_START.search(s, m.start() + 1)
+            continue
+        found = value
+        m = _ARRAY_START.search(s, end)
+    return found
+
+_BASE64 = re.compile(r"[A-Za-z0-9+/]*={0,2}")
 
-def _coerce_value(v, etype: Dict[str, Any]):
-    t = etype.get("type","string")
-    if t == "string":
-        return str(v)
+def data_uri_png_size(uri: str) -> int:
+    """Decoded byte size of a base64 PNG data URI, computed from its length; raises
+    ValidationError unless the payload is well-formed base64 (checked without
+    decoding it) whose first decoded bytes are the PNG signature."""
+    b64 = uri[len(_PNG_PREFIX):]
+    if any(c in b64 for c in " \t\r\n"):
+        b64 = "".join(b64.split())
+    if len(b64) % 4 or not _BASE64.fullmatch(b64):
+        raise ValidationError("Data URI is not valid base64")
+    try:
+        head = base64.b64decode(b64[:12])
+    except ValueError:
+        head = b""
+    if not head.startswith(_PNG_SIGNATURE):
+        raise ValidationError("Data URI is not a PNG image")
+    pad = len(b64) - len(b64.rstrip("="))
+    return len(b64) * 3 // 4 - pad
+
+def _coercer(etype: Dict[str, Any]) -> Callable[[Any], Any]:
+    t = etype.get("type", "string")
+    if t in ("string", "data_uri_png"):
+        return str
     if t == "int":
-        try: return int(v)
-        except: return 0
+        def to_int(v):
+            try: return int(v)
+            except Exception: return 0
+        return to_int
     if t == "float":
         decimals = etype.get("decimals")
-        try:
-            fv = float(v)
-            if decimals is not None:
-                return round(fv, int(decimals))
-            return fv
-        except:
-            return 0.0 if decimals is None else round(0.0, int(decimals))
+        if decimals is None:
+            def to_float(v):
+                try: return float(v)
+                except Exception: return 0.0
+            return to_float
+        d = int(decimals)
+        def to_rounded(v):
+            try: return round(float(v), d)
+            except Exception: return round(0.0, d)
+        return to_rounded
     if t == "boolean":
-        return bool(v)
-    if t == "data_uri_png":
-        return str(v)
-    return v
+        return bool
+    return lambda v: v
+
+# -------- PNG recompression --------
+# An oversized chart is shrunk in-process before it fails validation (which would
+# cost a whole repair round): lossless re-encode, then a 256/64-colour palette,
+# then progressive downscaling, stopping at the first encoding that fits. This
+# takes seconds for a large image: async callers go through
+# validate_and_coerce_async, which runs it in a worker thread.
+_png_reports: contextvars.ContextVar[Optional[List[Dict[str, Any]]]] = contextvars.ContextVar("png_reports", default=None)
+
+def set_png_sink(sink: List[Dict[str, Any]]) -> contextvars.Token:
+    """Collect a report of every PNG recompressed in this context (the orchestrator logs them)."""
+    return _png_reports.set(sink)
+
+def reset_png_sink(token: contextvars.Token) -> None:
+    _png_reports.reset(token)
+
+def drain_png_reports() -> List[Dict[str, Any]]:
+    sink = _png_reports.get()
+    if not sink:
+        return []
+    out = list(sink)
+    sink.clear()
+    return out
+
+def _encode_png(im) -> bytes:
+    buf = io.BytesIO()
+    im.save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
 
-def validate_and_coerce(stdout_text: str, spec: Dict[str, Any]) -> str:
+def _quantize(im, colors: int):
+    from PIL import Image
+    if im.mode == "RGBA":
+        return im.quantize(colors, method=Image.Quantize.FASTOCTREE)
+    return im.convert("RGB").quantize(colors, method=Image.Quantize.MEDIANCUT)
+
+@lru_cache(maxsize=8)  # hedged candidates / repeated validations may see the same payload
+def shrink_png(uri: str, max_bytes: int) -> Tuple[Optional[str], List[str]]:
+    """(smaller data URI or None, steps tried) for a PNG data URI over max_bytes;
+    counted in PNG_RECOMPRESS once per actual attempt (not on cache hits)."""
+    small, steps = _shrink_png(uri, max_bytes)
+    metrics.PNG_RECOMPRESS.labels("fit" if small else "too_large").inc()
+    return small, steps
+
+def _shrink_png(uri: str, max_bytes: int) -> Tuple[Optional[str], List[str]]:
+    from PIL import Image
+    try:
+        im = Image.open(io.BytesIO(base64.b64decode("".join(uri[len(_PNG_PREFIX):].split()))))
+        im.load()
+    except Exception as e:
+        return None, [f"decode failed: {e}"]
+    if im.mode not in ("RGB", "RGBA", "L", "P"):
+        im = im.convert("RGBA" if "A" in im.getbands() or "transparency" in im.info else "RGB")
+    steps: List[str] = []
+
+    def fits(data: bytes, step: str) -> Optional[str]:
+        steps.append(f"{step}: {len(data)} bytes")
+        return _PNG_PREFIX + base64.b64encode(data).decode("ascii") if len(data) <= max_bytes else None
+
+    data = _encode_png(im)
+    out = fits(data, "optimize")
+    if out:
+        return out, steps
+    palette = im.mode in ("RGB", "RGBA")
+    for colors in ((256, 64) if palette else ()):
+        data = _encode_png(_quantize(im, colors))
+        out = fits(data, f"quantize {colors} colours")
+        if out:
+            return out, steps
+    w, h = im.size
+    for _ in range(8):
+        scale = min(0.9, max(0.5, math.sqrt(max_bytes / len(data)) * 0.95))
+        w, h = int(w * scale), int(h * scale)
+        if min(w, h) < PNG_MIN_SIDE_PX:
+            steps.append(f"stopped: would go below {PNG_MIN_SIDE_PX} px")
+            break
+        small = im.resize((w, h), Image.LANCZOS)
+        data = _encode_png(_quantize(small, 64) if palette else small)
+        out = fits(data, f"downscale to {w}x{h}")
+        if out:
+            return out, steps
+    return None, steps
+
+def _png_check(max_bytes: int, recompress: bool) -> Callable[[Any], str]:
+    def check(v):
+        if not _is_data_uri_png(v):
+            raise ValidationError("Expected PNG data URI")
+        size = data_uri_png_size(v)
+        if size <= max_bytes:
+            return v
+        if not (PNG_RECOMPRESS and recompress):
+            raise ValidationError(f"PNG too large: {size} > {max_bytes}")
+        small, steps = shrink_png(v, max_bytes)
+        sink = _png_reports.get()
+        if sink is not None:
+            sink.append({"bytes": size, "max_bytes": max_bytes, "ok": small is not None,
+                         "final_bytes": data_uri_png_size(small) if small else None, "steps": steps})
+        if small is None:
+            raise ValidationError(f"PNG too large: {size} > {max_bytes} (recompression: {'; '.join(steps[-2:])})")
+        return small
+    return check
+
+@lru_cache(maxsize=256)
+def _compile(spec_key: str, recompress: bool = True) -> Callable[[str], str]:
+    spec = json.loads(spec_key)
     container = spec.get("container", "text")
-    s = stdout_text.strip()
 
     if container == "text":
-        return s if s else "N/A"
-
-    if container == "json_array":
-        m = re.search(r"(\[.*\])", s, flags=re.S)
-        if not m: raise ValidationError("No JSON array found in output")
-        arr_text = m.group(1)
-        try:
-            arr = json.loads(arr_text)
-        except Exception as e:
-            raise ValidationError(f"Invalid JSON array: {e}")
-        if not isinstance(arr, list):
-            raise ValidationError("Not a JSON array")
-
-        target_len = spec.get("length")
+        def validate_text(stdout_text: str) -> str:
+            s = stdout_text.strip()
+            return s if s else "N/A"
+        return validate_text
+
+    if container != "json_array":
+        def unsupported(stdout_text: str) -> str:
+            raise ValidationError(f"Unsupported container: {container}")
+        return unsupported
+
+    target_len = spec.get("length")
+    elems = spec.get("elements") or []
+    coercers = [_coercer(et) for et in elems]
+    checks = [(i, _png_check(et.get("max_bytes", 100000), recompress))
+              for i, et in enumerate(elems) if et.get("type") == "data_uri_png"]
+
+    def validate_array(stdout_text: str) -> str:
+        arr = find_last_json_array(stdout_text)
+        if arr is None:
+            raise ValidationError("No JSON array found in output")
         if target_len is not None and len(arr) != target_len:
             if len(arr) > target_len:
                 arr = arr[:target_len]
             else:
                 arr.extend(["N/A"] * (target_len - len(arr)))
-
-        elems = spec.get("elements") or []
-        if elems and len(arr) == len(elems):
-            out = []
-            for v, et in zip(arr, elems):
-                out.append(_coerce_value(v, et))
-            arr = out
-
-        for i, et in enumerate(spec.get("elements") or []):
-            if et.get("type") == "data_uri_png":
-                if not _is_data_uri_png(arr[i]):
-                    raise ValidationError("Expected PNG data URI")
-                raw = base64.b64decode(arr[i].split(",",1)[1])
-                maxb = et.get("max_bytes", 100000)
-                if len(raw) > maxb:
-                    raise ValidationError(f"PNG too large: {len(raw)} > {maxb}")
+        if coercers and len(arr) == len(coercers):
+            arr = [f(v) for f, v in zip(coercers, arr)]
+        for i, check in checks:
+            arr[i] = check(arr[i])
         return json.dumps(arr, ensure_ascii=False)
+    return validate_array
 
-    raise ValidationError(f"Unsupported container: {container}")
+def compile_spec(spec: Dict[str, Any], recompress: bool = True) -> Callable[[str], str]:
+    return _compile(json.dumps(spec, sort_keys=True), recompress)
 
-# -------- Dummy Answer --------
-from PIL import Image
-import io
+def validate_and_coerce(stdout_text: str, spec: Dict[str, Any], recompress: bool = True) -> str:
+    """recompress=False rejects an oversized PNG instead of shrinking it (cheap checks,
+    e.g. the early-completion predicate that runs inside the output pump)."""
+    return compile_spec(spec, recompress)(stdout_text)
+
+def _may_recompress(spec: Dict[str, Any]) -> bool:
+    return PNG_RECOMPRESS and any(et.get("type") == "data_uri_png" for et in spec.get("elements") or [])
 
+async def validate_and_coerce_async(stdout_text: str, spec: Dict[str, Any]) -> str:
+    """validate_and_coerce off the event loop when it may have to recompress a PNG
+    (the worker thread shares this context, so PNG reports reach the caller's sink)."""
+    if not _may_recompress(spec):
+        return validate_and_coerce(stdout_text, spec)
+    return await asyncio.to_thread(validate_and_coerce, stdout_text, spec)
+
+# -------- Dummy Answer --------
+@lru_cache(maxsize=1)
 def _tiny_png_data_uri() -> str:
+    from PIL import Image  # only the fallback path needs Pillow
     im = Image.new("RGBA", (1,1), (0,0,0,0))
     buf = io.BytesIO()
     im.save(buf, format="PNG", optimize=True)
@@ -130,3 +340,7 @@ def make_dummy_answer(spec: Dict[str, Any]) -> str:
             else: out.append("N/A")
         return json.dumps(out, ensure_ascii=False)
     return "N/A"
+
+def prewarm() -> None:
+    """Startup hook: build the dummy PNG payload ahead of the first fallback."""
+    _tiny_png_data_uri()
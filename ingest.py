@@ -0,0 +1,119 @@
+# ingest.py
+# Attachment pre-ingestion. Tabular attachments (CSV/TSV, Excel, JSON/JSONL) are
+# parsed once, inside the sandbox (the warm zygotes already have pandas loaded),
+# and written to ./ingested as Parquet (pickle when pyarrow is not installed);
+# ./attachments keeps only the uploaded originals. The script also reports columns/dtypes/row counts and a few sample
+# rows, which are rendered into the compact DATA SUMMARY given to the planner
+# and the code generator.
+import json, os
+from typing import Any, Dict, List, Tuple
+from executor_b64 import run_user_code
+from config import INGEST_SAMPLE_ROWS, INGEST_MAX_FILE_BYTES, INGEST_SUMMARY_MAX_CHARS
+
+INGEST_DIR = "ingested"
+TABULAR_EXT = {".csv", ".tsv", ".xlsx", ".xls", ".json", ".jsonl", ".ndjson"}
+
+INGEST_SCRIPT = r'''
+import importlib.util, json, os, sys
+import pandas as pd
+
+SRC, DST = "attachments", "__DIR__"
+SAMPLE_ROWS, MAX_BYTES, EXTS = __SAMPLE_ROWS__, __MAX_BYTES__, set(__EXTS__)
+FMT = "parquet" if importlib.util.find_spec("pyarrow") else "pickle"
+
+def frames(path, ext):
+    if ext == ".csv":
+        yield "", pd.read_csv(path, low_memory=False)
+    elif ext == ".tsv":
+        yield "", pd.read_csv(path, sep="\t", low_memory=False)
+    elif ext in (".xlsx", ".xls"):
+        for sheet, df in pd.read_excel(path, sheet_name=None).items():
+            yield str(sheet), df
+    elif ext in (".jsonl", ".ndjson"):
+        yield "", pd.read_json(path, lines=True)
+    elif ext == ".json":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        yield "", pd.json_normalize(data) if isinstance(data, list) else pd.DataFrame(data)
+
+def save(df, out):
+    df.columns = [str(c) for c in df.columns]
+    if FMT == "parquet":
+        try:
+            df.to_parquet(out + ".parquet", index=False)
+            return out + ".parquet", "pd.read_parquet"
+        except Exception:
+            pass
+    df.to_pickle(out + ".pkl")
+    return out + ".pkl", "pd.read_pickle"
+
+report = []
+os.makedirs(DST, exist_ok=True)
+for name in sorted(os.listdir(SRC)):
+    path = os.path.join(SRC, name)
+    ext = os.path.splitext(name)[1]
+    if not os.path.isfile(path) or ext.lower() not in EXTS:
+        continue
+    if os.path.getsize(path) > MAX_BYTES:
+        report.append({"source": path, "error": "too large to pre-ingest"})
+        continue
+    try:
+        for sheet, df in frames(path, ext.lower()):
+            if not isinstance(df, pd.DataFrame) or (df.empty and not len(df.columns)):
+                continue
+            # keep the extension: data.csv and data.xlsx must not share an output file
+            out, loader = save(df, os.path.join(DST, name + ("__" + sheet if sheet else "")))
+            sample = df.head(SAMPLE_ROWS).astype(str).to_dict(orient="records")
+            report.append({
+                "source": path, "sheet": sheet, "path": out, "loader": loader,
+                "rows": int(len(df)), "columns": [[str(c), str(t)] for c, t in df.dtypes.items()],
+                "sample": sample,
+            })
+    except Exception as e:
+        report.append({"source": path, "error": f"{type(e).__name__}: {e}"[:200]})
+print(json.dumps(report))
+'''
+
+def tabular_attachments(attachments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [a for a in attachments
+            if os.path.splitext(a.get("filename") or "")[1].lower() in TABULAR_EXT]
+
+def _script() -> str:
+    return (INGEST_SCRIPT.replace("__DIR__", INGEST_DIR)
+            .replace("__SAMPLE_ROWS__", str(INGEST_SAMPLE_ROWS))
+            .replace("__MAX_BYTES__", str(INGEST_MAX_FILE_BYTES))
+            .replace("__EXTS__", json.dumps(sorted(TABULAR_EXT))))
+
+def _clip(v: str, n: int = 40) -> str:
+    return v if len(v) <= n else v[:n - 1] + "…"
+
+def render_summary(report: List[Dict[str, Any]], max_chars: int = INGEST_SUMMARY_MAX_CHARS) -> str:
+    lines: List[str] = []
+    for r in report:
+        if "error" in r:
+            lines.append(f"- {r['source']}: not pre-ingested ({r['error']})")
+            continue
+        sheet = f" [sheet {r['sheet']}]" if r.get("sheet") else ""
+        lines.append(f"- {r['source']}{sheet}: {r['rows']} rows x {len(r['columns'])} cols; "
+                     f"fast copy: {r['loader']}(\"{r['path']}\")")
+        lines.append("  columns: " + ", ".join(f"{_clip(c, 30)}:{t}" for c, t in r["columns"]))
+        for row in r.get("sample") or []:
+            lines.append("  sample: " + json.dumps({_clip(k, 30): _clip(v) for k, v in row.items()}, ensure_ascii=False))
+    text = "\n".join(lines)
+    if len(text) > max_chars:
+        text = text[:max_chars].rsplit("\n", 1)[0] + "\n- (summary truncated)"
+    return text
+
+async def ingest_attachments(job_dir: str, attachments: List[Dict[str, Any]], timeout: float) -> Tuple[str, List[Dict[str, Any]]]:
+    """Convert tabular attachments in job_dir/attachments to job_dir/ingested; returns (summary text, report).
+    Empty summary when there is nothing tabular or ingestion failed."""
+    if not tabular_attachments(attachments):
+        return "", []
+    ok, stdout, stderr = await run_user_code(_script(), cwd=job_dir, timeout=timeout)
+    if not ok:
+        return "", [{"source": "attachments", "error": (stderr or "ingestion failed").strip()[-200:]}]
+    try:
+        report = json.loads(stdout.strip().splitlines()[-1])
+    except (ValueError, IndexError):
+        return "", []
+    return render_summary(report), report
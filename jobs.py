@@ -0,0 +1,284 @@
+# jobs.py
+# Job engine behind both HTTP contracts. A job runs handle_request in its own task,
+# so it survives the submitting connection; POST /api/ simply waits for it and
+# discards the job once the response is delivered (its result is only kept if the
+# connection dropped). Phase
+# log entries are mirrored into the job as progress events (GET /jobs/{id}/events
+# streams them as SSE), and finished jobs stay readable until their TTL runs out
+# or JOBS_MAX_RESULTS newer ones push them out. With a JobRegistry (SQLite, shared
+# by all worker processes) every state change is also written through, so any
+# worker can answer status and event requests for any job.
+import asyncio, json, os, shutil, time, uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+import metrics
+from orchestrator import handle_request
+from storage.job_registry import JobRegistry, process_token
+from config import (
+    JOBS_MAX_RESULTS, JOBS_RESULT_TTL_SEC, JOBS_MAX_EVENTS, JOBS_SSE_KEEPALIVE_SEC, JOBS_POLL_SEC,
+    JOB_REGISTRY_PATH, SHUTDOWN_GRACE_SEC,
+)
+
+# entry fields copied into progress events (the rest stays in the log store)
+EVENT_FIELDS = ("phase", "for", "q", "attempt", "ok", "result", "cached", "hit", "sec", "budget", "tokens", "error")
+
+class Job:
+    def __init__(self, job_id: str):
+        self.id = job_id
+        self.status = "queued"  # queued | running | done | failed
+        self.req_id: Optional[str] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.result: Optional[str] = None
+        self.error: Optional[str] = None
+        self.events: List[Dict[str, Any]] = []  # last JOBS_MAX_EVENTS, numbered by seq
+        self.seq = 0
+        self.task: Optional[asyncio.Task] = None
+        self.on_event: Optional[Callable[["Job", Dict[str, Any]], None]] = None
+        self._changed = asyncio.Event()
+        self._done = asyncio.Event()
+
+    def add_event(self, event: Dict[str, Any]) -> None:
+        self.seq += 1
+        if len(self.events) >= JOBS_MAX_EVENTS:
+            self.events.pop(0)
+        self.events.append({"seq": self.seq, **event})
+        if self.on_event is not None:
+            self.on_event(self, self.events[-1])
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _finish(self, status: str, result: Optional[str] = None, error: Optional[str] = None) -> None:
+        self.status = status
+        self.result = result
+        self.error = error
+        self.finished = time.time()
+        self._done.set()
+        self._notify()
+
+    async def wait(self) -> str:
+        """Result of the job; raises RuntimeError if it failed."""
+        await self._done.wait()
+        if self.status != "done":
+            raise RuntimeError(self.error or "job failed")
+        return self.result
+
+    def view(self) -> Dict[str, Any]:
+        out = {"id": self.id, "status": self.status, "req_id": self.req_id, "created": round(self.created, 3),
+               "started": self.started and round(self.started, 3), "finished": self.finished and round(self.finished, 3),
+               "phase": self.events[-1]["phase"] if self.events else None}
+        if self.status == "done":
+            out["result"] = self.result
+        elif self.status == "failed":
+            out["error"] = self.error
+        return out
+
+    async def stream(self, after: int = 0, keepalive_sec: float = JOBS_SSE_KEEPALIVE_SEC) -> AsyncIterator[str]:
+        """Server-sent events: progress events with seq > after (replayed, then live),
+        then a final "done" or "failed" event carrying view()."""
+        while True:
+            changed = self._changed
+            for event in [e for e in self.events if e["seq"] > after]:
+                yield _sse_progress(event)
+                after = event["seq"]
+            if self._done.is_set():
+                yield _sse_final(self.view())
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=keepalive_sec)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+
+def _sse_progress(event: Dict[str, Any]) -> str:
+    return f"id: {event['seq']}\nevent: progress\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+def _sse_final(view: Dict[str, Any]) -> str:
+    return f"event: {view['status']}\ndata: {json.dumps(view, ensure_ascii=False)}\n\n"
+
+def _row_view(row: Dict[str, Any]) -> Dict[str, Any]:
+    out = {k: row[k] for k in ("id", "status", "req_id", "created", "started", "finished", "phase")}
+    if row["status"] == "done":
+        out["result"] = row["result"]
+    elif row["status"] == "failed":
+        out["error"] = row["error"]
+    return out
+
+class ProgressLogger:
+    """Log-store proxy that also turns saved entries into progress events of a job."""
+
+    def __init__(self, inner, job: Job):
+        self.inner = inner
+        self.job = job
+
+    async def init(self) -> None:
+        await self.inner.init()
+
+    async def save(self, req_id: str, entry: Dict[str, Any]) -> None:
+        self.job.req_id = req_id
+        self.job.add_event({"ts": round(time.time(), 3), **{k: entry[k] for k in EVENT_FIELDS if k in entry}})
+        await self.inner.save(req_id, entry)
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+class JobStore:
+    def __init__(self, max_results: int = JOBS_MAX_RESULTS, ttl_sec: float = JOBS_RESULT_TTL_SEC,
+                 registry: Optional[JobRegistry] = None):
+        self.max_results = max_results
+        self.ttl_sec = ttl_sec
+        self.registry = registry
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        # one writer thread keeps registry updates in order (events before the final status)
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix="job-registry") if registry is not None else None
+        self._worker: Tuple[int, Optional[str]] = (0, None)  # (pid, process_token), per process
+
+    # -------- registry write-through (best effort, never blocks a request) --------
+    def _persist(self, fn, *args) -> None:
+        if self._writer is None:
+            return
+        fut = asyncio.get_running_loop().run_in_executor(self._writer, fn, *args)
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    def _put(self, job: Job) -> None:
+        if self.registry is not None:
+            if self._worker[0] != os.getpid():
+                self._worker = (os.getpid(), process_token(os.getpid()))
+            pid, token = self._worker
+            self._persist(self.registry.put, {**job.view(), "worker": pid, "worker_token": token})
+
+    def _on_event(self, job: Job, event: Dict[str, Any]) -> None:
+        if self.registry is not None:
+            self._persist(self.registry.add_event, job.id, {**event, "req_id": job.req_id})
+
+    async def start(self) -> None:
+        if self.registry is not None:
+            await asyncio.to_thread(self.registry.fail_orphans)
+
+    # -------- jobs --------
+    def submit(self, task_text: str, attachments: List[Dict[str, Any]], job_dir: str, logger) -> Job:
+        """Start handle_request in the background; the job owns (and finally removes) job_dir."""
+        self.expire()
+        job = Job(uuid.uuid4().hex)
+        job.on_event = self._on_event
+        self._jobs[job.id] = job
+        self._put(job)
+        job.task = asyncio.get_running_loop().create_task(self._run(job, task_text, attachments, job_dir, logger))
+        return job
+
+    async def _run(self, job: Job, task_text, attachments, job_dir, logger) -> None:
+        job.status = "running"
+        job.started = time.time()
+        self._put(job)
+        metrics.JOBS_ACTIVE.inc()
+        try:
+            result = await handle_request(task_text, attachments, job_dir, ProgressLogger(logger, job))
+            job._finish("done", result=result)
+        except asyncio.CancelledError:
+            job._finish("failed", error="cancelled")
+            raise
+        except Exception as e:
+            job._finish("failed", error=f"failure: {e}")
+        finally:
+            metrics.JOBS_ACTIVE.dec()
+            shutil.rmtree(job_dir, ignore_errors=True)
+            self._put(job)
+            self.expire()
+            if self.registry is not None:
+                self._persist(self.registry.expire, self.ttl_sec, self.max_results, JOBS_MAX_EVENTS)
+
+    async def discard(self, job_id: str) -> None:
+        """Forget a job whose result has been delivered, here and in the registry."""
+        self._jobs.pop(job_id, None)
+        if self._writer is not None:  # after the job's queued writes, on the writer thread
+            await asyncio.get_running_loop().run_in_executor(self._writer, self.registry.delete, job_id)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """A job started by this process."""
+        self.expire()
+        return self._jobs.get(job_id)
+
+    async def view(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Status of a job started by any worker."""
+        job = self.get(job_id)
+        if job is not None:
+            return job.view()
+        if self.registry is None:
+            return None
+        row = await asyncio.to_thread(self.registry.get, job_id)
+        return _row_view(row) if row else None
+
+    async def stream(self, job_id: str, after: int = 0) -> Optional[AsyncIterator[str]]:
+        """SSE stream for a job started by any worker (None if unknown)."""
+        job = self.get(job_id)
+        if job is not None:
+            return job.stream(after)
+        if self.registry is None or await asyncio.to_thread(self.registry.get, job_id) is None:
+            return None
+        return self._poll(job_id, after)
+
+    async def _poll(self, job_id: str, after: int, keepalive_sec: float = JOBS_SSE_KEEPALIVE_SEC) -> AsyncIterator[str]:
+        # another worker runs the job: follow it through the registry
+        beat = time.monotonic()
+        while True:
+            row = await asyncio.to_thread(self.registry.get, job_id)
+            for event in await asyncio.to_thread(self.registry.events, job_id, after):
+                yield _sse_progress(event)
+                after = event["seq"]
+                beat = time.monotonic()
+            if row is None or row["finished"] is not None:
+                yield _sse_final(_row_view(row) if row else {"id": job_id, "status": "failed", "error": "expired"})
+                return
+            if time.monotonic() - beat >= keepalive_sec:
+                yield ": keepalive\n\n"
+                beat = time.monotonic()
+            await asyncio.sleep(JOBS_POLL_SEC)
+
+    def expire(self) -> None:
+        now = time.time()
+        finished = [j for j in self._jobs.values() if j.finished is not None]
+        for job in finished:
+            if now - job.finished > self.ttl_sec:
+                self._jobs.pop(job.id, None)
+        finished = [j for j in self._jobs.values() if j.finished is not None]
+        for job in finished[:max(len(finished) - self.max_results, 0)]:
+            self._jobs.pop(job.id, None)
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    async def close(self, grace_sec: float = SHUTDOWN_GRACE_SEC) -> None:
+        """Drain: let running jobs finish for up to grace_sec, then cancel the rest
+        (which kills their sandboxes) and flush the registry writer."""
+        tasks = [j.task for j in self._jobs.values() if j.task is not None and not j.task.done()]
+        if tasks:
+            _done, pending = await asyncio.wait(tasks, timeout=grace_sec)
+            for t in pending:
+                t.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        if self._writer is not None:
+            writer, self._writer = self._writer, None
+            await asyncio.to_thread(writer.shutdown, True)
+
+_store: Optional[JobStore] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_registry: Optional[JobRegistry] = None
+
+def get_registry() -> Optional[JobRegistry]:
+    global _registry
+    if _registry is None and JOB_REGISTRY_PATH:
+        _registry = JobRegistry(JOB_REGISTRY_PATH)
+    return _registry
+
+def get_job_store() -> JobStore:
+    global _store, _loop
+    loop = asyncio.get_running_loop()
+    if _store is None or _loop is not loop:
+        _store = JobStore(registry=get_registry())
+        _loop = loop
+    return _store
@@ -1,21 +1,112 @@
-from openai import OpenAI
-from string import Template
-from typing import Dict, Any, Optional
-import os, json
-from config import OPENAI_API_KEY, FAST_MODEL, REASONING_MODEL, CODEGEN_MODEL
-
-_client = None
-def client() -> OpenAI:
-    global _client
-    if _client is None:
-        _client = OpenAI(api_key=OPENAI_API_KEY)
+from typing import TYPE_CHECKING, Dict, Any, Optional, Union
+import json, asyncio, random, time
+import httpx
+import metrics
+from scheduler import get_scheduler
+from prompt_builder import build as build_prompt
+from config import (
+    OPENAI_API_KEY, OPENAI_BASE_URL, FAST_MODEL, REASONING_MODEL, CODEGEN_MODEL,
+    LLM_MAX_CONNECTIONS, LLM_MAX_RETRIES,
+    LLM_BACKOFF_BASE_SEC, LLM_BACKOFF_MAX_SEC, LLM_CONNECT_TIMEOUT_SEC, LLM_REQUEST_TIMEOUT_SEC,
+)
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+# One AsyncOpenAI (and its httpx connection pool) per event loop; in-flight calls
+# are capped by the scheduler's EDF "llm" limiter. Retries are ours, so the SDK's are disabled.
+# The SDK is imported on first use: it is the slowest import of the app.
+_client: Optional["AsyncOpenAI"] = None
+_http: Optional[httpx.AsyncClient] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+_retiring: set = set()  # close() tasks of clients left behind by a previous loop
+
+async def _quiet_close(c: "AsyncOpenAI") -> None:
+    try:
+        await c.close()
+    except Exception:
+        pass
+
+def _retire(c: "AsyncOpenAI", old: Optional[asyncio.AbstractEventLoop], loop: asyncio.AbstractEventLoop) -> None:
+    # Close the previous loop's client (pool + sockets) on that loop while it still
+    # runs, otherwise here; either way in the background.
+    if old is not None and old.is_running():
+        asyncio.run_coroutine_threadsafe(_quiet_close(c), old)
+        return
+    task = loop.create_task(_quiet_close(c))
+    _retiring.add(task)
+    task.add_done_callback(_retiring.discard)
+
+def client() -> "AsyncOpenAI":
+    global _client, _http, _loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _loop is not loop:
+        from openai import AsyncOpenAI
+        if _client is not None:
+            _retire(_client, _loop, loop)
+        http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS),
+            timeout=httpx.Timeout(LLM_REQUEST_TIMEOUT_SEC, connect=LLM_CONNECT_TIMEOUT_SEC),
+        )
+        _client = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, http_client=http, max_retries=0)
+        _http = http
+        _loop = loop
     return _client
 
-PROMPTS_DIR = os.path.join(os.path.dirname(__file__), "prompts")
+async def prewarm() -> None:
+    """Startup hook: import the SDK and open a pooled connection (TCP + TLS) to the
+    API host, so the first request doesn't pay for either. Any HTTP status will do."""
+    c = client()
+    await _http.head(str(c.base_url), timeout=LLM_CONNECT_TIMEOUT_SEC)
+
+async def aclose() -> None:
+    global _client, _http, _loop
+    if _client is not None:
+        try:
+            await _client.close()
+        except Exception:
+            pass
+    _client, _http, _loop = None, None, None
+
+def _retry_delay(attempt: int, err: Exception) -> float:
+    resp = getattr(err, "response", None)
+    retry_after = resp.headers.get("retry-after") if resp is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), LLM_BACKOFF_MAX_SEC)
+        except ValueError:
+            pass
+    # full jitter
+    return random.uniform(0, min(LLM_BACKOFF_MAX_SEC, LLM_BACKOFF_BASE_SEC * (2 ** attempt)))
 
-def _load_prompt(name: str) -> Template:
-    with open(os.path.join(PROMPTS_DIR, name), "r", encoding="utf-8") as f:
-        return Template(f.read())
+def _retryable(err: Exception) -> bool:
+    import openai
+    if isinstance(err, openai.APIStatusError):
+        return err.status_code == 429 or err.status_code >= 500
+    return isinstance(err, openai.APIConnectionError)
+
+async def _create(**kwargs):
+    """responses.create with the EDF in-flight cap and jittered retry on 429/5xx/connection errors.
+    Cancellation (e.g. asyncio.wait_for on a phase deadline) aborts the HTTP request."""
+    c = client()
+    model = kwargs.get("model", "")
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            async with get_scheduler().llm.slot():
+                t0 = time.monotonic()
+                try:
+                    resp = await c.responses.create(**kwargs)
+                except BaseException as e:
+                    status = getattr(e, "status_code", None)
+                    metrics.observe_llm(model, time.monotonic() - t0, str(status) if status else type(e).__name__)
+                    raise
+                metrics.observe_llm(model, time.monotonic() - t0, "ok", getattr(resp, "usage", None))
+                return resp
+        except Exception as e:
+            if attempt >= LLM_MAX_RETRIES or not _retryable(e):
+                raise
+            await asyncio.sleep(_retry_delay(attempt, e))
 
 def _strip_code(text: str) -> str:
     t = text.strip()
@@ -26,29 +117,43 @@ def _strip_code(text: str) -> str:
         return parts[-1].strip()
     return t
 
-async def plan_task(task_text: str, spec: Dict[str, Any]) -> Dict[str, Any]:
-    tpl = _load_prompt("plan_prompt.txt")
-    prompt = tpl.substitute(task_text=task_text, spec_json=json.dumps(spec, ensure_ascii=False))
-    resp = client().responses.create(model=FAST_MODEL, input=prompt, max_output_tokens=700)
+async def plan_task(task_text: str, spec: Dict[str, Any], data_summary: str = "") -> Dict[str, Any]:
+    prompt = build_prompt("plan_prompt.txt", FAST_MODEL, task_text=task_text,
+                          spec_json=json.dumps(spec, ensure_ascii=False), data_summary=data_summary or "(none)")
+    resp = await _create(model=FAST_MODEL, input=prompt.text, max_output_tokens=700)
     txt = resp.output_text or "{}"
     try:
         return json.loads(txt)
     except Exception:
         return {"inputs": {}, "steps": [], "assumptions": []}
 
-async def generate_code(task_text: str, spec: Dict[str, Any], plan: Dict[str, Any], repair_context: Optional[str] = None) -> str:
-    tpl = _load_prompt("code_prompt.txt")
-    prompt = tpl.substitute(
+async def generate_code(task_text: str, spec: Dict[str, Any], plan: Dict[str, Any],
+                        repair_context: Optional[Union[str, Dict[str, str]]] = None,
+                        model: Optional[str] = None, temperature: Optional[float] = None, data_summary: str = "") -> str:
+    """repair_context is free text or sections such as {"stdout": ..., "stderr": ...};
+    sections are cut independently to fit the model's prompt budget."""
+    model = model or CODEGEN_MODEL
+    prompt = build_prompt(
+        "code_prompt.txt", model,
         task_text=task_text,
         spec_json=json.dumps(spec, ensure_ascii=False),
         plan_json=json.dumps(plan, ensure_ascii=False),
+        data_summary=data_summary or "(none)",
         repair_context=repair_context or ""
     )
-    resp = client().responses.create(model=CODEGEN_MODEL, input=prompt, max_output_tokens=2200)
+    extra = {} if temperature is None else {"temperature": temperature}
+    resp = await _create(model=model, input=prompt.text, max_output_tokens=2200, **extra)
+    return _strip_code(resp.output_text or "")
+
+async def generate_loader(task_text: str, plan: Dict[str, Any], data_summary: str = "") -> str:
+    """Shared data-loading script for per-question decomposition: saves datasets
+    under ./shared/ and prints a JSON array describing them."""
+    prompt = build_prompt("loader_prompt.txt", CODEGEN_MODEL, task_text=task_text,
+                          plan_json=json.dumps(plan, ensure_ascii=False), data_summary=data_summary or "(none)")
+    resp = await _create(model=CODEGEN_MODEL, input=prompt.text, max_output_tokens=2200)
     return _strip_code(resp.output_text or "")
 
 async def compose_answer(context: str, spec: Dict[str, Any]) -> str:
-    tpl = _load_prompt("answer_prompt.txt")
-    prompt = tpl.substitute(context=context, spec_json=json.dumps(spec, ensure_ascii=False))
-    resp = client().responses.create(model=REASONING_MODEL, input=prompt, max_output_tokens=1200)
+    prompt = build_prompt("answer_prompt.txt", REASONING_MODEL, context=context, spec_json=json.dumps(spec, ensure_ascii=False))
+    resp = await _create(model=REASONING_MODEL, input=prompt.text, max_output_tokens=1200)
     return resp.output_text or context
@@ -0,0 +1,135 @@
+# metrics.py
+# Prometheus instrumentation: per-phase wall time, LLM latency/tokens per model, prompt sizes,
+# sandbox CPU/peak RSS/spawn overhead, fetch cache results, scheduler queues, and
+# in-flight gauges. Exposed on /metrics. With PROMETHEUS_MULTIPROC_DIR set (serve.py
+# does this for WORKERS>1) every worker writes its samples there and /metrics
+# aggregates all of them; gauges are summed over live processes.
+import os, time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import multiprocess
+
+_SEC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 90, 120, 180, 300)
+
+PHASE_SECONDS = Histogram(
+    "tds_phase_seconds", "Wall time of each handle_request phase",
+    ["phase", "outcome"], buckets=_SEC_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "tds_request_seconds", "End-to-end handle_request wall time",
+    ["result"], buckets=_SEC_BUCKETS,
+)
+FALLBACKS = Counter("tds_fallback_dummy_total", "Requests answered with make_dummy_answer")
+REQUESTS_INFLIGHT = Gauge("tds_requests_inflight", "Requests currently in handle_request", multiprocess_mode="livesum")
+JOBS_ACTIVE = Gauge("tds_jobs_active", "Jobs (sync or async) currently running", multiprocess_mode="livesum")
+
+LLM_SECONDS = Histogram(
+    "tds_llm_request_seconds", "Latency of one Responses API call (per attempt)",
+    ["model", "outcome"], buckets=_SEC_BUCKETS,
+)
+LLM_TOKENS = Counter("tds_llm_tokens_total", "LLM token usage", ["model", "kind"])
+
+PROMPT_TOKENS = Histogram(
+    "tds_prompt_tokens", "Tokens in an assembled prompt (tiktoken or estimate)",
+    ["prompt"], buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000),
+)
+PROMPT_SECTIONS_CUT = Counter("tds_prompt_sections_cut_total", "Prompt sections cut to fit the token budget", ["section"])
+PNG_RECOMPRESS = Counter("tds_png_recompress_total", "Oversized PNG answers recompressed by the validator", ["result"])
+DECOMPOSE_SLOTS = Counter(
+    "tds_decompose_slots_total", "Questions of decomposed tasks by outcome (ok, repaired, dummy)", ["result"],
+)
+
+SANDBOXES_ACTIVE = Gauge(
+    "tds_sandboxes_active", "Sandboxed user-code processes currently running", multiprocess_mode="livesum",
+)
+SANDBOX_SPAWN_SECONDS = Histogram(
+    "tds_sandbox_spawn_seconds", "Time from run_user_code to a running child process",
+    ["path"], buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+SANDBOX_CPU_SECONDS = Histogram(
+    "tds_sandbox_cpu_seconds", "User+system CPU time of a sandboxed run",
+    ["path"], buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+SANDBOX_PEAK_RSS = Histogram(
+    "tds_sandbox_peak_rss_bytes", "Peak RSS of a sandboxed run",
+    ["path"], buckets=tuple(m * 1024 * 1024 for m in (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)),
+)
+SANDBOX_EXITS = Counter(
+    "tds_sandbox_exit_total", "Sandbox runs by exit reason (ok, error, timeout, oom, *_limit, ...)", ["reason"],
+)
+SANDBOX_OUTPUT_TRUNCATED = Counter(
+    "tds_sandbox_output_truncated_total", "Sandbox runs whose captured output hit its byte cap", ["stream"],
+)
+SANDBOX_EARLY_EXITS = Counter(
+    "tds_sandbox_early_exit_total", "Sandbox runs returned early once stdout held a valid payload",
+)
+
+FETCH_CACHE = Counter(
+    "tds_fetch_cache_total", "Sandbox HTTP fetches through the caching proxy", ["result"],
+)
+
+QUEUE_DEPTH = Gauge("tds_queue_depth", "Jobs waiting for a scheduler slot", ["resource"], multiprocess_mode="livesum")
+SLOTS_IN_USE = Gauge("tds_slots_in_use", "Scheduler slots currently held", ["resource"], multiprocess_mode="livesum")
+QUEUE_WAIT_SECONDS = Histogram(
+    "tds_queue_wait_seconds", "Time spent waiting for a scheduler slot",
+    ["resource"], buckets=(0,) + _SEC_BUCKETS,
+)
+ADMISSION_REJECTED = Counter(
+    "tds_admission_rejected_total", "Requests answered early because the remaining budget was too small",
+)
+
+class PhaseTimer:
+    __slots__ = ("phase", "start", "sec", "outcome")
+
+    def __init__(self, phase: str):
+        self.phase = phase
+        self.start = time.monotonic()
+        self.sec = 0.0
+        self.outcome = "ok"
+
+@contextmanager
+def phase_timer(phase: str) -> Iterator[PhaseTimer]:
+    """Time a phase; outcome is "error" if the block raises (incl. timeouts/cancellation)
+    unless the block set pt.outcome itself. pt.sec is rounded for log entries."""
+    pt = PhaseTimer(phase)
+    try:
+        yield pt
+    except BaseException:
+        pt.outcome = "error"
+        raise
+    finally:
+        elapsed = time.monotonic() - pt.start
+        pt.sec = round(elapsed, 3)
+        PHASE_SECONDS.labels(phase, pt.outcome).observe(elapsed)
+
+def observe_llm(model: str, seconds: float, outcome: str, usage=None) -> None:
+    LLM_SECONDS.labels(model, outcome).observe(seconds)
+    if usage is None:
+        return
+    for kind in ("input_tokens", "output_tokens"):
+        n = getattr(usage, kind, None)
+        if n:
+            LLM_TOKENS.labels(model, kind.split("_")[0]).inc(n)
+    details = getattr(usage, "output_tokens_details", None)
+    reasoning = getattr(details, "reasoning_tokens", None) if details is not None else None
+    if reasoning:
+        LLM_TOKENS.labels(model, "reasoning").inc(reasoning)
+
+def observe_sandbox(path: str, cpu_sec: Optional[float], peak_rss: Optional[int]) -> None:
+    if cpu_sec is not None:
+        SANDBOX_CPU_SECONDS.labels(path).observe(cpu_sec)
+    if peak_rss:
+        SANDBOX_PEAK_RSS.labels(path).observe(peak_rss)
+
+def render() -> bytes:
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest()
+
+def mark_process_dead() -> None:
+    """Drop this worker's live gauges from the shared metrics dir (on shutdown)."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(os.getpid())
@@ -1,93 +1,482 @@
 #############################################
 
 import asyncio, os, time, json, uuid, tempfile, shutil
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from config import (
     TOTAL_DEADLINE_SEC, CLIENT_RESPOND_SEC,
-    PLAN_SEC, CODEGEN1_SEC, RUN1_SEC, REPAIR_CODEGEN_SEC, REPAIR_RUN_SEC
+    CODEGEN_MODEL, HEDGE_K, HEDGE_DELAY_SEC, HEDGE_MODELS, HEDGE_TEMPERATURES, ADMISSION_CONTROL,
+    SANDBOX_EARLY_COMPLETE, INGEST_ENABLED, INGEST_SEC, SANDBOX_PROFILE, SANDBOX_PROFILE_TOP,
+    DECOMPOSE, DECOMPOSE_RESERVE_SEC,
 )
-from llm_client import plan_task, generate_code, compose_answer
+from llm_client import plan_task, generate_code, generate_loader, compose_answer
 from executor_b64 import run_user_code
-from format_handler import make_format_spec, validate_and_coerce, ValidationError, make_dummy_answer
+from sandbox_limits import usage_of, describe, job_limits
+from format_handler import (
+    make_format_spec, validate_and_coerce, validate_and_coerce_async, ValidationError, make_dummy_answer,
+    set_png_sink, reset_png_sink, drain_png_reports,
+)
+from result_cache import get_cache, reuse_levels, cache_key
+from storage.artifact_store import get_artifact_store
+from scheduler import get_scheduler, set_deadline, reset_deadline
+from budget import get_allocator, ObservingLogger
+from ingest import ingest_attachments, tabular_attachments, INGEST_DIR
+from uploads import _clone
+import metrics, fetch_cache, prompt_builder, sandbox_profiler, decompose
+from metrics import phase_timer
 
 def now_monotonic() -> float:
     import time
     return time.monotonic()
 
+class AdmissionRejected(Exception):
+    pass
+
+def _completion_check(spec: Dict[str, Any]):
+    """Early-completion predicate for run_user_code: stdout ends with a payload that
+    validates. None (wait for exit) when disabled or for free-text answers."""
+    if not SANDBOX_EARLY_COMPLETE or spec.get("container", "text") == "text":
+        return None
+    def complete(stdout: str) -> bool:
+        if not stdout.rstrip().endswith("]"):
+            return False
+        try:
+            validate_and_coerce(stdout, spec, recompress=False)  # runs in the output pump: no PNG shrinking
+            return True
+        except ValidationError:
+            return False
+    return complete
+
+def _hedge_variants(k: int) -> List[Tuple[str, Optional[float]]]:
+    models = [m.strip() for m in HEDGE_MODELS.split(",")] if HEDGE_MODELS else [""]
+    temps = [t.strip() for t in HEDGE_TEMPERATURES.split(",")] if HEDGE_TEMPERATURES else [""]
+    out = []
+    for i in range(k):
+        m = models[i % len(models)] or CODEGEN_MODEL
+        t = temps[i % len(temps)]
+        out.append((m, float(t) if t else None))
+    return out
+
+def _private_copy(src: str, dst: str) -> None:
+    # never a hard link: a script rewriting its file must not change a sibling's
+    if os.path.exists(dst):
+        return
+    if not _clone(src, dst):
+        shutil.copy2(src, dst)
+
+def _isolated_dir(job_dir: str, name: str, group: str = "hedge") -> str:
+    # Per-candidate cwd with its own ./attachments (and ./ingested, ./shared when
+    # pre-ingestion or the loader wrote them) tree: reflink clones, copy as fallback
+    cdir = os.path.join(job_dir, group, name)
+    for sub in ("attachments", INGEST_DIR, decompose.SHARED_DIR):
+        src = os.path.join(job_dir, sub)
+        dst = os.path.join(cdir, sub)
+        if os.path.isdir(src):
+            shutil.copytree(src, dst, copy_function=_private_copy, dirs_exist_ok=True)
+        elif sub == "attachments":
+            os.makedirs(dst, exist_ok=True)
+    return cdir
+
+def _usage_fields(usage: Dict[str, Any]) -> Dict[str, Any]:
+    # exit reason and resource usage of a sandbox run, for the log entry
+    return {k: usage[k] for k in ("reason", "cpu", "maxrss") if usage.get(k) is not None}
+
+def _png_fields() -> Dict[str, Any]:
+    png = drain_png_reports()
+    return {"png_recompress": png} if png else {}
+
+def _save_profile(arts, name: str, usage: Dict[str, Any]) -> None:
+    # opt-in (SANDBOX_PROFILE): kept even when the run was killed on timeout
+    if usage.get("profile"):
+        arts.put(name, json.dumps(usage["profile"], ensure_ascii=False, indent=2))
+
+def _repair_context(usage: Dict[str, Any], stdout: str, stderr: str) -> Dict[str, Optional[str]]:
+    # sections of the repair prompt; each is cut to the prompt budget by prompt_builder
+    return {"run": describe(usage, job_limits()) if usage else None,
+            "profile": sandbox_profiler.summarize(usage["profile"], SANDBOX_PROFILE_TOP) if usage.get("profile") else None,
+            "stdout": stdout or "", "stderr": stderr or ""}
+
+async def run_hedged(task_text, spec, plan, job_dir, arts, req_id, logger, budget_for, data_summary="") -> Tuple[Optional[str], str, str, str, Dict[str, Any]]:
+    """Race HEDGE_K codegen+run candidates; first payload passing validate_and_coerce wins.
+    Returns (payload, code, stdout, stderr, usage); payload is None if every candidate failed,
+    and stdout/stderr/usage then come from the first failed candidate (for the repair prompt)."""
+    variants = _hedge_variants(HEDGE_K)
+    kick = asyncio.Event()
+    failures: List[Tuple[int, str, str, Dict[str, Any]]] = []
+
+    async def candidate(i: int, model: str, temperature: Optional[float]) -> str:
+        if i and HEDGE_DELAY_SEC > 0:
+            try:
+                await asyncio.wait_for(kick.wait(), timeout=i * HEDGE_DELAY_SEC)
+            except asyncio.TimeoutError:
+                pass
+        stdout = stderr = ""
+        usage: Dict[str, Any] = {}
+        set_png_sink([])  # this task's own context
+        try:
+            code = await asyncio.wait_for(
+                generate_code(task_text, spec, plan, model=model, temperature=temperature, data_summary=data_summary),
+                timeout=await budget_for("codegen1")
+            )
+            arts.put(f"code_c{i}.py", code)
+            cwd = await asyncio.to_thread(_isolated_dir, job_dir, f"c{i}")
+            res = await run_user_code(code, cwd=cwd, timeout=await budget_for("run1"),
+                                      complete=_completion_check(spec), profile=SANDBOX_PROFILE)
+            (ok, stdout, stderr), usage = res, usage_of(res)
+            _save_profile(arts, f"profile_c{i}.json", usage)
+            arts.put(f"stdout_c{i}.txt", stdout or "")
+            arts.put(f"stderr_c{i}.txt", stderr or "")
+            if not ok:
+                raise RuntimeError(f"run failed: {(stderr or '').strip()[-200:]}")
+            payload = await validate_and_coerce_async(stdout, spec)
+            await logger.save(req_id, {"phase":"hedge","candidate":i,"model":model,"temperature":temperature,"result":"win",**_usage_fields(usage),**_png_fields()})
+            return payload, code
+        except asyncio.CancelledError:
+            await logger.save(req_id, {"phase":"hedge","candidate":i,"model":model,"temperature":temperature,"result":"cancelled"})
+            raise
+        except Exception as e:
+            failures.append((i, stdout, stderr, usage))
+            kick.set()
+            await logger.save(req_id, {"phase":"hedge","candidate":i,"model":model,"temperature":temperature,"result":"fail","error":str(e) or type(e).__name__,**_usage_fields(usage),**_png_fields()})
+            raise
+
+    tasks = [asyncio.ensure_future(candidate(i, m, t)) for i, (m, t) in enumerate(variants)]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            try:
+                payload, code = await fut
+                return payload, code, "", "", {}
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                continue
+    finally:
+        for t in tasks:
+            if not t.done():
+                t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    _, stdout, stderr, usage = min(failures, key=lambda f: f[0]) if failures else (0, "", "", {})
+    return None, "", stdout, stderr, usage
+
+async def run_decomposed(task_text, spec, plan, job_dir, arts, req_id, logger, budget_for, stop_at: float, data_summary="") -> Tuple[str, List[decompose.Slot]]:
+    """Shared loader, then one codegen+run per numbered question, all concurrent; a failed
+    question gets one repair while time remains. Questions still open at stop_at are
+    cancelled. Returns (assembled payload, slots); unresolved slots hold their dummy value."""
+    slots = decompose.make_slots(task_text, spec)
+
+    # Shared data: loaded once into ./shared; without it each question loads its own
+    summary = data_summary
+    with phase_timer("loader") as pt:
+        stdout = stderr = ""
+        usage: Dict[str, Any] = {}
+        try:
+            code = await asyncio.wait_for(generate_loader(task_text, plan, data_summary=data_summary),
+                                          timeout=await budget_for("codegen1"))
+            arts.put("code_loader.py", code)
+            # at most half of what is left, so the questions still get their turn
+            timeout = min(await budget_for("run1"), max(1.0, (stop_at - now_monotonic()) / 2))
+            res = await run_user_code(code, cwd=job_dir, timeout=timeout)
+            (ok, stdout, stderr), usage = res, usage_of(res)
+            arts.put("stdout_loader.txt", stdout or "")
+            arts.put("stderr_loader.txt", stderr or "")
+            if not ok:
+                raise RuntimeError(f"run failed: {(stderr or '').strip()[-200:]}")
+            shared = decompose.shared_summary(stdout)
+            summary = "\n\n".join(s for s in (data_summary, shared) if s)
+            error = None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            pt.outcome = "fail"
+            error = str(e) or type(e).__name__
+    await logger.save(req_id, {"phase":"loader","result":pt.outcome,"sec":pt.sec,**({"error":error} if error else {}),
+                               **_usage_fields(usage)})
+
+    async def solve(slot: decompose.Slot) -> None:
+        q = slot.index + 1
+        cwd = await asyncio.to_thread(_isolated_dir, job_dir, f"q{q}", "slots")
+        set_png_sink([])  # this task's own context
+        repair_ctx = None
+        for attempt, (codegen, run) in enumerate((("codegen1", "run1"), ("codegen2", "run2")), 1):
+            if attempt > 1 and now_monotonic() >= stop_at:
+                return
+            slot.attempts = attempt
+            name = f"q{q}" if attempt == 1 else f"q{q}_repaired"
+            stdout = stderr = ""
+            usage = {}
+            try:
+                code = await asyncio.wait_for(
+                    generate_code(slot.task_text, slot.spec, plan, repair_context=repair_ctx, data_summary=summary),
+                    timeout=await budget_for(codegen)
+                )
+                arts.put(f"code_{name}.py", code)
+                res = await run_user_code(code, cwd=cwd, timeout=await budget_for(run),
+                                          complete=_completion_check(slot.spec), profile=SANDBOX_PROFILE)
+                (ok, stdout, stderr), usage = res, usage_of(res)
+                _save_profile(arts, f"profile_{name}.json", usage)
+                arts.put(f"stdout_{name}.txt", stdout or "")
+                arts.put(f"stderr_{name}.txt", stderr or "")
+                if not ok:
+                    raise RuntimeError(f"run failed: {(stderr or '').strip()[-200:]}")
+                slot.value = json.loads(await validate_and_coerce_async(stdout, slot.spec))[0]
+                slot.resolved = True
+                await logger.save(req_id, {"phase":"slot","q":q,"attempt":attempt,"result":"ok",**_usage_fields(usage),**_png_fields()})
+                return
+            except asyncio.CancelledError:
+                await logger.save(req_id, {"phase":"slot","q":q,"attempt":attempt,"result":"cancelled"})
+                raise
+            except Exception as e:
+                slot.error = str(e) or type(e).__name__
+                await logger.save(req_id, {"phase":"slot","q":q,"attempt":attempt,"result":"fail","error":slot.error,
+                                           **_usage_fields(usage),**_png_fields()})
+                repair_ctx = _repair_context(usage, stdout, stderr)
+
+    tasks = [asyncio.ensure_future(solve(s)) for s in slots]
+    try:
+        await asyncio.wait(tasks, timeout=max(0.0, stop_at - now_monotonic()))
+    finally:
+        for t in tasks:
+            if not t.done():
+                t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    for s in slots:
+        metrics.DECOMPOSE_SLOTS.labels("dummy" if not s.resolved else "ok" if s.attempts == 1 else "repaired").inc()
+    return decompose.assemble(slots, spec), slots
+
 async def handle_request(task_text: str, attachments: List[Dict[str, Any]], job_dir: str, logger) -> str:
     t0 = now_monotonic()
     deadline_client = t0 + CLIENT_RESPOND_SEC
 
     req_id = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
-    run_dir = os.path.join("runs", req_id); os.makedirs(run_dir, exist_ok=True)
+    arts = get_artifact_store().open_run(req_id)
+    metrics.REQUESTS_INFLIGHT.inc()
+    token = set_deadline(deadline_client)  # EDF key for every LLM call / sandbox run below
+    logger = ObservingLogger(logger, get_allocator())  # phase durations feed the budget history
+    fetch_token = fetch_cache.set_request_tag(req_id)  # sandbox HTTP stats are kept per request
+    prompt_token = prompt_builder.set_sink([])  # prompt token counts, logged per phase
+    try:
+        return await _handle(task_text, attachments, job_dir, logger, req_id, arts, deadline_client)
+    finally:
+        prompt_builder.reset_sink(prompt_token)
+        fetch_cache.reset_request_tag(fetch_token)
+        fetch_stats = fetch_cache.pop_request_stats(req_id)
+        if fetch_stats:
+            try:
+                await logger.save(req_id, {"phase":"fetch_cache",**fetch_stats})
+            except Exception:
+                pass
+        reset_deadline(token)
+        metrics.REQUESTS_INFLIGHT.dec()
+        success = arts.has("final.txt")
+        metrics.REQUEST_SECONDS.labels("ok" if success else "dummy").observe(now_monotonic() - t0)
+        arts.finish(success=success)
+
+async def _handle(task_text, attachments, job_dir, logger, req_id, arts, deadline_client) -> str:
     await logger.init()
     await logger.save(req_id, {"phase":"start","attachments":[a["filename"] for a in attachments]})
 
     # 1) FormatSpec
-    spec = make_format_spec(task_text)
-    await logger.save(req_id, {"phase":"format_spec","spec":spec})
+    with phase_timer("format_spec") as pt:
+        spec = make_format_spec(task_text)
+    await logger.save(req_id, {"phase":"format_spec","spec":spec,"sec":pt.sec})
+
+    # 1b) Cache lookup: a hit can reuse the plan, the validated code or the final payload
+    cache = get_cache()
+    reuse = reuse_levels() if cache is not None else set()
+    ckey, cached = "", {}
+    if cache is not None:
+        ckey = await cache_key(task_text, spec, attachments)
+        entry, tier = await cache.get(ckey)
+        cached = {k: v for k, v in entry.items() if k in reuse}
+        hit = next((lvl for lvl in ("payload", "code", "plan") if lvl in cached), "miss")
+        if hit != "miss":
+            cache.count_reuse(hit)
+        await logger.save(req_id, {"phase":"cache","key":ckey[:16],"tier":tier,"hit":hit,"stats":dict(cache.stats)})
+        if "payload" in cached:
+            arts.put("final.txt", cached["payload"])
+            return cached["payload"]
+
+    async def remember(**fields):
+        if cache is not None:
+            await cache.update(ckey, **{k: v for k, v in fields.items() if k in reuse})
+
+    budgets = get_allocator()
+
+    async def budget_for(phase: str) -> float:
+        """Timeout for the next phase from the adaptive allocator; every decision is logged."""
+        decision = budgets.allocate(phase, deadline_client - now_monotonic())
+        await logger.save(req_id, {"phase":"budget","for":phase,**decision})
+        return decision["budget"]
+
+    async def log_prompts(phase: str) -> None:
+        for stats in prompt_builder.drain():
+            await logger.save(req_id, {"phase":"prompt","for":phase,**stats})
+
+    async def validate(phase: str, stdout: str):
+        """Returns the coerced payload, or None after logging the validation failure."""
+        png_token = set_png_sink([])
+        try:
+            with phase_timer(phase) as pt:
+                try:
+                    payload = await validate_and_coerce_async(stdout, spec)
+                except ValidationError as e:
+                    pt.outcome = "fail"
+                    error = str(e)
+            extra = _png_fields()  # oversized PNGs the validator recompressed (or tried to)
+        finally:
+            reset_png_sink(png_token)
+        if pt.outcome == "fail":
+            await logger.save(req_id, {"phase":phase,"result":"fail","error":error,"sec":pt.sec,**extra})
+            return None
+        arts.put("final.txt", payload)
+        await logger.save(req_id, {"phase":phase,"result":"ok","sec":pt.sec,**extra})
+        return payload
 
     async def main_flow():
+        # 1c) Admission: don't spend LLM/sandbox capacity on a request that cannot finish
+        if ADMISSION_CONTROL:
+            sched = get_scheduler()
+            admitted, expected = sched.admit(deadline_client, skip=[k for k in ("plan", "code") if k in cached])
+            await logger.save(req_id, {"phase":"admission","result":"admit" if admitted else "reject",
+                                       "remaining":round(deadline_client - now_monotonic(), 3),
+                                       "expected":round(expected, 3),"queues":sched.stats()})
+            if not admitted:
+                raise AdmissionRejected(f"expected {expected:.1f}s exceeds remaining budget")
+
+        # 1d) Pre-ingest tabular attachments once; both attempts load the fast copies
+        data_summary = ""
+        if INGEST_ENABLED and tabular_attachments(attachments):
+            with phase_timer("ingest") as pt:
+                data_summary, report = await ingest_attachments(
+                    job_dir, attachments, timeout=min(INGEST_SEC, max(1, deadline_client - now_monotonic())))
+            arts.put("data_summary.txt", data_summary)
+            await logger.save(req_id, {"phase":"ingest","files":[r.get("path") or r.get("source") for r in report],
+                                       "errors":[r["error"] for r in report if "error" in r],"sec":pt.sec})
+
         # 2) Plan
-        plan = await asyncio.wait_for(plan_task(task_text, spec), timeout=min(PLAN_SEC, max(3, deadline_client - now_monotonic())))
-        with open(os.path.join(run_dir, "plan.json"), "w", encoding="utf-8") as f: f.write(json.dumps(plan, ensure_ascii=False, indent=2))
-        await logger.save(req_id, {"phase":"plan","ok":True})
-
-        # 3) Codegen
-        code = await asyncio.wait_for(
-            generate_code(task_text, spec, plan),
-            timeout=min(CODEGEN1_SEC, max(5, deadline_client - now_monotonic()))
-        )
-        with open(os.path.join(run_dir, "code.py"), "w", encoding="utf-8") as f: f.write(code)
-        await logger.save(req_id, {"phase":"codegen1","ok":True})
-
-        # 4) Execute
-        ok, stdout, stderr = await run_user_code(code, cwd=job_dir, timeout=min(RUN1_SEC, max(10, deadline_client - now_monotonic())))
-        with open(os.path.join(run_dir, "stdout1.txt"), "w", encoding="utf-8") as f: f.write(stdout or "")
-        with open(os.path.join(run_dir, "stderr1.txt"), "w", encoding="utf-8") as f: f.write(stderr or "")
-        await logger.save(req_id, {"phase":"run1","ok":ok})
-
-        # 5) Validate
-        if ok:
-            try:
-                payload = validate_and_coerce(stdout, spec)
-                with open(os.path.join(run_dir, "final.txt"), "w", encoding="utf-8") as f: f.write(payload)
-                await logger.save(req_id, {"phase":"validate1","result":"ok"})
+        with phase_timer("plan") as pt:
+            if "plan" in cached:
+                plan = cached["plan"]
+            else:
+                plan = await asyncio.wait_for(plan_task(task_text, spec, data_summary=data_summary), timeout=await budget_for("plan"))
+        if "plan" not in cached:
+            await remember(plan=plan)
+        arts.put("plan.json", json.dumps(plan, ensure_ascii=False, indent=2))
+        await logger.save(req_id, {"phase":"plan","ok":True,"cached":"plan" in cached,"sec":pt.sec})
+        await log_prompts("plan")
+
+        if DECOMPOSE and "code" not in cached and decompose.applicable(spec, task_text):
+            # 3-5) Decomposed: shared loader, then one script per question; only failed
+            # questions are repaired and whatever is still open at the cutoff gets its dummy
+            with phase_timer("decompose") as pt:
+                assembled, slots = await run_decomposed(task_text, spec, plan, job_dir, arts, req_id, logger, budget_for,
+                                                        deadline_client - DECOMPOSE_RESERVE_SEC, data_summary)
+            await log_prompts("decompose")
+            resolved = [s.index + 1 for s in slots if s.resolved]
+            await logger.save(req_id, {"phase":"decompose","resolved":resolved,"questions":len(slots),"sec":pt.sec,
+                                       "unresolved":{s.index + 1: s.error or "not finished" for s in slots if not s.resolved}})
+            if not resolved:
+                raise RuntimeError("no question resolved")
+            payload = await validate("assemble", assembled)
+            if payload is None:
+                raise RuntimeError("assembled answer failed validation")
+            if len(resolved) == len(slots):
+                await remember(payload=payload)
+            return payload
+
+        if HEDGE_K > 1 and "code" not in cached:
+            # 3-5) Hedged: K candidates race, losers are cancelled and killed
+            with phase_timer("hedge") as pt:
+                payload, code, stdout, stderr, usage = await run_hedged(task_text, spec, plan, job_dir, arts, req_id, logger, budget_for, data_summary)
+            await log_prompts("hedge")
+            if payload is not None:
+                arts.put("final.txt", payload)
+                await logger.save(req_id, {"phase":"validate1","result":"ok","sec":pt.sec})
+                await remember(code=code, payload=payload)
                 return payload
-            except ValidationError as e:
-                await logger.save(req_id, {"phase":"validate1","result":"fail","error":str(e)})
+            await logger.save(req_id, {"phase":"validate1","result":"fail","error":"all hedged candidates failed","sec":pt.sec})
+        else:
+            # 3) Codegen
+            with phase_timer("codegen1") as pt:
+                if "code" in cached:
+                    code = cached["code"]
+                else:
+                    code = await asyncio.wait_for(
+                        generate_code(task_text, spec, plan, data_summary=data_summary),
+                        timeout=await budget_for("codegen1")
+                    )
+            arts.put("code.py", code)
+            await logger.save(req_id, {"phase":"codegen1","ok":True,"cached":"code" in cached,"sec":pt.sec})
+            await log_prompts("codegen1")
+
+            # 4) Execute
+            with phase_timer("run1") as pt:
+                res = await run_user_code(code, cwd=job_dir, timeout=await budget_for("run1"),
+                                          complete=_completion_check(spec), profile=SANDBOX_PROFILE)
+                (ok, stdout, stderr), usage = res, usage_of(res)
+                pt.outcome = "ok" if ok else "fail"
+            _save_profile(arts, "profile_run1.json", usage)
+            arts.put("stdout1.txt", stdout or "")
+            arts.put("stderr1.txt", stderr or "")
+            await logger.save(req_id, {"phase":"run1","ok":ok,"sec":pt.sec,**_usage_fields(usage)})
+
+            # 5) Validate
+            if ok:
+                payload = await validate("validate1", stdout)
+                if payload is not None:
+                    await remember(code=code, payload=payload)
+                    return payload
 
         # 6) Repair path if time allows
         if now_monotonic() < deadline_client:
-            repair_ctx = f"""PREVIOUS STDOUT:\n{stdout}\n\nPREVIOUS STDERR:\n{stderr}\n"""
-            code2 = await asyncio.wait_for(
-                generate_code(task_text, spec, plan, repair_context=repair_ctx),
-                timeout=min(REPAIR_CODEGEN_SEC, max(5, deadline_client - now_monotonic()))
-            )
-            with open(os.path.join(run_dir, "code_repaired.py"), "w", encoding="utf-8") as f: f.write(code2)
-            await logger.save(req_id, {"phase":"codegen2","ok":True})
+            repair_ctx = _repair_context(usage, stdout, stderr)
+            with phase_timer("codegen2") as pt:
+                code2 = await asyncio.wait_for(
+                    generate_code(task_text, spec, plan, repair_context=repair_ctx, data_summary=data_summary),
+                    timeout=await budget_for("codegen2")
+                )
+            arts.put("code_repaired.py", code2)
+            await logger.save(req_id, {"phase":"codegen2","ok":True,"sec":pt.sec})
+            await log_prompts("codegen2")
 
-            ok2, stdout2, stderr2 = await run_user_code(code2, cwd=job_dir, timeout=min(REPAIR_RUN_SEC, max(10, deadline_client - now_monotonic())))
-            with open(os.path.join(run_dir, "stdout2.txt"), "w", encoding="utf-8") as f: f.write(stdout2 or "")
-            with open(os.path.join(run_dir, "stderr2.txt"), "w", encoding="utf-8") as f: f.write(stderr2 or "")
-            await logger.save(req_id, {"phase":"run2","ok":ok2})
+            with phase_timer("run2") as pt:
+                res2 = await run_user_code(code2, cwd=job_dir, timeout=await budget_for("run2"),
+                                           complete=_completion_check(spec), profile=SANDBOX_PROFILE)
+                ok2, stdout2, stderr2 = res2
+                pt.outcome = "ok" if ok2 else "fail"
+            _save_profile(arts, "profile_run2.json", usage_of(res2))
+            arts.put("stdout2.txt", stdout2 or "")
+            arts.put("stderr2.txt", stderr2 or "")
+            await logger.save(req_id, {"phase":"run2","ok":ok2,"sec":pt.sec,**_usage_fields(usage_of(res2))})
 
             if ok2:
-                try:
-                    payload2 = validate_and_coerce(stdout2, spec)
-                    with open(os.path.join(run_dir, "final.txt"), "w", encoding="utf-8") as f: f.write(payload2)
-                    await logger.save(req_id, {"phase":"validate2","result":"ok"})
+                payload2 = await validate("validate2", stdout2)
+                if payload2 is not None:
+                    await remember(code=code2, payload=payload2)
                     return payload2
-                except ValidationError as e:
-                    await logger.save(req_id, {"phase":"validate2","result":"fail","error":str(e)})
 
         raise TimeoutError("valid payload not ready before client deadline")
 
-    try:
-        result = await asyncio.wait_for(main_flow(), timeout=max(1, deadline_client - now_monotonic()))
+    async def guarded_flow():
+        try:
+            return await asyncio.wait_for(main_flow(), timeout=max(1, deadline_client - now_monotonic()))
+        except Exception:
+            return None
+
+    if cache is not None:
+        # Single-flight: identical concurrent requests share one pipeline execution
+        result, coalesced = await cache.coalesce(ckey, guarded_flow)
+        if coalesced:
+            arts.put("final.txt", result)
+            await logger.save(req_id, {"phase":"cache","key":ckey[:16],"hit":"coalesced","stats":dict(cache.stats)})
+    else:
+        result = await guarded_flow()
+
+    if result is not None:
         return result
-    except Exception:
+
+    with phase_timer("fallback_dummy") as pt:
         dummy = make_dummy_answer(spec)
-        with open(os.path.join(run_dir, "final_dummy.txt"), "w", encoding="utf-8") as f: f.write(dummy)
-        await logger.save(req_id, {"phase":"fallback_dummy"})
-        return dummy
+    metrics.FALLBACKS.inc()
+    arts.put("final_dummy.txt", dummy)
+    await logger.save(req_id, {"phase":"fallback_dummy","sec":pt.sec})
+    return dummy
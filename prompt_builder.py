@@ -0,0 +1,211 @@
+# prompt_builder.py
+# Prompt assembly for llm_client. Each template in prompts/ is read and split into
+# literal/placeholder parts once per process. build() fills it in, counts tokens per
+# section and cuts oversized sections (repair stdout/stderr, data summary, answer
+# context) so the prompt fits the model's budget. Templates keep their fixed
+# instructions ahead of every per-request section, so the leading part of a prompt
+# is byte-identical across requests and provider-side prefix caching can hit. The
+# sections then run from most to least shared within a request (data summary, plan,
+# spec, task, repair context), so hedged, repaired and per-question codegen prompts
+# also share everything up to the part that differs.
+import contextvars, math, os, re
+from string import Template
+from typing import Any, Dict, List, Optional, Tuple
+import metrics
+from config import (
+    PROMPT_MAX_TOKENS, PROMPT_MAX_TOKENS_BY_MODEL, PROMPT_SECTION_MAX_TOKENS, PROMPT_SECTION_MIN_TOKENS,
+)
+
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts")
+CHARS_PER_TOKEN = 4  # estimate when tiktoken is not installed
+
+# Placeholders whose content may be cut to fit; the value is the share kept from
+# the head (the rest comes from the tail, where tracebacks end). A dict value
+# (e.g. repair_context={"stdout": ..., "stderr": ...}) becomes one section per key.
+SHRINKABLE = {"repair_context", "data_summary", "context"}
+HEAD_SHARE = {"stdout": 0.5, "stderr": 0.25, "data_summary": 1.0, "context": 0.5}
+LABELS = {"run": "PREVIOUS RUN", "profile": "PREVIOUS RUN HOT SPOTS", "stdout": "PREVIOUS STDOUT",
+          "stderr": "PREVIOUS STDERR"}
+
+_BLOB = re.compile(r"(?:data:[\w/+.-]+;base64,)?[A-Za-z0-9+/]{256,}={0,2}")
+
+class PromptTemplate:
+    def __init__(self, name: str, text: str):
+        self.name = name
+        self.parts: List[Tuple[str, str]] = []  # ("text", literal) | ("var", name)
+        pos = 0
+        for m in Template.pattern.finditer(text):
+            if m.group("invalid") is not None:
+                raise ValueError(f"{name}: invalid placeholder at offset {m.start()}")
+            self.parts.append(("text", text[pos:m.start()]))
+            if m.group("escaped") is not None:
+                self.parts.append(("text", "$"))
+            else:
+                self.parts.append(("var", m.group("named") or m.group("braced")))
+            pos = m.end()
+        self.parts.append(("text", text[pos:]))
+        self.placeholders = list(dict.fromkeys(v for kind, v in self.parts if kind == "var"))
+        self.static = "".join(v for kind, v in self.parts if kind == "text")
+        self._static_tokens: Dict[str, int] = {}
+
+    def static_tokens(self, model: str) -> int:
+        n = self._static_tokens.get(model)
+        if n is None:
+            n = self._static_tokens[model] = count_tokens(self.static, model)
+        return n
+
+    def render(self, values: Dict[str, str]) -> str:
+        return "".join(v if kind == "text" else values[v] for kind, v in self.parts)
+
+_templates: Dict[str, PromptTemplate] = {}
+
+def load_template(name: str) -> PromptTemplate:
+    tpl = _templates.get(name)
+    if tpl is None:
+        with open(os.path.join(PROMPTS_DIR, name), "r", encoding="utf-8") as f:
+            tpl = _templates[name] = PromptTemplate(name, f.read())
+    return tpl
+
+_encodings: Dict[str, Any] = {}
+
+def _encoding(model: str):
+    if model not in _encodings:
+        enc = None
+        try:
+            import tiktoken
+            try:
+                enc = tiktoken.encoding_for_model(model)
+            except KeyError:
+                enc = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            pass
+        _encodings[model] = enc
+    return _encodings[model]
+
+def count_tokens(text: str, model: str = "") -> int:
+    enc = _encoding(model)
+    if enc is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(enc.encode(text, disallowed_special=()))
+
+def _parse_budgets(raw: str) -> Dict[str, int]:
+    out = {}
+    for item in raw.split(","):
+        model, _, n = item.partition("=")
+        try:
+            out[model.strip()] = int(n)
+        except ValueError:
+            pass
+    return out
+
+_BUDGETS = _parse_budgets(PROMPT_MAX_TOKENS_BY_MODEL)
+
+def token_budget(model: str) -> int:
+    return _BUDGETS.get(model, PROMPT_MAX_TOKENS)
+
+def cut_text(text: str, max_tokens: int, head_share: float = 0.5, model: str = "") -> str:
+    """Fit text into max_tokens: base64 blobs are summarized first, then the middle
+    is dropped (head_share of what is kept comes from the start)."""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    text = _BLOB.sub(lambda m: f"<base64 blob, {len(m.group(0))} chars>", text)
+    n = count_tokens(text, model)
+    if n <= max_tokens:
+        return text
+    keep = len(text) * max_tokens / n
+    out = text
+    for _ in range(5):
+        head = int(keep * head_share)
+        tail = max(int(keep) - head, 0)
+        marker = f"\n...[{len(text) - head - tail} chars cut]...\n"
+        out = text[:head] + marker + (text[len(text) - tail:] if tail else "")
+        if count_tokens(out, model) <= max_tokens:
+            break
+        keep = keep * 0.85 - len(marker)
+    return out
+
+def _limits(sizes: Dict[str, int], room: int) -> Dict[str, int]:
+    # water-fill: small sections keep everything, large ones share what is left
+    limits = {}
+    pending = sorted(sizes, key=sizes.get)
+    room = max(room, 0)
+    while pending:
+        k = pending.pop(0)
+        share = room // (len(pending) + 1)
+        limits[k] = max(min(sizes[k], PROMPT_SECTION_MAX_TOKENS, share), min(sizes[k], PROMPT_SECTION_MIN_TOKENS))
+        room -= limits[k]
+    return limits
+
+class Prompt:
+    __slots__ = ("name", "model", "text", "tokens", "budget", "sections", "cut")
+
+    def __init__(self, name: str, model: str, text: str, tokens: int, budget: int,
+                 sections: Dict[str, int], cut: Dict[str, int]):
+        self.name = name
+        self.model = model
+        self.text = text
+        self.tokens = tokens
+        self.budget = budget
+        self.sections = sections  # tokens per section ("static" = template literals)
+        self.cut = cut  # section -> tokens before it was cut
+
+    def stats(self) -> Dict[str, Any]:
+        return {"prompt": self.name, "model": self.model, "tokens": self.tokens, "budget": self.budget,
+                "sections": self.sections, "cut": self.cut}
+
+_sink: contextvars.ContextVar[Optional[List[Dict[str, Any]]]] = contextvars.ContextVar("prompt_sink", default=None)
+
+def set_sink(sink: List[Dict[str, Any]]) -> contextvars.Token:
+    """Collect stats() of every prompt built in this context (the orchestrator logs them per phase)."""
+    return _sink.set(sink)
+
+def reset_sink(token: contextvars.Token) -> None:
+    _sink.reset(token)
+
+def drain() -> List[Dict[str, Any]]:
+    sink = _sink.get()
+    if not sink:
+        return []
+    out = list(sink)
+    sink.clear()
+    return out
+
+def build(name: str, model: str, **values: Any) -> Prompt:
+    tpl = load_template(name)
+    budget = token_budget(model)
+    sections: Dict[str, str] = {}
+    for var in tpl.placeholders:
+        v = values[var]
+        if isinstance(v, dict):
+            for k, text in v.items():
+                if text is not None:
+                    sections[f"{var}.{k}"] = str(text) or "(empty)"
+        else:
+            sections[var] = "" if v is None else str(v)
+
+    tokens = {k: count_tokens(text, model) for k, text in sections.items()}
+    shrink = [k for k in sections if k.split(".", 1)[0] in SHRINKABLE]
+    fixed = tpl.static_tokens(model) + sum(n for k, n in tokens.items() if k not in shrink)
+    cut = {}
+    for k, limit in _limits({k: tokens[k] for k in shrink}, budget - fixed).items():
+        if tokens[k] > limit:
+            cut[k] = tokens[k]
+            sections[k] = cut_text(sections[k], limit, HEAD_SHARE.get(k.rsplit(".", 1)[-1], 0.5), model)
+            tokens[k] = count_tokens(sections[k], model)
+            metrics.PROMPT_SECTIONS_CUT.labels(k).inc()
+
+    rendered = {}
+    for var in tpl.placeholders:
+        if isinstance(values[var], dict):
+            rendered[var] = "\n\n".join(f"{LABELS.get(k, k.upper())}:\n{sections[f'{var}.{k}']}"
+                                        for k in values[var] if f"{var}.{k}" in sections)
+        else:
+            rendered[var] = sections[var]
+    text = tpl.render(rendered)
+    total = tpl.static_tokens(model) + sum(tokens.values())
+    prompt = Prompt(name, model, text, total, budget, {"static": tpl.static_tokens(model), **tokens}, cut)
+    metrics.PROMPT_TOKENS.labels(name.rsplit(".", 1)[0]).observe(total)
+    sink = _sink.get()
+    if sink is not None:
+        sink.append(prompt.stats())
+    return prompt
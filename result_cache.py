@@ -0,0 +1,148 @@
+# result_cache.py
+# Content-addressed cache of plan / validated code / final payload, keyed on
+# normalized task text + FormatSpec + attachment content digests.
+# Tiers: in-memory LRU, then JSON files under runs/_cache with TTL and size eviction.
+# Also coalesces concurrent identical requests into one pipeline execution.
+import asyncio, hashlib, json, os, re, time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from disk_budget import DirBudget, file_size
+from config import CACHE_REUSE, CACHE_MEM_ITEMS, CACHE_DIR, CACHE_TTL_SEC, CACHE_DISK_MAX_BYTES
+
+REUSE_LEVELS = ("plan", "code", "payload")
+
+def normalize_task(text: str) -> str:
+    lines = [re.sub(r"[ \t]+", " ", l).strip() for l in text.replace("\r\n", "\n").replace("\r", "\n").split("\n")]
+    return "\n".join(l for l in lines if l)
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+async def cache_key(task_text: str, spec: Dict[str, Any], attachments: List[Dict[str, Any]]) -> str:
+    digests = []
+    for a in attachments:
+        if a.get("field") == "questions.txt":
+            continue  # its content is the task text
+        d = a.get("sha256") or await asyncio.to_thread(file_digest, a["path"])
+        digests.append([a.get("filename"), d])
+    material = json.dumps(
+        {"task": normalize_task(task_text), "spec": spec, "attachments": sorted(digests)},
+        sort_keys=True, ensure_ascii=False,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+class ResultCache:
+    def __init__(self, mem_items: int, disk_dir: Optional[str], ttl_sec: float, disk_max_bytes: int):
+        self.mem_items = mem_items
+        self.disk_dir = disk_dir
+        self.ttl_sec = ttl_sec
+        self.disk_max_bytes = disk_max_bytes
+        self._mem: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._budget = DirBudget(disk_dir, disk_max_bytes, ttl_sec) if disk_dir else None
+        self.stats = {"mem_hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0,
+                      "plan_hits": 0, "code_hits": 0, "payload_hits": 0}
+
+    # -------- tiers --------
+    def _fresh(self, entry: Dict[str, Any]) -> bool:
+        return (time.time() - entry.get("created", 0)) <= self.ttl_sec
+
+    def _mem_put(self, key: str, entry: Dict[str, Any]) -> None:
+        self._mem[key] = entry
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.mem_items:
+            self._mem.popitem(last=False)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], key + ".json")
+
+    def _disk_get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not self._fresh(entry):
+            try: os.remove(path)
+            except OSError: pass
+            return None
+        return entry
+
+    def _disk_put(self, key: str, entry: Dict[str, Any]) -> None:
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        before = file_size(path)
+        os.replace(tmp, path)
+        self._budget.add(file_size(path) - before)  # evicts (TTL, then oldest) only when over budget
+
+    # -------- API --------
+    async def get(self, key: str) -> Tuple[Dict[str, Any], str]:
+        """Return (entry, tier) where tier is memory | disk | miss; entry is {} on miss."""
+        entry = self._mem.get(key)
+        if entry is not None and self._fresh(entry):
+            self._mem.move_to_end(key)
+            self.stats["mem_hits"] += 1
+            return entry, "memory"
+        self._mem.pop(key, None)
+        if self.disk_dir:
+            entry = await asyncio.to_thread(self._disk_get, key)
+            if entry is not None:
+                self._mem_put(key, entry)
+                self.stats["disk_hits"] += 1
+                return entry, "disk"
+        self.stats["misses"] += 1
+        return {}, "miss"
+
+    async def update(self, key: str, **fields: Any) -> None:
+        entry = dict(self._mem.get(key) or {})
+        if not entry or not self._fresh(entry):
+            entry = {"created": time.time()}
+        entry.update({k: v for k, v in fields.items() if k in REUSE_LEVELS and v is not None})
+        self._mem_put(key, entry)
+        if self.disk_dir:
+            await asyncio.to_thread(self._disk_put, key, entry)
+
+    def count_reuse(self, level: str) -> None:
+        self.stats[f"{level}_hits"] += 1
+
+    async def coalesce(self, key: str, fn: Callable[[], Awaitable[str]]) -> Tuple[str, bool]:
+        """Run fn once per key at a time; concurrent callers share the leader's payload.
+        Returns (payload, coalesced). If the leader fails, a follower runs fn itself."""
+        fut = self._inflight.get(key)
+        if fut is not None:
+            res = await asyncio.shield(fut)
+            if res is not None:
+                self.stats["coalesced"] += 1
+                return res, True
+            return await fn(), False
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        res = None
+        try:
+            res = await fn()
+            return res, False
+        finally:
+            self._inflight.pop(key, None)
+            fut.set_result(res)
+
+_cache: Optional[ResultCache] = None
+
+def reuse_levels() -> set:
+    return {l.strip() for l in CACHE_REUSE.split(",") if l.strip() in REUSE_LEVELS}
+
+def get_cache() -> Optional[ResultCache]:
+    """Shared cache, or None when CACHE_REUSE enables no level."""
+    global _cache
+    if not reuse_levels():
+        return None
+    if _cache is None:
+        _cache = ResultCache(CACHE_MEM_ITEMS, CACHE_DIR or None, CACHE_TTL_SEC, CACHE_DISK_MAX_BYTES)
+    return _cache
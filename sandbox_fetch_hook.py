@@ -0,0 +1,38 @@
+# sandbox_fetch_hook.py
+# Imported inside a sandbox child when FETCH_PROXY is set. Plain http:// already
+# goes through the caching proxy via HTTP_PROXY; https:// requests made with
+# `requests` (also what pandas/bs4 scripts normally use) are sent to the proxy as
+# plain http with an X-Fetch-Scheme header so they can be cached too. The proxy
+# talks TLS upstream; the response keeps its original https URL.
+import os
+
+def install() -> bool:
+    proxy = os.environ.get("FETCH_PROXY")
+    if not proxy:
+        return False
+    try:
+        from requests.adapters import HTTPAdapter
+    except ImportError:
+        return False
+    if getattr(HTTPAdapter.send, "_fetch_hook", False):
+        return True
+    orig = HTTPAdapter.send
+
+    def send(self, request, **kwargs):
+        url = request.url or ""
+        if not url.startswith("https://") or request.method not in ("GET", "HEAD"):
+            return orig(self, request, **kwargs)
+        request.url = "http://" + url[len("https://"):]
+        request.headers["X-Fetch-Scheme"] = "https"
+        kwargs["proxies"] = {"http": proxy}
+        try:
+            resp = orig(self, request, **kwargs)
+        finally:
+            request.url = url
+            request.headers.pop("X-Fetch-Scheme", None)
+        resp.url = url
+        return resp
+
+    send._fetch_hook = True
+    HTTPAdapter.send = send
+    return True
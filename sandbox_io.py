@@ -0,0 +1,134 @@
+# sandbox_io.py
+# Bounded, incremental capture of sandbox stdout/stderr. Pipes are drained in
+# 64 KiB chunks into BoundedBuffer, which keeps at most head+tail bytes so a
+# script that floods its output cannot blow up the server's memory.
+import asyncio, os, time
+from collections import deque
+from typing import Callable, Deque, Optional
+import metrics
+from config import SANDBOX_STDOUT_MAX_BYTES, SANDBOX_STDERR_HEAD_BYTES, SANDBOX_STDERR_TAIL_BYTES
+
+CHUNK = 64 * 1024
+EARLY_CHECK_INTERVAL_SEC = 0.05
+
+class BoundedBuffer:
+    """First `head` bytes plus a ring of the last `tail` bytes; the middle is dropped."""
+
+    def __init__(self, head: int, tail: int, stream: str = ""):
+        self.head_cap = head
+        self.tail_cap = tail
+        self.stream = stream
+        self.head = bytearray()
+        self.tail: Deque[bytes] = deque()
+        self.tail_len = 0
+        self.total = 0
+
+    @property
+    def truncated(self) -> bool:
+        return self.total > len(self.head) + self.tail_len
+
+    def feed(self, data: bytes) -> None:
+        was_truncated = self.truncated
+        self.total += len(data)
+        room = self.head_cap - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if not data or self.tail_cap <= 0:
+            if self.truncated and not was_truncated:
+                metrics.SANDBOX_OUTPUT_TRUNCATED.labels(self.stream).inc()
+            return
+        if len(data) >= self.tail_cap:
+            self.tail.clear()
+            self.tail.append(bytes(data[-self.tail_cap:]))
+            self.tail_len = self.tail_cap
+        else:
+            self.tail.append(bytes(data))
+            self.tail_len += len(data)
+            while self.tail_len > self.tail_cap:
+                over = self.tail_len - self.tail_cap
+                first = self.tail[0]
+                if len(first) <= over:
+                    self.tail.popleft()
+                    self.tail_len -= len(first)
+                else:
+                    self.tail[0] = first[over:]
+                    self.tail_len -= over
+        if self.truncated and not was_truncated:
+            metrics.SANDBOX_OUTPUT_TRUNCATED.labels(self.stream).inc()
+
+    def getvalue(self) -> bytes:
+        tail = b"".join(self.tail)
+        dropped = self.total - len(self.head) - len(tail)
+        if dropped > 0:
+            return bytes(self.head) + f"\n...[{dropped} bytes truncated]...\n".encode() + tail
+        return bytes(self.head) + tail
+
+    def text(self) -> str:
+        return self.getvalue().decode("utf-8", "replace")
+
+def stdout_buffer() -> BoundedBuffer:
+    half = SANDBOX_STDOUT_MAX_BYTES // 2
+    return BoundedBuffer(half, SANDBOX_STDOUT_MAX_BYTES - half, "stdout")
+
+def stderr_buffer() -> BoundedBuffer:
+    return BoundedBuffer(SANDBOX_STDERR_HEAD_BYTES, SANDBOX_STDERR_TAIL_BYTES, "stderr")
+
+async def pump(reader: asyncio.StreamReader, buf: BoundedBuffer,
+               complete: Optional[Callable[[str], bool]] = None,
+               early: Optional[asyncio.Event] = None) -> None:
+    """Drain `reader` into `buf` until EOF. With `complete`, sets `early` once the
+    (untruncated) output so far satisfies it; checks run on newline-terminated
+    chunks, at most every EARLY_CHECK_INTERVAL_SEC. A check that falls inside the
+    interval is deferred on a timer rather than dropped, so a payload printed right
+    after another line is still seen while the script sits in a slow teardown."""
+    loop = asyncio.get_running_loop()
+    last_check = 0.0
+    deferred: Optional[asyncio.TimerHandle] = None
+
+    def check() -> None:
+        nonlocal last_check, deferred
+        deferred = None
+        last_check = time.monotonic()
+        if early.is_set() or buf.truncated:
+            return
+        try:
+            if complete(buf.text()):
+                early.set()
+        except Exception:
+            pass
+
+    try:
+        while True:
+            data = await reader.read(CHUNK)
+            if not data:
+                return
+            buf.feed(data)
+            if complete is None or early is None or early.is_set() or buf.truncated or not data.endswith(b"\n"):
+                continue
+            wait = last_check + EARLY_CHECK_INTERVAL_SEC - time.monotonic()
+            if wait <= 0:
+                if deferred is not None:
+                    deferred.cancel()
+                check()
+            elif deferred is None:
+                deferred = loop.call_later(wait, check)
+    finally:
+        if deferred is not None:
+            deferred.cancel()
+
+async def pipe_reader(fd: int):
+    """Wrap a raw pipe read-end in a StreamReader; returns (reader, transport)."""
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=2 ** 20)
+    transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(fd, "rb", 0)
+    )
+    return reader, transport
+
+async def pump_fd(fd: int, buf: BoundedBuffer, complete=None, early=None) -> None:
+    reader, transport = await pipe_reader(fd)
+    try:
+        await pump(reader, buf, complete, early)
+    finally:
+        transport.close()
@@ -0,0 +1,200 @@
+# sandbox_limits.py
+# Per-job resource limits and accounting for sandboxed runs. The pool and the
+# cold path send a limits dict with every job; the child applies it with
+# setrlimit before any generated code runs (the zygote child right after fork,
+# the cold path at the top of its wrapper script) and, when
+# SANDBOX_CGROUP_ROOT points at a delegated cgroup-v2 directory, moves itself
+# into a per-job cgroup with memory/pids/cpu caps. classify() turns the exit
+# status, rusage and stderr into an exit reason the orchestrator logs and puts
+# into the repair prompt.
+#
+# Imported by sandbox_zygote.py and the cold wrapper: keep the child-side helpers
+# (apply_rlimits, join_cgroup) free of anything but the standard library.
+import os, signal, time
+from typing import Any, Dict, Optional
+
+MB = 1024 * 1024
+
+_RLIMITS = {"as": "RLIMIT_AS", "cpu": "RLIMIT_CPU", "nofile": "RLIMIT_NOFILE",
+            "fsize": "RLIMIT_FSIZE", "nproc": "RLIMIT_NPROC"}
+
+def job_limits() -> Dict[str, int]:
+    """Configured limits for one job (bytes / seconds / counts; 0 = unlimited)."""
+    from config import (
+        SANDBOX_RLIMIT_AS_MB, SANDBOX_RLIMIT_CPU_SEC, SANDBOX_RLIMIT_NOFILE, SANDBOX_RLIMIT_FSIZE_MB,
+        SANDBOX_RLIMIT_NPROC,
+    )
+    return {"as": SANDBOX_RLIMIT_AS_MB * MB, "cpu": SANDBOX_RLIMIT_CPU_SEC, "nofile": SANDBOX_RLIMIT_NOFILE,
+            "fsize": SANDBOX_RLIMIT_FSIZE_MB * MB, "nproc": SANDBOX_RLIMIT_NPROC}
+
+def apply_rlimits(limits: Dict[str, int]) -> None:
+    """Child side: lower the soft and hard limits. Never raises a limit above its
+    current hard value. RLIMIT_CPU keeps 2 s between SIGXCPU and SIGKILL."""
+    import resource
+    for key, value in (limits or {}).items():
+        name = _RLIMITS.get(key)
+        if not value or name is None or not hasattr(resource, name):
+            continue
+        res = getattr(resource, name)
+        _soft, hard = resource.getrlimit(res)
+        soft = int(value)
+        new_hard = soft + 2 if key == "cpu" else soft
+        if hard != resource.RLIM_INFINITY:
+            soft, new_hard = min(soft, hard), min(new_hard, hard)
+        try:
+            resource.setrlimit(res, (soft, new_hard))
+        except (ValueError, OSError):
+            pass
+
+# -------- cgroup v2 --------
+def join_cgroup(path: Optional[str]) -> None:
+    """Child side: move the calling process into the job's cgroup."""
+    if not path:
+        return
+    try:
+        with open(os.path.join(path, "cgroup.procs"), "w") as f:
+            f.write("0")
+    except OSError:
+        pass
+
+def cgroup_available(root: str) -> bool:
+    return bool(root) and os.path.isfile(os.path.join(root, "cgroup.controllers")) and os.access(root, os.W_OK)
+
+class CgroupJob:
+    """One cgroup-v2 child of SANDBOX_CGROUP_ROOT per sandbox run."""
+
+    def __init__(self, root: str, name: str, memory_max: int = 0, pids_max: int = 0, cpus: float = 0.0):
+        self.path = os.path.join(root, name)
+        os.mkdir(self.path)
+        settings = []
+        if memory_max:
+            settings += [("memory.max", memory_max), ("memory.swap.max", 0)]
+        if pids_max:
+            settings.append(("pids.max", pids_max))
+        if cpus:
+            settings.append(("cpu.max", f"{int(cpus * 100000)} 100000"))
+        for fname, value in settings:
+            try:
+                with open(os.path.join(self.path, fname), "w") as f:
+                    f.write(str(value))
+            except OSError:
+                pass  # controller not delegated
+
+    def _read(self, fname: str) -> Dict[str, int]:
+        out = {}
+        try:
+            with open(os.path.join(self.path, fname)) as f:
+                for line in f:
+                    k, _, v = line.partition(" ")
+                    if v.strip().isdigit():
+                        out[k] = int(v)
+        except OSError:
+            pass
+        return out
+
+    def collect(self) -> Dict[str, Any]:
+        usage: Dict[str, Any] = {}
+        cpu = self._read("cpu.stat").get("usage_usec")
+        if cpu is not None:
+            usage["cpu"] = round(cpu / 1e6, 4)
+        try:
+            with open(os.path.join(self.path, "memory.peak")) as f:
+                usage["maxrss"] = int(f.read().strip())
+        except (OSError, ValueError):
+            pass
+        usage["oom_kill"] = self._read("memory.events").get("oom_kill", 0)
+        return usage
+
+    def remove(self) -> None:
+        # the killed job's processes may take a moment to leave the cgroup
+        for _ in range(50):
+            try:
+                with open(os.path.join(self.path, "cgroup.kill"), "w") as f:
+                    f.write("1")
+            except OSError:
+                pass
+            try:
+                os.rmdir(self.path)
+                return
+            except OSError:
+                time.sleep(0.01)
+
+def open_cgroup(tag: str) -> Optional[CgroupJob]:
+    from config import (
+        SANDBOX_CGROUP_ROOT, SANDBOX_CGROUP_MEMORY_MB, SANDBOX_CGROUP_PIDS_MAX, SANDBOX_CGROUP_CPUS,
+    )
+    if not cgroup_available(SANDBOX_CGROUP_ROOT):
+        return None
+    try:
+        return CgroupJob(SANDBOX_CGROUP_ROOT, f"job-{os.getpid()}-{tag}", SANDBOX_CGROUP_MEMORY_MB * MB,
+                         SANDBOX_CGROUP_PIDS_MAX, SANDBOX_CGROUP_CPUS)
+    except OSError:
+        return None
+
+class RunResult(tuple):
+    """(ok, stdout, stderr) as returned by run_user_code, plus .usage:
+    {"reason", "cpu", "maxrss", "wall", "exit", "signal"} (missing values are None)."""
+
+    def __new__(cls, ok: bool, stdout: str, stderr: str, usage: Optional[Dict[str, Any]] = None):
+        self = super().__new__(cls, (ok, stdout, stderr))
+        self.usage = usage or {}
+        return self
+
+def usage_of(result) -> Dict[str, Any]:
+    return getattr(result, "usage", None) or {}
+
+# -------- exit reasons --------
+_STDERR_HINTS = (
+    ("MemoryError", "memory_limit"),
+    ("Cannot allocate memory", "memory_limit"),
+    ("File too large", "fsize_limit"),
+    ("Too many open files", "nofile_limit"),
+    ("Resource temporarily unavailable", "nproc_limit"),
+)
+
+def classify(exit_code: Optional[int], sig: Optional[int], stderr: str, usage: Dict[str, Any],
+             limits: Dict[str, int]) -> str:
+    """ok | error | timeout | oom | memory_limit | cpu_limit | fsize_limit | nofile_limit |
+    nproc_limit | signal:<NAME>. Timeouts and early exits are decided by the caller."""
+    if exit_code == 0:
+        return "ok"
+    if usage.get("oom_kill"):
+        return "oom"
+    if sig == getattr(signal, "SIGXCPU", None):
+        return "cpu_limit"
+    if sig == getattr(signal, "SIGXFSZ", None):
+        return "fsize_limit"
+    if sig == signal.SIGKILL and limits.get("cpu") and (usage.get("cpu") or 0) >= limits["cpu"]:
+        return "cpu_limit"  # hard RLIMIT_CPU; "oom" needs the cgroup's oom_kill count above
+    if sig is not None:
+        try:
+            return f"signal:{signal.Signals(sig).name}"
+        except ValueError:
+            return f"signal:{sig}"
+    tail = (stderr or "")[-4000:]
+    for hint, reason in _STDERR_HINTS:
+        if hint in tail and (reason != "nproc_limit" or "fork" in tail or limits.get("nproc")):
+            return reason
+    return "error"
+
+def describe(usage: Dict[str, Any], limits: Dict[str, int]) -> str:
+    """One line for the repair prompt, e.g. "exit reason: memory_limit (address space
+    limit 4096 MB); cpu 3.20 s; peak RSS 3990 MB"."""
+    reason = usage.get("reason") or "unknown"
+    hint = {
+        "timeout": "wall-clock budget exceeded; make it faster",
+        "oom": "killed for using too much memory",
+        "memory_limit": f"address space limit {limits.get('as', 0) // MB} MB",
+        "cpu_limit": f"CPU limit {limits.get('cpu')} s",
+        "fsize_limit": f"file size limit {limits.get('fsize', 0) // MB} MB",
+        "nofile_limit": f"open files limit {limits.get('nofile')}",
+        "nproc_limit": f"process limit {limits.get('nproc')}",
+    }.get(reason)
+    parts = [f"exit reason: {reason}" + (f" ({hint})" if hint else "")]
+    if usage.get("cpu") is not None:
+        parts.append(f"cpu {usage['cpu']:.2f} s")
+    if usage.get("maxrss"):
+        parts.append(f"peak RSS {usage['maxrss'] // MB} MB")
+    if usage.get("wall") is not None:
+        parts.append(f"wall {usage['wall']:.2f} s")
+    return "; ".join(parts)
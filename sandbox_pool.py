@@ -0,0 +1,367 @@
+# sandbox_pool.py
+# Pool of pre-warmed "zygote" interpreters (see sandbox_zygote.py). Each zygote
+# has already imported the allowed libraries and forks a fresh child per job,
+# so generated code skips interpreter startup and the heavy imports.
+import asyncio, atexit, os, re, sys, json, signal, socket, time, uuid
+from typing import Any, Dict, List, Optional, Tuple
+from config import SANDBOX_POOL_SIZE, SANDBOX_WARMUP, SANDBOX_WARM_MODULES, SHUTDOWN_GRACE_SEC
+import metrics, fetch_cache, sandbox_limits
+from sandbox_limits import RunResult
+from scheduler import get_scheduler
+from sandbox_io import stdout_buffer, stderr_buffer, pump_fd
+
+ZYGOTE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sandbox_zygote.py")
+CODE_PROMPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts", "code_prompt.txt")
+USER_FILE = "user_code_exec.py"
+ZYGOTE_START_SEC = 60
+
+# pip distribution name -> import name, for the "Allowed libs" line of the code prompt
+_DIST_TO_MODULE = {"beautifulsoup4": "bs4", "pillow": "PIL"}
+# extra submodules worth pre-importing for a given top-level lib
+_EXTRA_MODULES = {"matplotlib": ["matplotlib.pyplot"], "pandas": ["pyarrow.parquet"]}
+
+def allowed_modules_from_prompt(path: str = CODE_PROMPT_PATH) -> List[str]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+    except OSError:
+        return []
+    m = re.search(r"Allowed libs:\s*(.+)", text)
+    if not m:
+        return []
+    mods: List[str] = []
+    for dist in (d.strip() for d in m.group(1).split(",")):
+        if not dist:
+            continue
+        mod = _DIST_TO_MODULE.get(dist.lower(), dist)
+        mods.append(mod)
+        mods.extend(_EXTRA_MODULES.get(mod, []))
+    return mods
+
+def warm_modules() -> List[str]:
+    if SANDBOX_WARM_MODULES:
+        return [m.strip() for m in SANDBOX_WARM_MODULES.split(",") if m.strip()]
+    return allowed_modules_from_prompt()
+
+def sandbox_env() -> Dict[str, str]:
+    # keep user code from seeing secrets
+    return {**os.environ, "PYTHONUNBUFFERED": "1", "OPENAI_API_KEY": ""}
+
+def _killpg(pid: Optional[int]) -> None:
+    if not pid:
+        return
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except Exception:
+        try: os.kill(pid, signal.SIGKILL)
+        except Exception: pass
+
+def kill_stragglers(pgid: Optional[int]) -> None:
+    """SIGKILL what is left of a finished job's process group (children it left
+    running escape per-process rlimits). No PID fallback: the leader is reaped."""
+    if not pgid:
+        return
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except OSError:
+        pass
+
+def _usage(done: Dict[str, Any], cgroup) -> Dict[str, Any]:
+    usage = {"cpu": done.get("cpu"), "maxrss": done.get("maxrss"), "exit": done.get("exit"), "signal": done.get("signal")}
+    if cgroup is not None:
+        usage.update({k: v for k, v in cgroup.collect().items() if v is not None})
+    return usage
+
+class _Worker:
+    def __init__(self, modules: List[str]):
+        self.modules = modules
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.sock: Optional[socket.socket] = None
+        self.warmed: List[str] = []
+        self.draining: Optional[asyncio.Future] = None
+        self._buf = b""
+
+    @property
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.returncode is None
+
+    async def start(self) -> None:
+        parent, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.proc = await asyncio.create_subprocess_exec(
+                sys.executable, ZYGOTE_PATH, str(child.fileno()), ",".join(self.modules),
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL,
+                pass_fds=(child.fileno(),),
+                env=sandbox_env(),
+            )
+        finally:
+            child.close()
+        parent.setblocking(False)
+        self.sock = parent
+        try:
+            hello = await asyncio.wait_for(self._recv(), timeout=ZYGOTE_START_SEC)
+        except BaseException:
+            self.close()
+            raise
+        if not hello.get("ready"):
+            self.close()
+            raise RuntimeError("sandbox zygote failed to start")
+        self.warmed = hello.get("warmed", [])
+
+    async def _recv(self) -> dict:
+        loop = asyncio.get_running_loop()
+        while b"\n" not in self._buf:
+            data = await loop.sock_recv(self.sock, 65536)
+            if not data:
+                raise ConnectionError("sandbox zygote exited")
+            self._buf += data
+        line, self._buf = self._buf.split(b"\n", 1)
+        return json.loads(line)
+
+    async def run(self, cwd: str, timeout: float, complete=None, env: Optional[Dict[str, str]] = None) -> RunResult:
+        limits = sandbox_limits.job_limits()
+        cgroup = sandbox_limits.open_cgroup(uuid.uuid4().hex[:12])
+        try:
+            return await self._run(cwd, timeout, complete, limits, cgroup, env or {})
+        finally:
+            if cgroup is not None:
+                cgroup.remove()
+
+    async def _run(self, cwd: str, timeout: float, complete, limits: Dict[str, int], cgroup,
+                   extra_env: Dict[str, str]) -> RunResult:
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        try:
+            env = {"PYTHONUNBUFFERED": "1", "OPENAI_API_KEY": "", **fetch_cache.child_env(), **extra_env}
+            job = {"cwd": os.path.abspath(cwd), "file": USER_FILE, "env": env, "limits": limits,
+                   "cgroup": cgroup.path if cgroup is not None else None}
+            socket.send_fds(self.sock, [(json.dumps(job) + "\n").encode("utf-8")], [out_w, err_w])
+        except BaseException:
+            for fd in (out_r, err_r):
+                os.close(fd)
+            raise
+        finally:
+            os.close(out_w)
+            os.close(err_w)
+
+        t_sent = time.monotonic()
+        out, err = stdout_buffer(), stderr_buffer()
+        early = asyncio.Event()
+        out_task = asyncio.ensure_future(pump_fd(out_r, out, complete, early))
+        err_task = asyncio.ensure_future(pump_fd(err_r, err))
+        pid = None
+        pending = 2  # protocol messages still owed by the zygote for this job
+        exit_msg: Optional[asyncio.Future] = None
+        try:
+            async def _wait():
+                nonlocal pid, pending, exit_msg
+                started = await self._recv()
+                pending = 1 if started.get("pid") else 0
+                pid = started.get("pid")
+                metrics.SANDBOX_SPAWN_SECONDS.labels("warm").observe(time.monotonic() - t_sent)
+                if pid is None:
+                    raise RuntimeError(started.get("error") or "sandbox fork failed")
+                exit_msg = asyncio.ensure_future(self._recv())
+                if complete is not None:
+                    early_wait = asyncio.ensure_future(early.wait())
+                    try:
+                        await asyncio.wait({exit_msg, early_wait}, return_when=asyncio.FIRST_COMPLETED)
+                    finally:
+                        early_wait.cancel()
+                    if not exit_msg.done():
+                        return None  # stdout already holds a valid payload
+                done = await asyncio.shield(exit_msg)  # a timeout must not cancel the read itself
+                pending = 0
+                await asyncio.gather(out_task, err_task)
+                return done
+
+            done = await asyncio.wait_for(_wait(), timeout=timeout)
+            wall = round(time.monotonic() - t_sent, 3)
+            if done is None:
+                # Early completion: skip the script's teardown; its exit message is
+                # consumed in the background before the worker is reused.
+                _killpg(pid)
+                self.draining = asyncio.ensure_future(self._settle(exit_msg))
+                metrics.SANDBOX_EARLY_EXITS.inc()
+                return RunResult(True, out.text(), err.text(), {"reason": "early", "wall": wall})
+            kill_stragglers(pid)
+            usage = _usage(done, cgroup)
+            metrics.observe_sandbox("warm", usage["cpu"], usage["maxrss"])
+            usage["reason"] = sandbox_limits.classify(usage["exit"], usage["signal"], err.text(), usage, limits)
+            usage["wall"] = wall
+            return RunResult(usage["exit"] == 0, out.text(), err.text(), usage)
+        except asyncio.TimeoutError:
+            _killpg(pid)
+            await self._owed(exit_msg, pending)
+            done = exit_msg.result() if exit_msg is not None and exit_msg.done() and not exit_msg.cancelled() \
+                and exit_msg.exception() is None else {}
+            usage = _usage(done, cgroup)
+            usage.update(reason="timeout", wall=round(time.monotonic() - t_sent, 3))
+            return RunResult(False, "", "timeout", usage)
+        except asyncio.CancelledError:
+            # Losing a race: kill the job, keep the zygote once its messages are consumed.
+            _killpg(pid)
+            self.draining = asyncio.ensure_future(self._owed(exit_msg, pending))
+            raise
+        except BaseException:
+            _killpg(pid)
+            self.close()
+            raise
+        finally:
+            for t in (out_task, err_task):
+                if not t.done():
+                    t.cancel()
+
+    async def _owed(self, exit_msg: Optional[asyncio.Future], pending: int) -> None:
+        if exit_msg is not None:
+            await self._settle(exit_msg)
+        else:
+            await self._drain(pending)
+
+    async def _settle(self, exit_msg: asyncio.Future) -> None:
+        # Wait for the in-flight read of the job's exit message (the child was killed).
+        try:
+            await asyncio.wait_for(asyncio.shield(exit_msg), timeout=5)
+        except BaseException:
+            exit_msg.cancel()
+            self.close()
+
+    async def _drain(self, pending: int) -> None:
+        # After a kill, consume the owed protocol messages so the worker can be reused.
+        try:
+            while pending > 0:
+                msg = await asyncio.wait_for(self._recv(), timeout=5)
+                pending -= 1
+                if pending == 1:
+                    _killpg(msg.get("pid"))
+        except BaseException:
+            self.close()
+
+    def close(self) -> None:
+        if self.sock is not None:
+            try: self.sock.close()
+            except Exception: pass
+            self.sock = None
+        if self.proc is not None and self.proc.returncode is None:
+            try: self.proc.kill()
+            except Exception: pass
+
+class SandboxPool:
+    def __init__(self, size: int, modules: List[str]):
+        self.size = size
+        self.modules = modules
+        self._idle: List[_Worker] = []
+        self._workers: List[_Worker] = []
+        self._starting = 0
+        self._closed = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self) -> None:
+        # Spawn missing zygotes in the background; jobs use the cold path until one is ready.
+        if self._closed:
+            return
+        self._loop = asyncio.get_running_loop()
+        missing = self.size - len(self._workers) - self._starting
+        for _ in range(max(0, missing)):
+            self._starting += 1
+            self._loop.create_task(self._spawn())
+
+    async def _spawn(self) -> None:
+        w = _Worker(self.modules)
+        try:
+            await w.start()
+            self._workers.append(w)
+            self._idle.append(w)
+        except Exception:
+            w.close()
+        finally:
+            self._starting -= 1
+
+    async def wait_ready(self, timeout: float = ZYGOTE_START_SEC) -> int:
+        self.start()
+        end = asyncio.get_running_loop().time() + timeout
+        while self._starting and asyncio.get_running_loop().time() < end:
+            await asyncio.sleep(0.05)
+        return len(self._idle)
+
+    def _retire(self, w: _Worker) -> None:
+        w.close()
+        if w in self._workers:
+            self._workers.remove(w)
+
+    async def run(self, user_code: str, cwd: str, timeout: float, complete=None,
+                  env: Optional[Dict[str, str]] = None) -> Optional[RunResult]:
+        """Run on an idle warm worker; None means no worker was free (caller should cold-spawn)."""
+        if self._closed:
+            return None
+        self.start()
+        while self._idle:
+            w = self._idle.pop()
+            if w.alive:
+                break
+            self._retire(w)
+        else:
+            return None
+
+        with open(os.path.join(cwd, USER_FILE), "w", encoding="utf-8") as f:
+            f.write(user_code)
+        try:
+            return await w.run(cwd, timeout, complete, env)
+        finally:
+            if w.draining is not None:
+                w.draining.add_done_callback(lambda _f, w=w: self._release(w))
+            else:
+                self._release(w)
+
+    def _release(self, w: _Worker) -> None:
+        w.draining = None
+        if w.alive and w.sock is not None:
+            self._idle.append(w)
+        else:
+            self._retire(w)
+            self.start()
+
+    def close(self) -> None:
+        self._closed = True
+        for w in list(self._workers):
+            w.close()
+        self._workers.clear()
+        self._idle.clear()
+
+_pool: Optional[SandboxPool] = None
+
+def get_pool() -> Optional[SandboxPool]:
+    """Return the loop-bound pool, or None when pooling is disabled or unsupported."""
+    global _pool
+    if SANDBOX_POOL_SIZE <= 0 or not hasattr(os, "fork") or not hasattr(socket, "send_fds"):
+        return None
+    loop = asyncio.get_running_loop()
+    if _pool is not None and _pool._loop is not None and _pool._loop is not loop:
+        _pool.close()
+        _pool = None
+    if _pool is None:
+        _pool = SandboxPool(SANDBOX_POOL_SIZE, warm_modules())
+    return _pool
+
+async def startup() -> None:
+    """Warm-up hook for app startup; honours SANDBOX_WARMUP."""
+    pool = get_pool()
+    if pool is not None and SANDBOX_WARMUP == "eager":
+        pool.start()
+
+async def shutdown(grace_sec: float = SHUTDOWN_GRACE_SEC) -> None:
+    """Drain hook for app shutdown: wait (bounded) for in-flight sandbox runs, warm
+    or cold, then stop the zygotes."""
+    sandbox = get_scheduler().sandbox
+    end = time.monotonic() + grace_sec
+    while sandbox.in_use and time.monotonic() < end:
+        await asyncio.sleep(0.05)
+    if _pool is not None:
+        _pool.close()
+
+@atexit.register
+def _shutdown() -> None:
+    if _pool is not None:
+        _pool.close()
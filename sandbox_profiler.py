@@ -0,0 +1,186 @@
+# sandbox_profiler.py
+# Opt-in profiling of generated code (SANDBOX_PROFILE=true). Inside the sandbox a
+# daemon thread samples the main thread's stack every `interval` seconds (and,
+# with memory=True, keeps tracemalloc running) and rewrites PROFILE_FILE in the
+# job dir about once a second. The file therefore survives a kill on timeout; it
+# just misses the last second. The executor reads it back into the run's usage,
+# the orchestrator stores it under runs/<req_id>/ and summarize() turns it into
+# the "hot spots" section of the repair prompt.
+#
+# Imported inside the sandbox (zygote child and cold wrapper): standard library only.
+import json, linecache, os, sys, threading, time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+ENV_VAR = "SANDBOX_PROFILE"
+PROFILE_FILE = ".sandbox_profile.json"
+USER_FILE = "user_code_exec.py"
+FLUSH_SEC = 1.0
+KEEP = 30  # entries per table in the profile file
+# harness frames under the user script; never reported
+_HARNESS = {"runpy.py", "sandbox_zygote.py", "runner_user_code.py"}
+
+def env(interval: float, memory: bool) -> Dict[str, str]:
+    """Extra sandbox env that turns the profiler on for one run."""
+    return {ENV_VAR: json.dumps({"out": PROFILE_FILE, "interval": interval, "memory": memory})}
+
+def _short(path: str) -> str:
+    for marker in ("site-packages" + os.sep, "dist-packages" + os.sep):
+        if marker in path:
+            return path.split(marker, 1)[1]
+    return os.path.basename(path)
+
+class Sampler:
+    def __init__(self, out: str, interval: float = 0.01, memory: bool = False):
+        self.out = os.path.abspath(out)
+        self.interval = max(float(interval), 0.001)
+        self.memory = memory
+        self.samples = 0
+        self.self_counts: Counter = Counter()
+        self.cum_counts: Counter = Counter()
+        self._ident = threading.get_ident()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._t0 = time.monotonic()
+        self._mem_top: Dict[str, Any] = {"current": -1, "top": []}
+
+    def start(self) -> "Sampler":
+        if self.memory:
+            import tracemalloc
+            tracemalloc.start()
+        self._thread = threading.Thread(target=self._loop, name="sandbox-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(1.0)
+        self.flush(finished=True)
+
+    def _loop(self) -> None:
+        next_flush = time.monotonic() + FLUSH_SEC
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._ident)
+            if frame is not None:
+                self._sample(frame)
+            if time.monotonic() >= next_flush:
+                self.flush()
+                next_flush = time.monotonic() + FLUSH_SEC
+
+    def _sample(self, frame) -> None:
+        seen = set()
+        leaf = None
+        while frame is not None:
+            code = frame.f_code
+            name = os.path.basename(code.co_filename)
+            if name not in _HARNESS:
+                if name == USER_FILE:
+                    key = ("line", frame.f_lineno, code.co_name)  # line-level inside the generated script
+                else:
+                    key = ("func", _short(code.co_filename), code.co_name)
+                if leaf is None:
+                    leaf = key
+                seen.add(key)
+            frame = frame.f_back
+        with self._lock:
+            self.samples += 1
+            if leaf is not None:
+                self.self_counts[leaf] += 1
+            self.cum_counts.update(seen)
+
+    def snapshot(self, finished: bool = False) -> Dict[str, Any]:
+        with self._lock:
+            samples, self_counts, cum_counts = self.samples, Counter(self.self_counts), Counter(self.cum_counts)
+        lines, funcs = [], []
+        for key, cum in cum_counts.most_common():
+            kind, where, name = key
+            row = {"self": self_counts.get(key, 0), "cum": cum}
+            if kind == "line" and len(lines) < KEEP:
+                lines.append({"line": where, "func": name,
+                              "code": linecache.getline(os.path.join(os.path.dirname(self.out), USER_FILE), where).strip(),
+                              **row})
+            elif kind == "func" and len(funcs) < KEEP:
+                funcs.append({"func": f"{where}:{name}", **row})
+        prof = {"samples": samples, "interval": self.interval, "elapsed": round(time.monotonic() - self._t0, 3),
+                "finished": finished, "lines": lines, "functions": funcs}
+        if self.memory:
+            prof["memory"] = self._memory()
+        return prof
+
+    def _memory(self) -> Dict[str, Any]:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            return {}
+        current, peak = tracemalloc.get_traced_memory()
+        if current > self._mem_top["current"]:
+            # largest live allocations as of the fullest heap seen at a flush (by
+            # the final flush the script's globals are usually gone already)
+            snap = tracemalloc.take_snapshot().filter_traces(
+                (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)))
+            top = []
+            for stat in snap.statistics("lineno")[:10]:
+                fr = stat.traceback[0]
+                name = os.path.basename(fr.filename)
+                top.append({"where": f"line {fr.lineno}" if name == USER_FILE else f"{_short(fr.filename)}:{fr.lineno}",
+                            "size": stat.size, "count": stat.count})
+            self._mem_top = {"current": current, "top": top}
+        return {"current": current, "peak": peak, "top": self._mem_top["top"]}
+
+    def flush(self, finished: bool = False) -> None:
+        try:
+            tmp = f"{self.out}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.snapshot(finished), f)
+            os.replace(tmp, self.out)
+        except Exception:
+            pass
+
+def from_env() -> Optional[Sampler]:
+    """Sandbox side: start a sampler if the run asked for one."""
+    raw = os.environ.get(ENV_VAR)
+    if not raw:
+        return None
+    try:
+        cfg = json.loads(raw)
+        return Sampler(cfg.get("out") or PROFILE_FILE, cfg.get("interval", 0.01), bool(cfg.get("memory"))).start()
+    except Exception:
+        return None
+
+# -------- server side --------
+def load(cwd: str) -> Optional[Dict[str, Any]]:
+    """Read (and remove) the profile a run left in its job dir."""
+    path = os.path.join(cwd, PROFILE_FILE)
+    try:
+        with open(path) as f:
+            prof = json.load(f)
+        os.remove(path)
+        return prof
+    except (OSError, ValueError):
+        return None
+
+def _mb(n: int) -> str:
+    return f"{n / (1024 * 1024):.1f} MB"
+
+def summarize(prof: Dict[str, Any], top: int = 8) -> str:
+    """Compact hot-spot report of a profile, for the repair prompt."""
+    n = prof.get("samples") or 0
+    state = "finished" if prof.get("finished") else "did not finish (timeout or killed)"
+    out = [f"{n} stack samples over {prof.get('elapsed', 0):.1f} s; the run {state}."]
+    if n:
+        pct = lambda c: f"{100 * c / n:5.1f}%"
+        lines = prof.get("lines") or []
+        if lines:
+            out.append("Hot lines of your script (share of samples spent in the line, incl. calls):")
+            out += [f"  {pct(r['cum'])}  line {r['line']}: {r['code'] or r['func']}" for r in lines[:top]]
+        funcs = sorted(prof.get("functions") or [], key=lambda r: r["self"], reverse=True)
+        funcs = [r for r in funcs if r["self"]][:top]
+        if funcs:
+            out.append("Library functions using the most time themselves:")
+            out += [f"  {pct(r['self'])}  {r['func']}" for r in funcs]
+    mem = prof.get("memory") or {}
+    if mem.get("peak"):
+        where = ", ".join(f"{t['where']} {_mb(t['size'])}" for t in (mem.get("top") or [])[:3])
+        out.append(f"Peak traced memory {_mb(mem['peak'])}" + (f"; largest live allocations: {where}" if where else ""))
+    return "\n".join(out)
@@ -0,0 +1,125 @@
+# sandbox_zygote.py
+# Warm "zygote" interpreter for the sandbox pool. Imports the allowed libraries
+# once, then forks a fresh child per job. Talks to the pool over an AF_UNIX
+# socket (fd given in argv[1]); each job message carries the child's stdout and
+# stderr pipe write-ends as SCM_RIGHTS ancillary data.
+#
+# Protocol (newline-delimited JSON):
+#   zygote -> pool : {"ready": true, "warmed": [...], "failed": [...]}
+#   pool -> zygote : {"cwd": ..., "file": ..., "env": {...}, "limits": {...},
+#                     "cgroup": <path|null>}  + 2 fds
+#   zygote -> pool : {"pid": <child pid>}
+#   zygote -> pool : {"pid": <child pid>, "exit": <code>, "signal": <sig|null>,
+#                     "cpu": <user+sys seconds>, "maxrss": <peak RSS bytes>}
+import os, sys, json, socket, importlib
+import sandbox_limits, sandbox_profiler
+
+def _send(sock: socket.socket, msg: dict) -> None:
+    sock.sendall((json.dumps(msg) + "\n").encode("utf-8"))
+
+def _maxrss_bytes(v: int) -> int:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return v if sys.platform == "darwin" else v * 1024
+
+def _warm(modules):
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    warmed, failed = [], []
+    for name in modules:
+        try:
+            importlib.import_module(name)
+            warmed.append(name)
+        except Exception:
+            failed.append(name)
+    return warmed, failed
+
+def _run_child(job: dict, out_fd: int, err_fd: int) -> None:
+    # Runs in the forked child; never returns.
+    code = 1
+    profiler = None
+    try:
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.dup2(out_fd, 1)
+        os.dup2(err_fd, 2)
+        for fd in (devnull, out_fd, err_fd):
+            os.close(fd)
+        os.chdir(job["cwd"])
+        os.environ.update(job.get("env") or {})
+        if os.environ.get("FETCH_PROXY"):
+            try:
+                import sandbox_fetch_hook
+                sandbox_fetch_hook.install()
+            except Exception:
+                pass
+        sys.argv = [job["file"]]
+        sys.path.insert(0, job["cwd"])
+        sandbox_limits.join_cgroup(job.get("cgroup"))
+        sandbox_limits.apply_rlimits(job.get("limits"))
+        profiler = sandbox_profiler.from_env()
+
+        import runpy, traceback
+        try:
+            runpy.run_path(job["file"], run_name="__main__")
+            code = 0
+        except SystemExit as e:
+            if e.code is None:
+                code = 0
+            elif isinstance(e.code, int):
+                code = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                code = 1
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+    finally:
+        if profiler is not None:
+            profiler.stop()
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except Exception:
+            pass
+        os._exit(code)
+
+def main() -> None:
+    sock = socket.socket(fileno=int(sys.argv[1]))
+    warmed, failed = _warm([m for m in sys.argv[2].split(",") if m] if len(sys.argv) > 2 else [])
+    _send(sock, {"ready": True, "warmed": warmed, "failed": failed})
+
+    buf = b""
+    while True:
+        fds = []
+        while b"\n" not in buf:
+            data, new_fds, _flags, _addr = socket.recv_fds(sock, 65536, 2)
+            fds.extend(new_fds)
+            if not data:
+                return
+            buf += data
+        line, buf = buf.split(b"\n", 1)
+        job = json.loads(line)
+        if len(fds) != 2:
+            for fd in fds:
+                os.close(fd)
+            _send(sock, {"pid": None, "exit": None, "signal": None, "error": "missing fds"})
+            continue
+
+        out_fd, err_fd = fds
+        pid = os.fork()
+        if pid == 0:
+            sock.close()
+            _run_child(job, out_fd, err_fd)
+        os.close(out_fd)
+        os.close(err_fd)
+        _send(sock, {"pid": pid})
+
+        _, status, ru = os.wait4(pid, 0)
+        usage = {"cpu": round(ru.ru_utime + ru.ru_stime, 4), "maxrss": _maxrss_bytes(ru.ru_maxrss)}
+        if os.WIFSIGNALED(status):
+            _send(sock, {"pid": pid, "exit": None, "signal": os.WTERMSIG(status), **usage})
+        else:
+            _send(sock, {"pid": pid, "exit": os.WEXITSTATUS(status), "signal": None, **usage})
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# scheduler.py
+# Earliest-deadline-first admission for the two scarce resources: sandbox
+# executions (bounded per CPU) and LLM calls (bounded by LLM_MAX_CONCURRENCY).
+# The request deadline travels in a contextvar set by handle_request, so any
+# task spawned for the request (hedged candidates, ...) queues with it.
+import asyncio, contextvars, heapq, itertools, os, time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Iterable, List, Optional, Tuple
+import metrics
+from config import (
+    CLIENT_RESPOND_SEC, LLM_MAX_CONCURRENCY, SANDBOX_MAX_CONCURRENCY, SANDBOX_PER_CPU, ADMISSION_SLACK_SEC,
+    ADMISSION_SEED_FRACTION, PLAN_SEC, CODEGEN1_SEC, RUN1_SEC, WORKERS,
+)
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline", default=None)
+
+def set_deadline(deadline: float) -> contextvars.Token:
+    return _deadline.set(deadline)
+
+def reset_deadline(token: contextvars.Token) -> None:
+    _deadline.reset(token)
+
+def current_deadline() -> float:
+    d = _deadline.get()
+    return d if d is not None else time.monotonic() + CLIENT_RESPOND_SEC
+
+class EDFLimiter:
+    """Counting semaphore whose waiters are woken in deadline order.
+
+    A released slot is handed directly to the earliest-deadline waiter. Keeps an
+    EWMA of how long a slot is held, used to estimate queueing delay; it starts at
+    `hold_sec` so admission control works before any history exists."""
+
+    def __init__(self, name: str, capacity: int, alpha: float = 0.2, hold_sec: float = 0.0):
+        self.name = name
+        self.capacity = max(1, capacity)
+        self.in_use = 0
+        self.hold_sec = hold_sec
+        self.alpha = alpha
+        self._heap: List[list] = []
+        self._seq = itertools.count()
+
+    @property
+    def depth(self) -> int:
+        return len(self._heap)
+
+    def ahead_of(self, deadline: float) -> int:
+        """Jobs that would be served before one with this deadline (queued + over capacity)."""
+        return sum(1 for d, _s, _f in self._heap if d <= deadline) + max(0, self.in_use - self.capacity + 1)
+
+    def expected_wait(self, deadline: float) -> float:
+        return self.ahead_of(deadline) / self.capacity * self.hold_sec
+
+    async def acquire(self, deadline: Optional[float] = None) -> None:
+        if self.in_use < self.capacity and not self._heap:
+            self.in_use += 1
+            metrics.QUEUE_WAIT_SECONDS.labels(self.name).observe(0.0)
+            self._publish()
+            return
+        entry = [current_deadline() if deadline is None else deadline, next(self._seq),
+                 asyncio.get_running_loop().create_future()]
+        heapq.heappush(self._heap, entry)
+        self._publish()
+        t0 = time.monotonic()
+        try:
+            await entry[2]
+        except asyncio.CancelledError:
+            if entry[2].done() and not entry[2].cancelled():
+                self.release()  # slot was handed over just as we were cancelled
+            else:
+                self._heap.remove(entry)
+                heapq.heapify(self._heap)
+            self._publish()
+            raise
+        metrics.QUEUE_WAIT_SECONDS.labels(self.name).observe(time.monotonic() - t0)
+        self._publish()
+
+    def release(self) -> None:
+        while self._heap:
+            _d, _s, fut = heapq.heappop(self._heap)
+            if not fut.done():
+                fut.set_result(None)  # in_use unchanged: the slot moves to the waiter
+                self._publish()
+                return
+        self.in_use -= 1
+        self._publish()
+
+    @asynccontextmanager
+    async def slot(self, deadline: Optional[float] = None) -> AsyncIterator[None]:
+        await self.acquire(deadline)
+        t0 = time.monotonic()
+        try:
+            yield
+        finally:
+            self.hold_sec += self.alpha * ((time.monotonic() - t0) - self.hold_sec)
+            self.release()
+
+    def _publish(self) -> None:
+        metrics.QUEUE_DEPTH.labels(self.name).set(len(self._heap))
+        metrics.SLOTS_IN_USE.labels(self.name).set(self.in_use)
+
+def sandbox_slots() -> int:
+    if SANDBOX_MAX_CONCURRENCY > 0:
+        return SANDBOX_MAX_CONCURRENCY
+    # the CPUs are shared by all worker processes
+    return max(1, int(SANDBOX_PER_CPU * (os.cpu_count() or 1) / max(WORKERS, 1)))
+
+class Scheduler:
+    def __init__(self, sandbox_slots: int, llm_slots: int, slack_sec: float = ADMISSION_SLACK_SEC,
+                 seed_fraction: float = ADMISSION_SEED_FRACTION):
+        self.sandbox = EDFLimiter("sandbox", sandbox_slots, hold_sec=seed_fraction * RUN1_SEC)
+        self.llm = EDFLimiter("llm", llm_slots, hold_sec=seed_fraction * (PLAN_SEC + CODEGEN1_SEC) / 2)
+        self.slack_sec = slack_sec
+
+    def expected_sec(self, deadline: float, skip: Iterable[str] = ()) -> float:
+        """Expected time to produce a first answer: plan + codegen LLM calls and one
+        sandbox run (minus cached phases), plus the queueing delay ahead of `deadline`."""
+        skip = set(skip)
+        llm_calls = (0 if "plan" in skip else 1) + (0 if "code" in skip else 1)
+        est = llm_calls * (self.llm.hold_sec + (self.llm.expected_wait(deadline) if llm_calls else 0.0))
+        est += self.sandbox.hold_sec + self.sandbox.expected_wait(deadline)
+        return est + self.slack_sec
+
+    def admit(self, deadline: float, skip: Iterable[str] = ()) -> Tuple[bool, float]:
+        expected = self.expected_sec(deadline, skip)
+        ok = deadline - time.monotonic() >= expected
+        if not ok:
+            metrics.ADMISSION_REJECTED.inc()
+        return ok, expected
+
+    def stats(self) -> dict:
+        return {
+            lim.name: {"capacity": lim.capacity, "in_use": lim.in_use, "queued": lim.depth, "hold_sec": round(lim.hold_sec, 3)}
+            for lim in (self.sandbox, self.llm)
+        }
+
+# One scheduler per event loop (futures are loop-bound), like llm_client.client()
+_sched: Optional[Scheduler] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def get_scheduler() -> Scheduler:
+    global _sched, _loop
+    loop = asyncio.get_running_loop()
+    if _sched is None or _loop is not loop:
+        _sched = Scheduler(sandbox_slots(), LLM_MAX_CONCURRENCY)
+        _loop = loop
+    return _sched
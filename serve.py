@@ -0,0 +1,22 @@
+# serve.py
+# Process entry point (see Procfile): uvicorn with WORKERS worker processes. For
+# WORKERS>1 a fresh PROMETHEUS_MULTIPROC_DIR is prepared before any worker imports
+# metrics, so /metrics on any worker reports the whole server.
+import os, shutil, tempfile
+import uvicorn
+from config import HOST, PORT, WORKERS, SHUTDOWN_GRACE_SEC
+
+def main() -> None:
+    if WORKERS > 1 and not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = os.path.join(tempfile.gettempdir(), f"tds_metrics_{os.getpid()}")
+    metrics_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)  # samples of a previous run
+        os.makedirs(metrics_dir)
+    # uvicorn first waits (bounded) for open requests, then the app's shutdown hooks
+    # drain jobs and sandboxes with the same grace period
+    uvicorn.run("app:app", host=HOST, port=PORT, workers=WORKERS,
+                timeout_graceful_shutdown=int(SHUTDOWN_GRACE_SEC))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import asyncio, fcntl, gzip, io, os, random, shutil, tarfile, time
+from typing import Dict, List, Optional, Set, Tuple
+from config import (
+    RUNS_DIR, ARTIFACT_COMPRESS_MIN_BYTES, ARTIFACT_PACK, ARTIFACT_SAMPLE_SUCCESS_PCT,
+    ARTIFACT_RETENTION_SEC, ARTIFACT_MAX_BYTES, ARTIFACT_GC_INTERVAL_SEC,
+)
+
+class RunArtifacts:
+    """Artifacts of one request (plan.json, code.py, stdout1.txt, ...) under runs/<req_id>.
+
+    put() never touches the disk on the caller's thread. In write-through mode
+    each artifact is written by a worker thread right away; when packing or
+    sampling is enabled they are buffered until finish() decides what to keep.
+    """
+
+    def __init__(self, store: "ArtifactStore", req_id: str):
+        self.store = store
+        self.req_id = req_id
+        self.dir = os.path.join(store.root, req_id)
+        self.names: Set[str] = set()
+        self.buffered = store.pack or store.sample_pct < 100
+        self._buffer: Dict[str, str] = {}
+        self._finished = False
+
+    def put(self, name: str, text: str) -> None:
+        self.names.add(name)
+        if self.buffered:
+            self._buffer[name] = text or ""
+        else:
+            self.store._submit(self._write_file, name, text or "")
+
+    def has(self, name: str) -> bool:
+        return name in self.names
+
+    def finish(self, success: bool) -> None:
+        if self._finished:
+            return
+        self._finished = True
+        if not self.buffered:
+            return
+        items, self._buffer = self._buffer, {}
+        if success and random.uniform(0, 100) >= self.store.sample_pct:
+            return  # not sampled
+        self.store._submit(self._write_packed if self.store.pack else self._write_many, items)
+
+    # -------- worker-thread writers --------
+    def _write_file(self, name: str, text: str) -> None:
+        os.makedirs(self.dir, exist_ok=True)
+        data = text.encode("utf-8")
+        if len(data) >= self.store.compress_min:
+            with gzip.open(os.path.join(self.dir, name + ".gz"), "wb", compresslevel=6) as f:
+                f.write(data)
+        else:
+            with open(os.path.join(self.dir, name), "wb") as f:
+                f.write(data)
+
+    def _write_many(self, items: Dict[str, str]) -> None:
+        for name, text in items.items():
+            self._write_file(name, text)
+
+    def _write_packed(self, items: Dict[str, str]) -> None:
+        os.makedirs(self.store.root, exist_ok=True)
+        path = self.dir + ".tar.gz"
+        tmp = path + ".tmp"
+        with tarfile.open(tmp, "w:gz", compresslevel=6) as tar:
+            for name, text in items.items():
+                data = text.encode("utf-8")
+                info = tarfile.TarInfo(f"{self.req_id}/{name}")
+                info.size = len(data)
+                info.mtime = int(time.time())
+                tar.addfile(info, io.BytesIO(data))
+        os.replace(tmp, path)
+
+class ArtifactStore:
+    """Run-artifact store for runs/ with background writes and retention GC.
+    Entries whose name starts with "_" (e.g. runs/_cache) are never collected."""
+
+    def __init__(self, root: str = RUNS_DIR, compress_min: int = ARTIFACT_COMPRESS_MIN_BYTES,
+                 pack: bool = ARTIFACT_PACK, sample_pct: float = ARTIFACT_SAMPLE_SUCCESS_PCT,
+                 retention_sec: int = ARTIFACT_RETENTION_SEC, max_bytes: int = ARTIFACT_MAX_BYTES,
+                 gc_interval_sec: int = ARTIFACT_GC_INTERVAL_SEC):
+        self.root = root
+        self.compress_min = compress_min
+        self.pack = pack
+        self.sample_pct = sample_pct
+        self.retention_sec = retention_sec
+        self.max_bytes = max_bytes
+        self.gc_interval_sec = gc_interval_sec
+        self._pending: Set[asyncio.Future] = set()
+        self._gc_task: Optional[asyncio.Task] = None
+
+    def open_run(self, req_id: str) -> RunArtifacts:
+        return RunArtifacts(self, req_id)
+
+    def _submit(self, fn, *args) -> None:
+        fut = asyncio.get_running_loop().run_in_executor(None, fn, *args)
+        self._pending.add(fut)
+        fut.add_done_callback(self._pending.discard)
+
+    async def drain(self) -> None:
+        """Wait for queued artifact writes (e.g. on shutdown)."""
+        while self._pending:
+            await asyncio.gather(*list(self._pending), return_exceptions=True)
+
+    # -------- retention GC --------
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        out = []
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return out
+        for n in names:
+            if n.startswith("_") or n.endswith(".tmp"):
+                continue
+            p = os.path.join(self.root, n)
+            try:
+                st = os.stat(p)
+                size = st.st_size
+                if os.path.isdir(p):
+                    size = sum(os.path.getsize(os.path.join(r, f)) for r, _d, fs in os.walk(p) for f in fs)
+            except OSError:
+                continue
+            out.append((st.st_mtime, size, p))
+        return out
+
+    def gc(self) -> int:
+        """Delete runs older than retention_sec, then oldest runs until under max_bytes."""
+        removed = 0
+        now = time.time()
+        keep = []
+        for mtime, size, p in self._entries():
+            if self.retention_sec and now - mtime > self.retention_sec:
+                self._remove(p)
+                removed += 1
+            else:
+                keep.append((mtime, size, p))
+        total = sum(size for _, size, _p in keep)
+        keep.sort()
+        while keep and self.max_bytes and total > self.max_bytes:
+            _, size, p = keep.pop(0)
+            self._remove(p)
+            removed += 1
+            total -= size
+        return removed
+
+    def gc_exclusive(self) -> int:
+        """gc() unless another worker process is collecting right now (flock on runs/_gc.lock)."""
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, "_gc.lock"), "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return 0
+            return self.gc()
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try: os.remove(path)
+            except OSError: pass
+
+    def start_gc(self) -> None:
+        if self.gc_interval_sec > 0 and (self._gc_task is None or self._gc_task.done()):
+            self._gc_task = asyncio.get_running_loop().create_task(self._gc_loop())
+
+    async def _gc_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.gc_exclusive)
+            except Exception:
+                pass
+            await asyncio.sleep(self.gc_interval_sec)
+
+    async def close(self) -> None:
+        if self._gc_task is not None:
+            self._gc_task.cancel()
+            self._gc_task = None
+        await self.drain()
+
+_store: Optional[ArtifactStore] = None
+
+def get_artifact_store() -> ArtifactStore:
+    global _store
+    if _store is None:
+        _store = ArtifactStore()
+    return _store
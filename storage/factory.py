@@ -0,0 +1,23 @@
+from typing import Optional
+from .log_store import LogStore
+from config import LOG_BACKEND, LOG_S3_BUCKET, AWS_REGION, DATABASE_URL
+
+_store: Optional[LogStore] = None
+
+def make_log_store(backend: str = LOG_BACKEND) -> LogStore:
+    b = (backend or "file").lower()
+    if b == "s3":
+        from .log_store_s3 import S3LogStore
+        return S3LogStore(LOG_S3_BUCKET, AWS_REGION)
+    if b == "db":
+        from .log_store_db import DBLogStore
+        return DBLogStore(DATABASE_URL)
+    from .log_store_file import FileLogStore
+    return FileLogStore()
+
+def get_log_store() -> LogStore:
+    """Process-wide log store selected by LOG_BACKEND (file | s3 | db)."""
+    global _store
+    if _store is None:
+        _store = make_log_store()
+    return _store
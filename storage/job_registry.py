@@ -0,0 +1,151 @@
+import json, os, sqlite3, threading, time
+from typing import Any, Dict, List, Optional
+from config import JOB_REGISTRY_PATH
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY, status TEXT NOT NULL, req_id TEXT, worker INTEGER, worker_token TEXT,
+    created REAL, started REAL, finished REAL, phase TEXT, result TEXT, error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished);
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id TEXT NOT NULL, seq INTEGER NOT NULL, event TEXT NOT NULL, PRIMARY KEY (job_id, seq)
+);
+"""
+_COLUMNS = ("id", "status", "req_id", "worker", "worker_token", "created", "started", "finished", "phase", "result", "error")
+
+class JobRegistry:
+    """Job state shared by all worker processes: one SQLite file in WAL mode, so
+    readers in other workers never block the writer. Methods are blocking; callers
+    run them in a worker thread."""
+
+    def __init__(self, path: str = JOB_REGISTRY_PATH):
+        self.path = path
+        self._local = threading.local()
+        d = os.path.dirname(os.path.abspath(path))
+        os.makedirs(d, exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        if "worker_token" not in {r[1] for r in conn.execute("PRAGMA table_info(jobs)")}:
+            conn.execute("ALTER TABLE jobs ADD COLUMN worker_token TEXT")  # registry from an older release
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def put(self, view: Dict[str, Any]) -> None:
+        row = [view.get(c) for c in _COLUMNS]
+        self._conn().execute(
+            f"INSERT OR REPLACE INTO jobs ({','.join(_COLUMNS)}) VALUES ({','.join('?' * len(_COLUMNS))})", row)
+
+    def add_event(self, job_id: str, event: Dict[str, Any]) -> None:
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.execute("INSERT OR REPLACE INTO job_events (job_id, seq, event) VALUES (?, ?, ?)",
+                         (job_id, event["seq"], json.dumps(event, ensure_ascii=False)))
+            conn.execute("UPDATE jobs SET phase = ?, req_id = COALESCE(req_id, ?) WHERE id = ?",
+                         (event.get("phase"), event.get("req_id"), job_id))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        cur = self._conn().execute(f"SELECT {','.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,))
+        row = cur.fetchone()
+        return dict(zip(_COLUMNS, row)) if row else None
+
+    def events(self, job_id: str, after: int = 0) -> List[Dict[str, Any]]:
+        cur = self._conn().execute("SELECT event FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+                                   (job_id, after))
+        return [json.loads(r[0]) for r in cur.fetchall()]
+
+    def expire(self, ttl_sec: float, max_results: int, max_events: int) -> None:
+        """Drop finished jobs past their TTL or beyond the newest max_results, and
+        events beyond the last max_events per job."""
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.execute("DELETE FROM jobs WHERE finished IS NOT NULL AND finished < ?", (time.time() - ttl_sec,))
+            conn.execute("DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE finished IS NOT NULL "
+                         "ORDER BY finished DESC LIMIT -1 OFFSET ?)", (max_results,))
+            conn.execute("DELETE FROM job_events WHERE job_id NOT IN (SELECT id FROM jobs)")
+            conn.execute("DELETE FROM job_events WHERE seq <= (SELECT MAX(seq) FROM job_events e "
+                         "WHERE e.job_id = job_events.job_id) - ?", (max_events,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, job_id: str) -> None:
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            conn.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def fail_orphans(self) -> int:
+        """Mark unfinished jobs of worker processes that no longer exist as failed. A
+        worker is identified by its PID plus process_token(), so a job left behind
+        by a previous boot does not look alive when a new worker reuses the PID."""
+        conn = self._conn()
+        rows = conn.execute("SELECT id, worker, worker_token FROM jobs WHERE finished IS NULL").fetchall()
+        dead = [job_id for job_id, pid, token in rows if not _alive(pid, token)]
+        for job_id in dead:
+            conn.execute("UPDATE jobs SET status = 'failed', error = 'worker exited', finished = ? WHERE id = ?",
+                         (time.time(), job_id))
+        return len(dead)
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+def _boot_id() -> str:
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+def process_token(pid: int) -> Optional[str]:
+    """Identity of a running process beyond its PID: the kernel boot id plus the
+    process start time (clock ticks since boot, field 22 of /proc/<pid>/stat).
+    None where /proc is unavailable or the process is gone."""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # comm (field 2) may contain spaces and parentheses; fields after it are plain
+    fields = stat[stat.rfind(b")") + 2:].split()
+    if len(fields) < 20:
+        return None
+    return f"{_boot_id()}:{fields[19].decode()}"
+
+def _alive(pid: Optional[int], token: Optional[str] = None) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    if token is not None:
+        current = process_token(pid)
+        if current is not None and current != token:
+            return False  # the PID now belongs to another process
+    return True
@@ -1,5 +1,7 @@
-from typing import Protocol, Dict, Any
+from typing import Protocol, Dict, Any, List
 
 class LogStore(Protocol):
     async def init(self) -> None: ...
     async def save(self, req_id: str, entry: Dict[str, Any]) -> None: ...
+    async def close(self) -> None: ...
+    async def recent(self, limit: int) -> List[Dict[str, Any]]: ...
@@ -0,0 +1,103 @@
+import asyncio, time
+from abc import ABC, abstractmethod
+from typing import Dict, Any, List, Optional
+from .log_store import LogStore
+from config import LOG_QUEUE_MAX, LOG_BATCH_SIZE, LOG_FLUSH_SEC
+
+class BufferedLogStore(LogStore, ABC):
+    """Base for background-flushed log backends.
+
+    save() only enqueues onto a bounded in-memory queue (entries are dropped and
+    counted when it is full, so logging never blocks a request). A flusher task
+    group-commits up to batch_size entries, or whatever arrived within flush_sec,
+    by calling _write_batch() in a worker thread.
+    """
+
+    def __init__(self, max_queue: int = LOG_QUEUE_MAX, batch_size: int = LOG_BATCH_SIZE, flush_sec: float = LOG_FLUSH_SEC):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_sec = flush_sec
+        self.dropped = 0
+        self.failed = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._opened = False
+
+    # -------- backend hooks (run in a worker thread) --------
+    @abstractmethod
+    def _write_batch(self, records: List[Dict[str, Any]]) -> None:
+        """Persist one batch of entries, in order; raising counts the batch as failed."""
+
+    def _open(self) -> None: ...
+    def _close(self) -> None: ...
+    def _read_recent(self, limit: int) -> List[Dict[str, Any]]: return []
+
+    # -------- LogStore --------
+    async def init(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._task is not None and self._loop is loop and not self._task.done():
+            return
+        if not self._opened:
+            await asyncio.to_thread(self._open)
+            self._opened = True
+        self._loop = loop
+        self._queue = asyncio.Queue(self.max_queue)
+        self._task = loop.create_task(self._flusher())
+
+    async def save(self, req_id: str, entry: Dict[str, Any]) -> None:
+        if self._task is None or self._loop is not asyncio.get_running_loop():
+            await self.init()
+        try:
+            self._queue.put_nowait({"ts": round(time.time(), 3), "req_id": req_id, **entry})
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def recent(self, limit: int) -> List[Dict[str, Any]]:
+        """Up to `limit` most recently persisted entries, oldest first (best effort)."""
+        try:
+            return await asyncio.to_thread(self._read_recent, limit)
+        except Exception:
+            return []
+
+    async def flush(self) -> None:
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        await self.flush()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._opened:
+            await asyncio.to_thread(self._close)
+            self._opened = False
+
+    async def _flusher(self) -> None:
+        loop = asyncio.get_running_loop()
+        q = self._queue
+        while True:
+            batch = [await q.get()]
+            deadline = loop.time() + self.flush_sec
+            while len(batch) < self.batch_size:
+                while not q.empty() and len(batch) < self.batch_size:
+                    batch.append(q.get_nowait())
+                remaining = deadline - loop.time()
+                if len(batch) >= self.batch_size or remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(q.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except Exception:
+                self.failed += len(batch)
+            finally:
+                for _ in batch:
+                    q.task_done()
@@ -1,18 +1,52 @@
-# Optional Postgres logger (skeleton)
-from typing import Dict, Any
-from .log_store import LogStore
+# SQL logger (Postgres in production, SQLite for local runs/tests) with batched inserts
+import json
+from typing import Dict, Any, List
+from .log_store_buffered import BufferedLogStore
+from config import LOG_DB_POOL_SIZE, LOG_DB_TABLE
 
-class DBLogStore(LogStore):
-    def __init__(self, database_url: str):
+class DBLogStore(BufferedLogStore):
+    def __init__(self, database_url: str, table: str = LOG_DB_TABLE, pool_size: int = LOG_DB_POOL_SIZE, **kw):
+        super().__init__(**kw)
         self.url = database_url
-        self._ready = False
+        self.table_name = table
+        self.pool_size = pool_size
+        self.engine = None
+        self.table = None
 
-    async def init(self) -> None:
-        # TODO: create engine/tables with SQLAlchemy
-        self._ready = True
+    def _open(self) -> None:
+        from sqlalchemy import create_engine, MetaData, Table, Column, Integer, Float, String, Text
+        opts: Dict[str, Any] = {"pool_pre_ping": True}
+        if not self.url.startswith("sqlite"):
+            opts.update(pool_size=self.pool_size, max_overflow=self.pool_size)
+        self.engine = create_engine(self.url, **opts)
+        md = MetaData()
+        self.table = Table(
+            self.table_name, md,
+            Column("id", Integer, primary_key=True, autoincrement=True),
+            Column("ts", Float, index=True),
+            Column("req_id", String(64), index=True),
+            Column("phase", String(64)),
+            Column("entry", Text),
+        )
+        md.create_all(self.engine)
 
-    async def save(self, req_id: str, entry: Dict[str, Any]) -> None:
-        if not self._ready:
-            return
-        # TODO: insert row
-        pass
+    def _write_batch(self, records: List[Dict[str, Any]]) -> None:
+        rows = [{
+            "ts": r.get("ts"),
+            "req_id": r.get("req_id"),
+            "phase": r.get("phase"),
+            "entry": json.dumps(r, ensure_ascii=False),
+        } for r in records]
+        with self.engine.begin() as conn:
+            conn.execute(self.table.insert(), rows)
+
+    def _read_recent(self, limit: int) -> List[Dict[str, Any]]:
+        from sqlalchemy import select
+        q = select(self.table.c.entry).order_by(self.table.c.id.desc()).limit(limit)
+        with self.engine.connect() as conn:
+            rows = [json.loads(e) for (e,) in conn.execute(q)]
+        return rows[::-1]
+
+    def _close(self) -> None:
+        if self.engine is not None:
+            self.engine.dispose()
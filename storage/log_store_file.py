@@ -1,16 +1,76 @@
-import os, json
-from typing import Dict, Any
-from .log_store import LogStore
-from config import LOG_DIR, LOG_FILE
-
-class FileLogStore(LogStore):
-    def __init__(self):
-        os.makedirs(LOG_DIR, exist_ok=True)
-        self.path = os.path.join(LOG_DIR, LOG_FILE)
-
-    async def init(self) -> None:
-        os.makedirs(LOG_DIR, exist_ok=True)
-
-    async def save(self, req_id: str, entry: Dict[str, Any]) -> None:
-        with open(self.path, "a", encoding="utf-8") as f:
-            f.write(json.dumps({"req_id": req_id, **entry}, ensure_ascii=False) + "\n")
+import os, json, fcntl, gzip, shutil, time
+from typing import Dict, Any, List
+from .log_store_buffered import BufferedLogStore
+from config import LOG_DIR, LOG_FILE, LOG_ROTATE_BYTES, LOG_ROTATE_KEEP
+
+class FileLogStore(BufferedLogStore):
+    """JSON-lines file, appended in batches; rotated at LOG_ROTATE_BYTES into
+    gzip-compressed siblings (app.log.<ms>.gz), keeping LOG_ROTATE_KEEP of them.
+    Appends and rotation hold an flock on app.log.lock, so several worker
+    processes can share one file without interleaving or losing lines."""
+
+    def __init__(self, log_dir: str = LOG_DIR, log_file: str = LOG_FILE,
+                 rotate_bytes: int = LOG_ROTATE_BYTES, keep: int = LOG_ROTATE_KEEP, **kw):
+        super().__init__(**kw)
+        os.makedirs(log_dir, exist_ok=True)
+        self.dir = log_dir
+        self.path = os.path.join(log_dir, log_file)
+        self.rotate_bytes = rotate_bytes
+        self.keep = keep
+
+    def _open(self) -> None:
+        os.makedirs(self.dir, exist_ok=True)
+
+    def _write_batch(self, records: List[Dict[str, Any]]) -> None:
+        data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+        with open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # opened under the lock: another worker may have just rotated the file
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(data)
+                size = f.tell()
+            if self.rotate_bytes and size >= self.rotate_bytes:
+                self._rotate()
+
+    def _read_recent(self, limit: int) -> List[Dict[str, Any]]:
+        chunks: List[List[Dict[str, Any]]] = []
+        n = 0
+        for path in [self.path] + self.rotated_files()[::-1]:
+            if n >= limit:
+                break
+            try:
+                opener = gzip.open if path.endswith(".gz") else open
+                with opener(path, "rt", encoding="utf-8") as f:
+                    lines = f.readlines()[-(limit - n):]
+            except OSError:
+                continue
+            rows = []
+            for line in lines:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    pass
+            chunks.append(rows)
+            n += len(rows)
+        return [r for rows in reversed(chunks) for r in rows]
+
+    def _rotate(self) -> None:
+        rotated = f"{self.path}.{int(time.time() * 1000)}"
+        os.replace(self.path, rotated)
+        with open(rotated, "rb") as src, gzip.open(rotated + ".gz", "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(rotated)
+        self._prune()
+
+    def rotated_files(self) -> List[str]:
+        """Compressed rotations, oldest first."""
+        base = os.path.basename(self.path) + "."
+        names = [n for n in os.listdir(self.dir) if n.startswith(base) and n.endswith(".gz")]
+        names.sort(key=lambda n: int(n[len(base):-3]) if n[len(base):-3].isdigit() else 0)
+        return [os.path.join(self.dir, n) for n in names]
+
+    def _prune(self) -> None:
+        files = self.rotated_files()
+        for p in files[:max(0, len(files) - self.keep)]:
+            try: os.remove(p)
+            except OSError: pass
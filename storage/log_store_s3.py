@@ -1,18 +1,47 @@
-# Optional S3 logger (skeleton)
-import json, time
-import boto3
-from typing import Dict, Any
-from .log_store import LogStore
+# S3 logger: one JSON-lines object per flushed batch
+import json, time, gzip, uuid
+from typing import Dict, Any, List, Optional
+from .log_store_buffered import BufferedLogStore
+from config import LOG_S3_PREFIX, LOG_S3_ENDPOINT_URL, LOG_S3_GZIP
 
-class S3LogStore(LogStore):
-    def __init__(self, bucket: str, region: str = "us-east-1"):
+class S3LogStore(BufferedLogStore):
+    def __init__(self, bucket: str, region: str = "us-east-1", client=None,
+                 prefix: str = LOG_S3_PREFIX, endpoint_url: Optional[str] = LOG_S3_ENDPOINT_URL,
+                 compress: bool = LOG_S3_GZIP, **kw):
+        super().__init__(**kw)
         self.bucket = bucket
-        self.client = boto3.client("s3", region_name=region)
+        self.prefix = prefix.strip("/")
+        self.compress = compress
+        if client is None:
+            import boto3
+            client = boto3.client("s3", region_name=region, endpoint_url=endpoint_url or None)
+        self.client = client
 
-    async def init(self) -> None:
-        pass
+    def _write_batch(self, records: List[Dict[str, Any]]) -> None:
+        body = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode("utf-8")
+        now = time.gmtime()
+        key = f"{self.prefix}/{time.strftime('%Y/%m/%d', now)}/{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}.jsonl"
+        extra = {}
+        if self.compress:
+            body = gzip.compress(body)
+            key += ".gz"
+            extra["ContentEncoding"] = "gzip"
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=body, ContentType="application/x-ndjson", **extra)
 
-    async def save(self, req_id: str, entry: Dict[str, Any]) -> None:
-        key = f"logs/{req_id}-{int(time.time()*1000)}.json"
-        body = json.dumps(entry, ensure_ascii=False).encode("utf-8")
-        self.client.put_object(Bucket=self.bucket, Key=key, Body=body, ContentType="application/json")
+    def _read_recent(self, limit: int) -> List[Dict[str, Any]]:
+        # Batch keys sort by time within a day; look at today and yesterday only
+        keys: List[str] = []
+        for days_ago in (0, 1):
+            day = time.strftime("%Y/%m/%d", time.gmtime(time.time() - days_ago * 86400))
+            pages = self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=f"{self.prefix}/{day}/")
+            keys.extend(o["Key"] for page in pages for o in page.get("Contents", []))
+        rows: List[Dict[str, Any]] = []
+        for key in sorted(keys, reverse=True):
+            if len(rows) >= limit:
+                break
+            body = self.client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+            if key.endswith(".gz"):
+                body = gzip.decompress(body)
+            batch = [json.loads(line) for line in body.decode("utf-8").splitlines() if line.strip()]
+            rows[:0] = batch[-(limit - len(rows)):]
+        return rows
@@ -0,0 +1,12 @@
+import asyncio
+
+_loop = None
+
+def run(coro):
+    """Run a coroutine to completion on the event loop shared by the test session
+    (module singletons such as the scheduler and the sandbox pool bind to one loop)."""
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+    return _loop.run_until_complete(coro)
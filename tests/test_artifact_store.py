@@ -0,0 +1,49 @@
+import gzip, os, tarfile, tempfile, time
+from storage.artifact_store import ArtifactStore
+from conftest import run as _run
+
+def test_write_through_compresses_large_blobs():
+    with tempfile.TemporaryDirectory() as d:
+        store = ArtifactStore(root=d, compress_min=100, gc_interval_sec=0)
+        async def go():
+            arts = store.open_run("r1")
+            arts.put("code.py", "print(1)")
+            arts.put("stdout1.txt", "x" * 1000)
+            arts.finish(success=True)
+            await store.drain()
+        _run(go())
+        assert sorted(os.listdir(os.path.join(d, "r1"))) == ["code.py", "stdout1.txt.gz"]
+        with gzip.open(os.path.join(d, "r1", "stdout1.txt.gz"), "rt") as f:
+            assert f.read() == "x" * 1000
+
+def test_pack_and_sample_successful_runs():
+    with tempfile.TemporaryDirectory() as d:
+        store = ArtifactStore(root=d, pack=True, sample_pct=0, gc_interval_sec=0)
+        async def go():
+            ok = store.open_run("ok")
+            ok.put("final.txt", "[1]")
+            ok.finish(success=True)
+            bad = store.open_run("bad")
+            bad.put("stderr1.txt", "Traceback")
+            bad.finish(success=False)
+            await store.drain()
+        _run(go())
+        assert os.listdir(d) == ["bad.tar.gz"]
+        with tarfile.open(os.path.join(d, "bad.tar.gz")) as tar:
+            assert tar.extractfile("bad/stderr1.txt").read() == b"Traceback"
+
+def test_gc_by_age_and_total_bytes_skips_private_dirs():
+    with tempfile.TemporaryDirectory() as d:
+        def make(name, size, age):
+            os.makedirs(os.path.join(d, name))
+            with open(os.path.join(d, name, "f"), "w") as f:
+                f.write("x" * size)
+            t = time.time() - age
+            os.utime(os.path.join(d, name), (t, t))
+        make("_cache", 5000, 10 ** 6)
+        make("ancient", 10, 10 ** 6)
+        make("old", 600, 300)
+        make("new", 600, 10)
+        store = ArtifactStore(root=d, retention_sec=3600, max_bytes=1000, gc_interval_sec=0)
+        assert store.gc() == 2
+        assert sorted(os.listdir(d)) == ["_cache", "new"]
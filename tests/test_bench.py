@@ -0,0 +1,43 @@
+import os, sys, tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench"))
+from run_bench import parse_metrics, delta, histogram, quantile, parse_size, compare, main
+
+EXPOSITION = """# TYPE tds_phase_seconds histogram
+tds_phase_seconds_bucket{le="0.1",outcome="ok",phase="plan"} 2.0
+tds_phase_seconds_bucket{le="0.5",outcome="ok",phase="plan"} 8.0
+tds_phase_seconds_bucket{le="1.0",outcome="ok",phase="plan"} 10.0
+tds_phase_seconds_bucket{le="+Inf",outcome="ok",phase="plan"} 10.0
+tds_phase_seconds_bucket{le="0.1",outcome="error",phase="plan"} 0.0
+tds_phase_seconds_bucket{le="0.5",outcome="error",phase="plan"} 0.0
+tds_phase_seconds_bucket{le="1.0",outcome="error",phase="plan"} 0.0
+tds_phase_seconds_bucket{le="+Inf",outcome="error",phase="plan"} 2.0
+tds_fallback_dummy_total 3.0
+"""
+
+def test_histogram_quantiles_from_metric_deltas():
+    before = parse_metrics('tds_fallback_dummy_total 1.0\n')
+    d = delta(parse_metrics(EXPOSITION), before)
+    assert d[("tds_fallback_dummy_total", ())] == 2.0
+    ok = histogram(d, "tds_phase_seconds", phase="plan", outcome="ok")
+    assert ok[-1] == (float("inf"), 10.0)
+    assert abs(quantile(ok, 0.5) - (0.1 + 0.4 * 3 / 6)) < 1e-9
+    both = histogram(d, "tds_phase_seconds", phase="plan")
+    assert both[-1][1] == 12.0 and quantile(both, 0.99) == 1.0
+    assert quantile([], 0.5) is None
+
+def test_sizes_and_compare():
+    assert parse_size("4k") == 4096 and parse_size("2m") == 2 * 1024 ** 2
+    old = {"requests_per_sec": 2.0, "latency": {"p50": 1.0}, "phases": {}}
+    new = {"requests_per_sec": 3.0, "latency": {"p50": 0.5}, "phases": {}}
+    rows = compare(new, old)
+    assert any("requests_per_sec" in r and "+50.0%" in r for r in rows)
+    assert any("latency.p50" in r and "-50.0%" in r for r in rows)
+
+def test_canned_scenario_never_falls_back():
+    # the fake LLM's canned plan/script must answer every request without a dummy
+    with tempfile.TemporaryDirectory() as d:
+        report = main(["--requests", "6", "--concurrency", "3", "--sizes", "1k,64k", "--llm-latency", "0",
+                       "--llm-jitter", "0", "--out", os.path.join(d, "bench.json"), "--max-fallback-rate", "0"])
+    assert report["ok"] == report["requests"] == 6
+    assert report["fallback_rate"] == 0
+    assert report["llm_calls"]["code"] >= 6
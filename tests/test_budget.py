@@ -0,0 +1,60 @@
+import tempfile
+import pytest
+import budget
+from budget import BudgetAllocator, ObservingLogger, STATIC, load_history
+from storage.log_store_file import FileLogStore
+from conftest import run as _run
+
+def _history(alloc, n=40, plan=3.0, codegen=5.0, run=4.0, fail_every=0):
+    for i in range(n):
+        alloc.observe({"phase": "plan", "ok": True, "cached": False, "sec": plan})
+        alloc.observe({"phase": "codegen1", "ok": True, "sec": codegen})
+        alloc.observe({"phase": "codegen2", "ok": True, "sec": codegen})
+        alloc.observe({"phase": "run1", "ok": True, "sec": run})
+        alloc.observe({"phase": "run2", "ok": True, "sec": run})
+        failed = fail_every and i % fail_every == 0
+        alloc.observe({"phase": "validate1", "result": "fail" if failed else "ok", "sec": 0.01})
+
+def test_cold_start_uses_static_needs_and_reserves_repair():
+    alloc = BudgetAllocator(adaptive=True, margin=1.0, min_samples=20)
+    d = alloc.allocate("plan", 285.0)
+    assert d["source"] == "static" and d["need"] == STATIC["plan"]
+    assert d["reserve"] == STATIC["codegen2"] + STATIC["run2"]
+    total = STATIC["plan"] + STATIC["codegen1"] + STATIC["run1"]
+    assert d["budget"] == pytest.approx((285 - d["reserve"]) * STATIC["plan"] / total, abs=1e-3)
+
+def test_history_shrinks_needs_and_skips_reserve_when_first_pass_is_reliable():
+    alloc = BudgetAllocator(adaptive=True, margin=1.0, min_samples=20, repair_min_prob=0.05)
+    _history(alloc)
+    d = alloc.allocate("run1", 20.0)
+    assert d["source"] == "history" and d["need"] == 4.0 and d["p_repair"] == 0.0
+    assert d["reserve"] == 0 and d["budget"] == 20.0
+
+    _history(alloc, fail_every=4)  # first attempts now fail ~12% of the time
+    d = alloc.allocate("run1", 20.0)
+    assert d["reserve"] == 9.0 and d["budget"] == 11.0
+    d = alloc.allocate("run1", 6.0)  # reserve doesn't fit: the first attempt keeps its need
+    assert d["budget"] == 4.0 and d["reserve"] == 2.0
+    assert alloc.allocate("run2", 7.0)["budget"] == 7.0
+
+def test_static_mode_matches_old_caps():
+    alloc = BudgetAllocator(adaptive=False)
+    assert alloc.allocate("plan", 285.0)["budget"] == STATIC["plan"]
+    assert alloc.allocate("run1", 1.0)["budget"] == 10
+
+def test_history_survives_restart_via_log_store(monkeypatch):
+    with tempfile.TemporaryDirectory() as d:
+        store = FileLogStore(log_dir=d, log_file="app.log", batch_size=50, flush_sec=0.01)
+        first = BudgetAllocator(min_samples=5)
+        async def emit():
+            logger = ObservingLogger(store, first)
+            await logger.init()
+            for _ in range(10):
+                await logger.save("r", {"phase": "plan", "ok": True, "cached": False, "sec": 2.5})
+            await store.close()
+        _run(emit())
+        assert list(first.samples["plan"]) == [2.5] * 10
+
+        monkeypatch.setattr(budget, "_allocator", BudgetAllocator(min_samples=5))
+        assert _run(load_history(FileLogStore(log_dir=d, log_file="app.log"))) == 10
+        assert budget.get_allocator().need("plan")[1] == "history"
@@ -0,0 +1,130 @@
+import asyncio, json, os, tempfile
+import orchestrator as orch
+import scheduler
+import decompose
+import format_handler as fmt
+from conftest import run as _run
+
+TASK = """Answer the following questions and respond with a JSON array of strings containing the answer.
+
+1. Which name comes first?
+2. How many names are there?
+3. Which name is longest?
+"""
+
+class ListLogger:
+    def __init__(self): self.entries = []
+    async def init(self): pass
+    async def save(self, req_id, entry): self.entries.append(entry)
+
+async def fake_plan(task_text, spec, data_summary=""): return {"steps":[{"id":"S1","op":"FORMAT","desc":"direct"}]}
+
+LOADER = ('import json, os\nos.makedirs("shared", exist_ok=True)\n'
+          'open("shared/names.txt", "w").write("ada\\ngrace\\nbarbara\\n")\n'
+          'print(json.dumps([{"file": "shared/names.txt", "description": "names, one per line"}]))')
+
+def test_split_and_assemble():
+    spec = fmt.make_format_spec(TASK)
+    preamble, questions = decompose.split_questions(TASK)
+    assert preamble.startswith("Answer the following") and questions[1] == "2. How many names are there?"
+    assert decompose.applicable(spec, TASK)
+    assert not decompose.applicable(spec, "1. only one question")
+    slots = decompose.make_slots(TASK, spec)
+    assert [s.spec["length"] for s in slots] == [1, 1, 1]
+    assert "question 3 of 3" in slots[2].task_text and "Which name is longest?" in slots[2].task_text
+    slots[0].value, slots[0].resolved = "ada", True
+    assert json.loads(decompose.assemble(slots, spec)) == ["ada", "N/A", "N/A"]
+    assert "shared/names.txt: names" in decompose.shared_summary('log line\n[{"file": "shared/names.txt", "description": "names"}]')
+    assert decompose.shared_summary("no manifest") == ""
+
+def test_only_failed_questions_are_repaired(monkeypatch):
+    calls = []
+    summaries = []
+
+    async def loader(task_text, plan, data_summary=""):
+        return LOADER
+
+    async def codegen(task_text, spec, plan, repair_context=None, data_summary=""):
+        q = next(i for i in (1, 2, 3) if f"question {i} of 3" in task_text)
+        calls.append((q, bool(repair_context)))
+        summaries.append(data_summary)
+        if q == 1:
+            return 'names = open("shared/names.txt").read().split()\nprint(f"[\\"{names[0]}\\"]")'
+        if q == 2:
+            if not repair_context:
+                return 'raise ValueError("off by one")'
+            assert "off by one" in repair_context["stderr"]
+            return 'print(f"[\\"{len(open(\'shared/names.txt\').read().split())}\\"]")'
+        return 'print("not json")'
+
+    monkeypatch.setattr(orch, "DECOMPOSE", True)
+    monkeypatch.setattr(orch, "plan_task", fake_plan)
+    monkeypatch.setattr(orch, "generate_loader", loader)
+    monkeypatch.setattr(orch, "generate_code", codegen)
+    monkeypatch.setattr(scheduler, "SANDBOX_MAX_CONCURRENCY", 3)
+    monkeypatch.setattr(scheduler, "_sched", None)
+
+    logger = ListLogger()
+    with tempfile.TemporaryDirectory() as job:
+        os.makedirs(os.path.join(job, "attachments"), exist_ok=True)
+        res = _run(asyncio.wait_for(orch.handle_request(TASK, [], job, logger), timeout=60))
+    assert json.loads(res) == ["ada", "3", "N/A"]
+    assert sorted(calls) == [(1, False), (2, False), (2, True), (3, False), (3, True)]
+    assert all("shared/names.txt" in s for s in summaries)
+    slots = {(e["q"], e["attempt"]): e["result"] for e in logger.entries if e["phase"] == "slot"}
+    assert slots == {(1, 1): "ok", (2, 1): "fail", (2, 2): "ok", (3, 1): "fail", (3, 2): "fail"}
+    done = next(e for e in logger.entries if e["phase"] == "decompose")
+    assert done["resolved"] == [1, 2] and done["questions"] == 3
+    assert done["unresolved"] == {3: "No JSON array found in output"}
+    assert any(e["phase"] == "assemble" and e["result"] == "ok" for e in logger.entries)
+
+def test_slots_get_private_shared_data(monkeypatch):
+    async def loader(task_text, plan, data_summary=""):
+        return LOADER
+
+    async def codegen(task_text, spec, plan, repair_context=None, data_summary=""):
+        if "question 1 of 3" in task_text:  # clobbers its copy of the loader output
+            return 'open("shared/names.txt", "w").write("x")\nprint("[\\"x\\"]")'
+        if "question 2 of 3" in task_text:
+            return 'import time\ntime.sleep(1)\nprint(f"[\\"{len(open(\'shared/names.txt\').read().split())}\\"]")'
+        return 'import time\ntime.sleep(1)\nprint(f"[\\"{open(\'shared/names.txt\').read().split()[0]}\\"]")'
+
+    monkeypatch.setattr(orch, "DECOMPOSE", True)
+    monkeypatch.setattr(orch, "plan_task", fake_plan)
+    monkeypatch.setattr(orch, "generate_loader", loader)
+    monkeypatch.setattr(orch, "generate_code", codegen)
+    monkeypatch.setattr(scheduler, "SANDBOX_MAX_CONCURRENCY", 3)
+    monkeypatch.setattr(scheduler, "_sched", None)
+
+    with tempfile.TemporaryDirectory() as job:
+        os.makedirs(os.path.join(job, "attachments"), exist_ok=True)
+        res = _run(asyncio.wait_for(orch.handle_request(TASK, [], job, ListLogger()), timeout=60))
+    assert json.loads(res) == ["x", "3", "ada"]
+
+def test_open_questions_get_dummy_at_cutoff(monkeypatch):
+    async def loader(task_text, plan, data_summary=""):
+        raise RuntimeError("no loader today")
+
+    async def codegen(task_text, spec, plan, repair_context=None, data_summary=""):
+        if "question 1 of 3" in task_text:
+            return 'print("[\\"ada\\"]")'
+        return 'import time\ntime.sleep(60)'
+
+    monkeypatch.setattr(orch, "DECOMPOSE", True)
+    monkeypatch.setattr(orch, "CLIENT_RESPOND_SEC", 8)
+    monkeypatch.setattr(orch, "DECOMPOSE_RESERVE_SEC", 4)
+    monkeypatch.setattr(orch, "ADMISSION_CONTROL", False)  # the 8 s budget is below the seeded estimate
+    monkeypatch.setattr(orch, "plan_task", fake_plan)
+    monkeypatch.setattr(orch, "generate_loader", loader)
+    monkeypatch.setattr(orch, "generate_code", codegen)
+    monkeypatch.setattr(scheduler, "SANDBOX_MAX_CONCURRENCY", 3)
+    monkeypatch.setattr(scheduler, "_sched", None)
+
+    logger = ListLogger()
+    with tempfile.TemporaryDirectory() as job:
+        os.makedirs(os.path.join(job, "attachments"), exist_ok=True)
+        res = _run(asyncio.wait_for(orch.handle_request(TASK, [], job, logger), timeout=30))
+    assert json.loads(res) == ["ada", "N/A", "N/A"]
+    assert next(e for e in logger.entries if e["phase"] == "loader")["error"] == "no loader today"
+    results = {e["q"]: e["result"] for e in logger.entries if e["phase"] == "slot"}
+    assert results == {1: "ok", 2: "cancelled", 3: "cancelled"}
@@ -1,9 +1,35 @@
-import asyncio, tempfile, os
-from executor import run_user_code
+import tempfile, os, time
+import executor_b64
+from executor_b64 import run_user_code
+from conftest import run as _run
 
 def test_run_user_code_basic():
     code = 'print("[1, 2, 3]")'
     with tempfile.TemporaryDirectory() as d:
-        ok, out, err = asyncio.get_event_loop().run_until_complete(run_user_code(code, d, timeout=5))
+        ok, out, err = _run(run_user_code(code, d, timeout=5))
     assert ok
     assert out.strip() == "[1, 2, 3]"
+
+SPAWNS = ('import subprocess, sys, time\n'
+          'child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])\n'
+          'open("child.pid", "w").write(str(child.pid))\n'
+          'time.sleep(60)')
+
+def _gone(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] == "Z"
+    except FileNotFoundError:
+        return True
+
+def test_timeout_kills_the_scripts_children(monkeypatch):
+    monkeypatch.setattr(executor_b64, "get_pool", lambda: None)  # the cold path
+    with tempfile.TemporaryDirectory() as d:
+        ok, out, err = _run(run_user_code(SPAWNS, d, timeout=2))
+        with open(os.path.join(d, "child.pid")) as f:
+            pid = int(f.read())
+    for _ in range(50):
+        if _gone(pid):
+            break
+        time.sleep(0.05)
+    assert not ok and err == "timeout" and _gone(pid)
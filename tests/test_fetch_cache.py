@@ -0,0 +1,204 @@
+import asyncio, os, tempfile, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import httpx
+import fetch_cache
+from fetch_cache import FetchCache, freshness
+from executor_b64 import run_user_code
+from conftest import run as _run
+
+BIG = bytes(range(256)) * 4096  # 1 MiB
+
+class _Origin(BaseHTTPRequestHandler):
+    """Local stand-in for a remote site: /etag revalidates, /fresh has max-age, /slow is slow,
+    /big is 1 MiB; POST echoes the body."""
+    hits = {}
+
+    def do_GET(self):
+        type(self).hits[self.path] = type(self).hits.get(self.path, 0) + 1
+        if self.path == "/slow":
+            time.sleep(0.3)
+        if self.path == "/etag" and self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.send_header("ETag", '"v1"')
+            self.end_headers()
+            return
+        body = BIG if self.path == "/big" else f"body of {self.path}".encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        if self.path == "/etag":
+            self.send_header("ETag", '"v1"')
+            self.send_header("Cache-Control", "max-age=0")
+        elif self.path == "/nostore":
+            self.send_header("Cache-Control", "no-store")
+        else:
+            self.send_header("Cache-Control", "max-age=60")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        type(self).hits[self.path] = type(self).hits.get(self.path, 0) + 1
+        if "chunked" in self.headers.get("Transfer-Encoding", ""):
+            data = b""
+            while size := int(self.rfile.readline().split(b";")[0], 16):
+                data += self.rfile.read(size)
+                self.rfile.readline()
+            self.rfile.readline()
+        else:
+            data = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        body = b"got " + data
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def _origin():
+    _Origin.hits = {}
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Origin)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv, f"http://127.0.0.1:{srv.server_address[1]}"
+
+def test_freshness_from_headers():
+    assert freshness({"cache-control": "max-age=30"}, 3600, 0) == 30
+    assert freshness({"cache-control": "no-store"}, 3600, 0) is None
+    assert freshness({"cache-control": "no-cache"}, 3600, 5) == 5
+    assert freshness({}, 3600, 0) == 3600
+
+def test_proxy_hit_miss_revalidate_and_per_request_stats():
+    srv, base = _origin()
+    with tempfile.TemporaryDirectory() as d:
+        cache = FetchCache(cache_dir=d)
+
+        async def go():
+            await cache.start()
+            try:
+                async with httpx.AsyncClient(proxy=cache.proxy_url("req-1")) as client:
+                    r1 = await client.get(base + "/fresh")
+                    r2 = await client.get(base + "/fresh")
+                    r3 = await client.get(base + "/etag")
+                    r4 = await client.get(base + "/etag")
+                    r5 = await client.get(base + "/nostore")
+                    r6 = await client.get(base + "/nostore")
+                return [r1, r2, r3, r4, r5, r6]
+            finally:
+                await cache.close()
+
+        rs = _run(go())
+    srv.shutdown()
+    assert [r.headers["x-cache"] for r in rs] == ["MISS", "HIT", "MISS", "REVALIDATED", "MISS", "MISS"]
+    assert all(r.status_code == 200 for r in rs)
+    assert rs[1].text == "body of /fresh" and rs[3].text == "body of /etag"
+    assert _Origin.hits == {"/fresh": 1, "/etag": 2, "/nostore": 2}
+    stats = cache.pop_stats("req-1")
+    assert stats["hit"] == 1
+    assert stats["miss"] == 4 and stats["revalidated"] == 1
+    assert cache.pop_stats("req-1") == {}
+
+def test_concurrent_fetches_are_coalesced():
+    srv, base = _origin()
+    with tempfile.TemporaryDirectory() as d:
+        cache = FetchCache(cache_dir=d)
+
+        async def go():
+            await cache.start()
+            try:
+                return await asyncio.gather(*[cache.fetch("GET", base + "/slow", {}, "t") for _ in range(4)])
+            finally:
+                await cache.close()
+
+        res = _run(go())
+    srv.shutdown()
+    assert _Origin.hits == {"/slow": 1}
+    assert sorted(r[3] for r in res) == ["coalesced"] * 3 + ["miss"]
+    assert all(r[2] == b"body of /slow" for r in res)
+
+def test_sandbox_requests_go_through_proxy(monkeypatch):
+    srv, base = _origin()
+    code = f'import requests\nprint(requests.get("{base}/fresh").text)\n'
+    with tempfile.TemporaryDirectory() as d:
+        cache = FetchCache(cache_dir=d)
+        monkeypatch.setattr(fetch_cache, "_cache", cache)
+
+        async def go():
+            await cache.start()
+            token = fetch_cache.set_request_tag("req-2")
+            try:
+                outs = []
+                for _ in range(2):
+                    with tempfile.TemporaryDirectory() as job:
+                        outs.append(await run_user_code(code, job, timeout=20))
+                return outs
+            finally:
+                fetch_cache.reset_request_tag(token)
+                await cache.close()
+
+        outs = _run(go())
+    srv.shutdown()
+    assert [o[1].strip() for o in outs] == ["body of /fresh"] * 2, outs
+    assert _Origin.hits == {"/fresh": 1}
+    assert fetch_cache.pop_request_stats("req-2") == {"miss": 1, "hit": 1, "bytes": 28}
+
+def test_proxy_forwards_request_bodies_and_maps_failures_to_502(monkeypatch):
+    srv, base = _origin()
+    with tempfile.TemporaryDirectory() as d:
+        cache = FetchCache(cache_dir=d)
+
+        async def chunks():
+            yield b"a=1&"
+            yield b"b=2"
+
+        async def boom(*a, **kw):
+            raise RuntimeError("not an httpx error")
+
+        async def go():
+            await cache.start()
+            try:
+                async with httpx.AsyncClient(proxy=cache.proxy_url("req-3")) as client:
+                    sized = await client.post(base + "/echo", content=b"hello=1")
+                    chunked = await client.post(base + "/echo", content=chunks())
+                    get_with_body = await client.request("GET", base + "/fresh", content=b"ignored")
+                    monkeypatch.setattr(cache, "_upstream", boom)
+                    failed = await client.post(base + "/echo", content=b"x")
+                return sized, chunked, get_with_body, failed
+            finally:
+                await cache.close()
+
+        sized, chunked, get_with_body, failed = _run(go())
+    srv.shutdown()
+    assert (sized.status_code, sized.text, sized.headers["x-cache"]) == (200, "got hello=1", "BYPASS")
+    assert chunked.text == "got a=1&b=2"
+    assert get_with_body.text == "body of /fresh"
+    assert failed.status_code == 502 and "RuntimeError" in failed.text
+    assert cache.pop_stats("req-3")["error"] == 1
+
+def test_oversized_response_is_streamed_not_stored():
+    srv, base = _origin()
+    with tempfile.TemporaryDirectory() as d:
+        cache = FetchCache(cache_dir=d, max_object_bytes=64 * 1024)
+        buffered = []
+        upstream = cache._upstream
+
+        async def spy(*a, **kw):
+            res = await upstream(*a, **kw)
+            buffered.append(res[2])
+            return res
+
+        cache._upstream = spy
+
+        async def go():
+            await cache.start()
+            try:
+                async with httpx.AsyncClient(proxy=cache.proxy_url("req-4")) as client:
+                    return [await client.get(base + "/big") for _ in range(2)]
+            finally:
+                await cache.close()
+
+        rs = _run(go())
+        stored = [n for _, _, ns in os.walk(d) for n in ns]
+    srv.shutdown()
+    assert all(r.status_code == 200 and r.content == BIG for r in rs)
+    assert [r.headers["x-cache"] for r in rs] == ["MISS", "MISS"]
+    assert buffered == [None, None] and stored == [] and _Origin.hits == {"/big": 2}
+    assert cache.pop_stats("req-4") == {"miss": 2, "bytes": 2 * len(BIG)}
@@ -0,0 +1,132 @@
+import asyncio, base64, io, json
+import pytest
+from PIL import Image
+import format_handler as fmt
+import metrics
+from conftest import run as _run
+from format_handler import validate_and_coerce, ValidationError, find_last_json_array, data_uri_png_size
+
+def _png_uri(size=(64, 64)):
+    buf = io.BytesIO()
+    Image.new("RGB", size, (200, 10, 10)).save(buf, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode(), len(buf.getvalue())
+
+SPEC = {"container": "json_array", "length": 3,
+        "elements": [{"type": "int"}, {"type": "float", "decimals": 2}, {"type": "data_uri_png", "max_bytes": 100000}]}
+
+def test_last_top_level_array_wins_over_earlier_noise():
+    uri, _ = _png_uri()
+    out = "columns: ['a', 'b']\n[1, 2]\nloading [====]\n" + json.dumps(["7", "0.456", uri]) + "\ndone\n"
+    assert json.loads(validate_and_coerce(out, SPEC)) == [7, 0.46, uri]
+    assert find_last_json_array('{"x": [1, [2]]} [3, [4, 5]] [') == [3, [4, 5]]
+    assert find_last_json_array("w [1. 2.]\n[[1, 2], [3]]\n") == [[1, 2], [3]]
+    assert find_last_json_array("[1]" + "\nw [0. 1.]" * 5000 + "\nend") == [1]
+    assert find_last_json_array("no arrays here") is None
+
+def test_png_size_and_signature_without_full_decode(monkeypatch):
+    monkeypatch.setattr(fmt, "PNG_RECOMPRESS", False)
+    uri, n = _png_uri((300, 300))
+    assert data_uri_png_size(uri) == n
+    spec = {**SPEC, "elements": SPEC["elements"][:2] + [{"type": "data_uri_png", "max_bytes": n - 1}]}
+    with pytest.raises(ValidationError, match="PNG too large"):
+        validate_and_coerce(json.dumps([1, 1, uri]), spec)
+    fake = "data:image/png;base64," + base64.b64encode(b"GIF89a" + b"\0" * 50).decode()
+    with pytest.raises(ValidationError, match="not a PNG"):
+        validate_and_coerce(json.dumps([1, 1, fake]), SPEC)
+    for corrupt in (uri[:200] + "!!not*base64!!" + uri[214:], uri[:-3]):
+        with pytest.raises(ValidationError, match="not valid base64"):
+            validate_and_coerce(json.dumps([1, 1, corrupt]), SPEC)
+
+def test_deeply_nested_junk_is_not_an_array():
+    spec = {"container": "json_array", "length": 1, "elements": [{"type": "string"}]}
+    with pytest.raises(ValidationError, match="No JSON array"):
+        validate_and_coerce("[" * 5000, spec)
+    assert find_last_json_array("[" * 5000 + '["a"]') == ["a"]
+    assert find_last_json_array("[" * 5000 + '\nlog\n["b"]\nbye') == ["b"]
+
+def test_length_padding_text_and_compiled_cache():
+    spec = {"container": "json_array", "length": 2, "elements": [{"type": "string"}, {"type": "string"}]}
+    assert validate_and_coerce("[1]", spec) == '["1", "N/A"]'
+    assert validate_and_coerce("[1, 2, 3]", spec) == '["1", "2"]'
+    with pytest.raises(ValidationError):
+        validate_and_coerce("nothing", spec)
+    assert validate_and_coerce("  hi \n", {"container": "text"}) == "hi"
+    assert fmt.compile_spec(dict(spec)) is fmt.compile_spec(spec)
+
+def _chart_uri(size=(1200, 900), noise=False):
+    if noise:
+        import os
+        im = Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3))
+        buf = io.BytesIO()
+        im.save(buf, format="PNG")
+    else:  # an antialiased scatter plot, the usual oversized answer
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+        import numpy as np
+        rng = np.random.default_rng(0)
+        fig, ax = plt.subplots(figsize=(size[0] / 100, size[1] / 100), dpi=100)
+        x = rng.normal(size=3000)
+        ax.scatter(x, x + rng.normal(size=3000), c=rng.random(3000), cmap="viridis", alpha=0.6)
+        ax.plot([-3, 3], [-3, 3], "r:")
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png")
+        plt.close(fig)
+    return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode(), len(buf.getvalue())
+
+def test_oversized_png_is_recompressed_and_reported():
+    uri, n = _chart_uri()
+    assert n > 100000
+    sink = []
+    token = fmt.set_png_sink(sink)
+    try:
+        out = json.loads(validate_and_coerce(json.dumps([1, 1, uri]), SPEC))
+        reports = fmt.drain_png_reports()
+    finally:
+        fmt.reset_png_sink(token)
+    small = out[2]
+    assert small != uri and data_uri_png_size(small) <= 100000
+    im = Image.open(io.BytesIO(base64.b64decode(small[len("data:image/png;base64,"):])))
+    assert im.format == "PNG" and min(im.size) >= fmt.PNG_MIN_SIDE_PX
+    assert len(reports) == 1 and reports[0]["ok"] and reports[0]["bytes"] == n
+    assert reports[0]["final_bytes"] == data_uri_png_size(small) and reports[0]["steps"][0].startswith("optimize")
+    assert sink == []
+
+def test_png_that_cannot_shrink_enough_still_fails(monkeypatch):
+    monkeypatch.setattr(fmt, "PNG_MIN_SIDE_PX", 200)
+    uri, n = _chart_uri((400, 300), noise=True)
+    spec = {**SPEC, "elements": SPEC["elements"][:2] + [{"type": "data_uri_png", "max_bytes": 2000}]}
+    with pytest.raises(ValidationError, match=r"PNG too large: .*recompression: .*below 200 px"):
+        validate_and_coerce(json.dumps([1, 1, uri]), spec)
+
+def test_recompression_runs_off_the_event_loop_and_is_counted_once():
+    uri, _ = _chart_uri()
+    stdout = json.dumps([1, 1, uri])
+    fmt.shrink_png.cache_clear()
+    fit = metrics.PNG_RECOMPRESS.labels("fit")
+    before = fit._value.get()
+    with pytest.raises(ValidationError, match="PNG too large"):
+        validate_and_coerce(stdout, SPEC, recompress=False)  # the early-completion check
+    assert fit._value.get() == before
+
+    async def go():
+        ticks = 0
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.005)
+                ticks += 1
+        t = asyncio.ensure_future(ticker())
+        token = fmt.set_png_sink([])
+        try:
+            first = await fmt.validate_and_coerce_async(stdout, SPEC)
+            second = await fmt.validate_and_coerce_async(stdout, SPEC)
+            reports = fmt.drain_png_reports()
+        finally:
+            fmt.reset_png_sink(token)
+            t.cancel()
+        return first, second, reports, ticks
+
+    first, second, reports, ticks = _run(go())
+    assert first == second and len(reports) == 2 and ticks > 5
+    assert fit._value.get() == before + 1
@@ -0,0 +1,86 @@
+import json, os, tempfile
+import pandas as pd
+import orchestrator as orch
+from ingest import ingest_attachments, render_summary
+from conftest import run as _run
+
+def _job(d):
+    att = os.path.join(d, "attachments")
+    os.makedirs(att)
+    with open(os.path.join(att, "sales.csv"), "w") as f:
+        f.write("region,amount\n" + "".join(f"r{i % 3},{i * 1.5}\n" for i in range(50)))
+    with open(os.path.join(att, "people.json"), "w") as f:
+        json.dump([{"name": "a", "age": 3}, {"name": "b", "age": 5}], f)
+    with open(os.path.join(att, "broken.jsonl"), "w") as f:
+        f.write("{not json\n")
+    with open(os.path.join(att, "questions.txt"), "w") as f:
+        f.write("1. total?")
+    return [{"filename": n, "path": os.path.join(att, n)} for n in sorted(os.listdir(att))]
+
+def test_ingests_tabular_attachments_and_summarises():
+    with tempfile.TemporaryDirectory() as d:
+        summary, report = _run(ingest_attachments(d, _job(d), timeout=60))
+        by_src = {os.path.basename(r["source"]): r for r in report}
+        assert set(by_src) == {"sales.csv", "people.json", "broken.jsonl"}
+        assert "error" in by_src["broken.jsonl"]
+        sales = by_src["sales.csv"]
+        assert sales["rows"] == 50 and sales["columns"] == [["region", "object"], ["amount", "float64"]]
+        loader = getattr(pd, sales["loader"].split(".")[1])
+        fast = loader(os.path.join(d, sales["path"]))
+        pd.testing.assert_frame_equal(fast, pd.read_csv(os.path.join(d, "attachments", "sales.csv")))
+        assert "attachments/sales.csv: 50 rows x 2 cols" in summary
+        assert "amount:float64" in summary and "not pre-ingested" in summary
+
+def test_attachments_dir_keeps_only_the_uploads():
+    with tempfile.TemporaryDirectory() as d:
+        uploads = _job(d)
+        summary, _ = _run(ingest_attachments(d, uploads, timeout=60))
+        att = os.path.join(d, "attachments")
+        assert sorted(os.listdir(att)) == [a["filename"] for a in uploads]
+        for name in os.listdir(att):  # what a generated script typically does
+            with open(os.path.join(att, name), "rb") as f:
+                f.read()
+        assert os.listdir(os.path.join(d, "ingested")) and '"ingested/sales.' in summary
+
+def test_sources_sharing_a_stem_get_separate_copies():
+    with tempfile.TemporaryDirectory() as d:
+        att = os.path.join(d, "attachments")
+        os.makedirs(att)
+        with open(os.path.join(att, "data.csv"), "w") as f:
+            f.write("a,b\n1,2\n")
+        with open(os.path.join(att, "data.json"), "w") as f:
+            json.dump([{"x": "p"}, {"x": "q"}, {"x": "r"}], f)
+        uploads = [{"filename": n, "path": os.path.join(att, n)} for n in sorted(os.listdir(att))]
+        _, report = _run(ingest_attachments(d, uploads, timeout=60))
+        by_src = {os.path.basename(r["source"]): r for r in report}
+        assert by_src["data.csv"]["path"] != by_src["data.json"]["path"]
+        for src, rows, cols in (("data.csv", 1, ["a", "b"]), ("data.json", 3, ["x"])):
+            r = by_src[src]
+            fast = getattr(pd, r["loader"].split(".")[1])(os.path.join(d, r["path"]))
+            assert len(fast) == rows and list(fast.columns) == cols
+
+def test_summary_is_capped():
+    report = [{"source": f"attachments/f{i}.csv", "sheet": "", "path": "p", "loader": "pd.read_pickle",
+               "rows": 1, "columns": [["c" * 50, "int64"]] * 20, "sample": []} for i in range(50)]
+    text = render_summary(report, max_chars=500)
+    assert len(text) < 550 and text.endswith("(summary truncated)")
+
+def test_summary_reaches_plan_and_code_prompts(monkeypatch):
+    seen = {}
+    async def plan(task_text, spec, data_summary=""):
+        seen["plan"] = data_summary
+        return {}
+    async def codegen(task_text, spec, plan, repair_context=None, data_summary="", **kw):
+        seen["code"] = data_summary
+        return 'import pandas as pd, glob\nprint(\'["%d"]\' % len(glob.glob("ingested/*")))'
+    monkeypatch.setattr(orch, "plan_task", plan)
+    monkeypatch.setattr(orch, "generate_code", codegen)
+
+    class Logger:
+        async def init(self): pass
+        async def save(self, req_id, entry): pass
+
+    with tempfile.TemporaryDirectory() as d:
+        res = _run(orch.handle_request("Respond with a JSON array of strings with one item.", _job(d), d, Logger()))
+    assert "sales.csv" in seen["plan"] and seen["code"] == seen["plan"]
+    assert json.loads(res) == ["2"]
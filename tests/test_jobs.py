@@ -0,0 +1,169 @@
+import asyncio, json, os, sqlite3, tempfile, time
+from fastapi.testclient import TestClient
+import app as app_module
+import jobs
+from jobs import JobStore
+from conftest import run as _run
+
+class _Logger:
+    async def init(self): pass
+    async def save(self, req_id, entry): pass
+    async def recent(self, limit): return []
+    async def close(self): pass
+
+def test_job_runs_detached_streams_progress_and_cleans_up(monkeypatch):
+    gate = None
+    async def fake_handle(task_text, attachments, job_dir, logger):
+        await logger.save("r1", {"phase": "plan", "ok": True, "sec": 0.1, "spec": {"big": "x"}})
+        await gate.wait()
+        await logger.save("r1", {"phase": "run1", "ok": True, "sec": 0.2})
+        return '["ok"]'
+    monkeypatch.setattr(jobs, "handle_request", fake_handle)
+
+    async def go():
+        nonlocal gate
+        gate = asyncio.Event()
+        store = JobStore()
+        job_dir = tempfile.mkdtemp(prefix="job_")
+        job = store.submit("t", [], job_dir, _Logger())
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        mid = store.get(job.id).view()
+        chunks = []
+        async def listen():
+            async for chunk in job.stream(keepalive_sec=5):
+                chunks.append(chunk)
+        listener = asyncio.ensure_future(listen())
+        await asyncio.sleep(0.01)
+        gate.set()
+        result = await job.wait()
+        await asyncio.wait_for(listener, 1)
+        return mid, result, chunks, job_dir
+
+    mid, result, chunks, job_dir = _run(go())
+    assert mid["status"] == "running" and mid["phase"] == "plan" and mid["req_id"] == "r1"
+    assert result == '["ok"]' and not os.path.exists(job_dir)
+    progress = [json.loads(c.split("data: ", 1)[1]) for c in chunks if c.startswith("id: ")]
+    assert [e["phase"] for e in progress] == ["plan", "run1"] and [e["seq"] for e in progress] == [1, 2]
+    assert "spec" not in progress[0]
+    assert chunks[-1].startswith("event: done") and '"result": "[\\"ok\\"]"' in chunks[-1]
+
+def test_result_store_is_bounded_with_ttl(monkeypatch):
+    async def fake_handle(task_text, attachments, job_dir, logger):
+        if task_text == "boom":
+            raise ValueError("bad")
+        return task_text
+    monkeypatch.setattr(jobs, "handle_request", fake_handle)
+
+    async def go():
+        store = JobStore(max_results=2, ttl_sec=60)
+        done = [store.submit(str(i), [], tempfile.mkdtemp(), _Logger()) for i in range(3)]
+        await asyncio.gather(*(j.task for j in done))
+        failed = store.submit("boom", [], tempfile.mkdtemp(), _Logger())
+        await failed.task
+        kept = [j.id for j in done if store.get(j.id) is not None]
+        failed.finished = time.time() - 120
+        return store, done, failed, kept
+
+    store, done, failed, kept = _run(go())
+    assert kept == [done[2].id]
+    assert store.get(failed.id) is None and failed.view()["error"] == "failure: bad"
+
+def test_async_submit_and_poll_over_http(monkeypatch):
+    async def fake_handle(task_text, attachments, job_dir, logger):
+        await logger.save("r9", {"phase": "plan", "ok": True})
+        return "[42]"
+    monkeypatch.setattr(jobs, "handle_request", fake_handle)
+    monkeypatch.setattr(app_module, "get_log_store", lambda: _Logger())
+    with TestClient(app_module.app) as client:
+        r = client.post("/api/?async=true", files={"questions.txt": ("q.txt", b"1. what?")})
+        assert r.status_code == 202 and r.headers["location"] == f"/jobs/{r.json()['job_id']}"
+        job_id = r.json()["job_id"]
+        for _ in range(50):
+            view = client.get(f"/jobs/{job_id}").json()
+            if view["status"] == "done":
+                break
+            time.sleep(0.02)
+        assert view["result"] == "[42]" and view["req_id"] == "r9"
+        events = client.get(f"/jobs/{job_id}/events").text
+        assert "event: progress" in events and "event: done" in events
+        assert client.get("/jobs/nope").status_code == 404
+
+        # a delivered sync result is not retained
+        r = client.post("/api/", files={"questions.txt": ("q.txt", b"1. what?")})
+        assert r.text == "[42]" and client.get(f"/jobs/{r.headers['x-job-id']}").status_code == 404
+
+def test_registry_shares_jobs_between_workers(monkeypatch):
+    from storage.job_registry import JobRegistry
+    async def fake_handle(task_text, attachments, job_dir, logger):
+        await logger.save("r5", {"phase": "plan", "ok": True})
+        await asyncio.sleep(0.2)
+        await logger.save("r5", {"phase": "run1", "ok": True})
+        return "[7]"
+    monkeypatch.setattr(jobs, "handle_request", fake_handle)
+    monkeypatch.setattr(jobs, "JOBS_POLL_SEC", 0.02)
+
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "jobs.sqlite3")
+
+        async def go():
+            worker_a = JobStore(registry=JobRegistry(path))
+            worker_b = JobStore(registry=JobRegistry(path))  # e.g. another uvicorn process
+            job = worker_a.submit("t", [], tempfile.mkdtemp(), _Logger())
+            await asyncio.sleep(0.05)
+            mid = await worker_b.view(job.id)
+            chunks = [c async for c in await worker_b.stream(job.id)]
+            await worker_a.close()
+            return job, mid, chunks, await worker_b.view(job.id), await worker_b.view("nope")
+
+        job, mid, chunks, final, missing = _run(go())
+        conn = sqlite3.connect(path)
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert mid["status"] == "running" and mid["phase"] == "plan" and mid["req_id"] == "r5"
+    progress = [json.loads(c.split("data: ", 1)[1]) for c in chunks if c.startswith("id: ")]
+    assert [e["phase"] for e in progress] == ["plan", "run1"]
+    assert chunks[-1].startswith("event: done")
+    assert final["status"] == "done" and final["result"] == "[7]" and missing is None
+
+def test_discarded_job_leaves_memory_and_registry(monkeypatch):
+    from storage.job_registry import JobRegistry
+    async def fake_handle(task_text, attachments, job_dir, logger):
+        await logger.save("r6", {"phase": "plan", "ok": True})
+        return "[" + "x" * 1000 + "]"
+    monkeypatch.setattr(jobs, "handle_request", fake_handle)
+
+    with tempfile.TemporaryDirectory() as d:
+        async def go():
+            store = JobStore(registry=JobRegistry(os.path.join(d, "jobs.sqlite3")))
+            job = store.submit("t", [], tempfile.mkdtemp(), _Logger())
+            await job.task
+            await store.discard(job.id)
+            other = JobStore(registry=JobRegistry(os.path.join(d, "jobs.sqlite3")))
+            view = await other.view(job.id)
+            events = await asyncio.to_thread(other.registry.events, job.id)
+            await store.close()
+            return store, job, view, events
+
+        store, job, view, events = _run(go())
+    assert len(store) == 0 and view is None and events == []
+
+def test_orphaned_jobs_are_failed_on_startup():
+    from storage.job_registry import JobRegistry
+    with tempfile.TemporaryDirectory() as d:
+        reg = JobRegistry(os.path.join(d, "jobs.sqlite3"))
+        reg.put({"id": "j1", "status": "running", "worker": 2 ** 22 + 12345, "created": time.time()})
+        reg.put({"id": "j2", "status": "running", "worker": os.getpid(), "created": time.time()})
+        assert reg.fail_orphans() == 1
+        assert reg.get("j1")["status"] == "failed" and reg.get("j2")["status"] == "running"
+
+def test_reused_pid_with_another_token_is_an_orphan():
+    from storage.job_registry import JobRegistry, process_token
+    me = os.getpid()
+    with tempfile.TemporaryDirectory() as d:
+        reg = JobRegistry(os.path.join(d, "jobs.sqlite3"))
+        # same (live) PID, but written by a worker from a previous boot
+        reg.put({"id": "old", "status": "running", "worker": me, "worker_token": "old-boot:42", "created": time.time()})
+        reg.put({"id": "mine", "status": "running", "worker": me, "worker_token": process_token(me),
+                 "created": time.time()})
+        assert reg.fail_orphans() == (1 if process_token(me) is not None else 0)
+        assert reg.get("mine")["status"] == "running"
@@ -0,0 +1,78 @@
+import asyncio, os, sys, time, json
+import pytest
+import llm_client, scheduler
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench"))
+from fake_llm import FakeResponsesServer
+from conftest import run as _run
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    def make(**kw):
+        srv = FakeResponsesServer(**kw)
+        monkeypatch.setattr(llm_client, "OPENAI_BASE_URL", srv.base_url)
+        monkeypatch.setattr(llm_client, "OPENAI_API_KEY", "sk-test")
+        monkeypatch.setattr(llm_client, "LLM_BACKOFF_BASE_SEC", 0.01)
+        monkeypatch.setattr(llm_client, "_client", None)
+        return srv
+    return make
+
+def test_plan_task_against_fake_endpoint(fake_llm):
+    plan = {"inputs": {}, "steps": [{"id": "S1", "op": "FORMAT", "desc": "x"}], "assumptions": []}
+    with fake_llm(reply=lambda body: json.dumps(plan)) as srv:
+        got = _run(llm_client.plan_task("task", {"container": "text"}))
+    assert got == plan and srv.calls == 1
+
+def test_retries_on_429_and_5xx(fake_llm):
+    with fake_llm(reply=lambda body: "print(1)", statuses=[429, 503]) as srv:
+        code = _run(llm_client.generate_code("task", {"container": "text"}, {}))
+    assert code.endswith("print(1)")
+    assert srv.calls == 3
+
+def test_no_retry_on_4xx(fake_llm):
+    with fake_llm(reply=lambda body: "x", statuses=[400]) as srv:
+        with pytest.raises(Exception):
+            _run(llm_client.compose_answer("ctx", {"container": "text"}))
+    assert srv.calls == 1
+
+def test_concurrency_cap_and_event_loop_stays_free(fake_llm, monkeypatch):
+    monkeypatch.setattr(scheduler, "LLM_MAX_CONCURRENCY", 2)
+    monkeypatch.setattr(scheduler, "_sched", None)
+
+    async def go():
+        ticks = 0
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+        t = asyncio.ensure_future(ticker())
+        await asyncio.gather(*[llm_client.compose_answer("c", {}) for _ in range(5)])
+        t.cancel()
+        return ticks
+
+    with fake_llm(reply=lambda body: "ok", delay=0.2) as srv:
+        ticks = _run(go())
+    assert srv.max_in_flight == 2
+    assert ticks > 10
+
+def test_phase_deadline_cancels_call(fake_llm):
+    with fake_llm(reply=lambda body: "{}", delay=3) as srv:
+        t0 = time.monotonic()
+        with pytest.raises(asyncio.TimeoutError):
+            _run(asyncio.wait_for(llm_client.plan_task("t", {}), timeout=0.2))
+        assert time.monotonic() - t0 < 1.5
+
+def test_client_of_a_previous_loop_is_closed(fake_llm):
+    async def call():
+        await llm_client.compose_answer("c", {})
+        return llm_client._http
+
+    other = asyncio.new_event_loop()
+    with fake_llm(reply=lambda body: "ok"):
+        try:
+            old = other.run_until_complete(call())
+            new = _run(call())
+            _run(asyncio.sleep(0.05))
+        finally:
+            other.close()
+    assert old is not new and old.is_closed and not new.is_closed
@@ -0,0 +1,96 @@
+import gzip, json, os, sqlite3, tempfile
+from storage.log_store_file import FileLogStore
+from storage.log_store_s3 import S3LogStore
+from storage.log_store_db import DBLogStore
+from conftest import run as _run
+
+async def _emit(store, n):
+    await store.init()
+    for i in range(n):
+        await store.save(f"r{i % 3}", {"phase": "run1", "i": i})
+    await store.close()
+
+def test_file_store_batches_rotates_and_gzips():
+    with tempfile.TemporaryDirectory() as d:
+        store = FileLogStore(log_dir=d, log_file="app.log", rotate_bytes=2000, keep=2, batch_size=10, flush_sec=0.01)
+        _run(_emit(store, 200))
+        rotated = store.rotated_files()
+        assert len(rotated) == 2
+        lines = []
+        for p in rotated:
+            with gzip.open(p, "rt") as f:
+                lines += f.read().splitlines()
+        if os.path.exists(store.path):
+            with open(store.path) as f:
+                lines += f.read().splitlines()
+        records = [json.loads(l) for l in lines]
+        assert records[0]["phase"] == "run1" and "ts" in records[0] and records[0]["req_id"].startswith("r")
+        assert records[-1]["i"] == 199
+        assert [r["i"] for r in records] == sorted(r["i"] for r in records)
+
+def test_queue_overflow_drops_instead_of_blocking():
+    with tempfile.TemporaryDirectory() as d:
+        store = FileLogStore(log_dir=d, max_queue=5, flush_sec=0.01)
+        async def go():
+            await store.init()
+            for i in range(50):
+                await store.save("r", {"phase": "x", "i": i})
+            await store.close()
+        _run(go())
+        assert store.dropped > 0
+
+class FakeS3:
+    def __init__(self): self.objects = {}
+    def put_object(self, Bucket, Key, Body, **kw): self.objects[(Bucket, Key)] = (Body, kw)
+
+def test_s3_store_writes_multi_entry_batches():
+    s3 = FakeS3()
+    store = S3LogStore("bucket", client=s3, batch_size=50, flush_sec=0.05)
+    _run(_emit(store, 120))
+    assert 3 <= len(s3.objects) < 120
+    lines = []
+    for (bucket, key), (body, kw) in s3.objects.items():
+        assert key.startswith("logs/") and key.endswith(".jsonl.gz") and kw["ContentEncoding"] == "gzip"
+        lines += gzip.decompress(body).decode().splitlines()
+    assert sorted(json.loads(l)["i"] for l in lines) == list(range(120))
+
+def test_db_store_batched_insert_on_sqlite():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "logs.db")
+        store = DBLogStore(f"sqlite:///{path}", batch_size=25, flush_sec=0.05)
+        _run(_emit(store, 60))
+        rows = sqlite3.connect(path).execute("select req_id, phase, entry from app_logs order by id").fetchall()
+    assert len(rows) == 60
+    assert rows[0][:2] == ("r0", "run1") and json.loads(rows[-1][2])["i"] == 59
+
+def test_recent_reads_back_across_rotations_and_db():
+    with tempfile.TemporaryDirectory() as d:
+        store = FileLogStore(log_dir=d, log_file="app.log", rotate_bytes=1500, keep=5, batch_size=10, flush_sec=0.01)
+        _run(_emit(store, 100))
+        recent = _run(store.recent(30))
+        assert [r["i"] for r in recent] == list(range(70, 100))
+
+        db = DBLogStore(f"sqlite:///{os.path.join(d, 'logs.db')}", batch_size=10, flush_sec=0.01)
+        _run(_emit(db, 25))
+        db._open()
+        assert [r["i"] for r in _run(db.recent(5))] == [20, 21, 22, 23, 24]
+
+def _append_from_worker(log_dir, worker):
+    store = FileLogStore(log_dir=log_dir, rotate_bytes=4096, keep=1000)
+    for i in range(100):
+        store._write_batch([{"worker": worker, "i": i, "pad": "x" * 40}])
+
+def test_file_store_is_safe_across_processes():
+    import multiprocessing
+    with tempfile.TemporaryDirectory() as d:
+        procs = [multiprocessing.get_context("fork").Process(target=_append_from_worker, args=(d, w)) for w in range(4)]
+        for p in procs: p.start()
+        for p in procs: p.join()
+        store = FileLogStore(log_dir=d, keep=1000)
+        rows = []
+        for path in store.rotated_files() + [store.path]:
+            opener = gzip.open if path.endswith(".gz") else open
+            with opener(path, "rt", encoding="utf-8") as f:
+                rows += [json.loads(line) for line in f]
+        assert len(rows) == 400
+        assert sorted((r["worker"], r["i"]) for r in rows) == [(w, i) for w in range(4) for i in range(100)]
@@ -0,0 +1,53 @@
+import os, tempfile
+from fastapi.testclient import TestClient
+import app as app_module
+import orchestrator as orch
+from metrics import phase_timer, PHASE_SECONDS
+from conftest import run as _run
+
+class DummyLogger:
+    def __init__(self): self.entries = []
+    async def init(self): pass
+    async def save(self, req_id, entry): self.entries.append(entry)
+
+def _count(text, name, **labels):
+    want = [f'{k}="{v}"' for k, v in labels.items()]
+    for line in text.splitlines():
+        if line.startswith(f"{name}{{") and all(w in line for w in want):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+def test_phase_timer_records_outcome():
+    before = PHASE_SECONDS.labels("unit", "error")._sum.get()
+    try:
+        with phase_timer("unit") as pt:
+            raise ValueError()
+    except ValueError:
+        pass
+    assert pt.outcome == "error" and pt.sec >= 0
+    assert PHASE_SECONDS.labels("unit", "error")._sum.get() >= before
+
+def test_metrics_endpoint_exposes_phases_and_sandbox(monkeypatch):
+    async def fake_plan(task_text, spec, data_summary=""): return {"steps": []}
+    async def fake_codegen(task_text, spec, plan, repair_context=None, **kw):
+        return 'print("nope")' if repair_context is None else 'print("[\\"ok\\"]")'
+    monkeypatch.setattr(orch, "plan_task", fake_plan)
+    monkeypatch.setattr(orch, "generate_code", fake_codegen)
+
+    client = TestClient(app_module.app)
+    before = client.get("/metrics").text
+    logger = DummyLogger()
+    with tempfile.TemporaryDirectory() as job:
+        os.makedirs(os.path.join(job, "attachments"))
+        res = _run(
+            orch.handle_request("Respond with a JSON array of strings with one item.", [], job, logger))
+    assert res == '["ok"]'
+    text = client.get("/metrics").text
+
+    for phase, outcome in [("plan", "ok"), ("codegen1", "ok"), ("run1", "ok"),
+                           ("validate1", "fail"), ("codegen2", "ok"), ("run2", "ok"), ("validate2", "ok")]:
+        assert _count(text, "tds_phase_seconds_count", phase=phase, outcome=outcome) == \
+            _count(before, "tds_phase_seconds_count", phase=phase, outcome=outcome) + 1, phase
+    assert all("sec" in e for e in logger.entries if e["phase"] in {"plan", "run1", "validate2"})
+    assert "tds_sandbox_cpu_seconds_count" in text
+    assert "tds_requests_inflight 0.0" in text
@@ -1,13 +1,15 @@
 import asyncio, tempfile, os, types
 import orchestrator as orch
+import scheduler
 import format_handler as fmt
+from conftest import run as _run
 
 class DummyLogger:
     async def init(self): pass
     async def save(self, req_id, entry): pass
 
-async def fake_plan(task_text, spec): return {"steps":[{"id":"S1","op":"FORMAT","desc":"direct"}]}
-async def fake_codegen(task_text, spec, plan, repair_context=None): return 'print("[\"N/A\"]")'
+async def fake_plan(task_text, spec, data_summary=""): return {"steps":[{"id":"S1","op":"FORMAT","desc":"direct"}]}
+async def fake_codegen(task_text, spec, plan, repair_context=None, data_summary=""): return 'print("[\"N/A\"]")'
 
 def test_orchestrator_dummy_flow(monkeypatch):
     monkeypatch.setattr(orch, "plan_task", fake_plan)
@@ -16,8 +18,81 @@ def test_orchestrator_dummy_flow(monkeypatch):
     task_text = "Respond with a JSON array of strings with one item."
     with tempfile.TemporaryDirectory() as job:
         os.makedirs(os.path.join(job, "attachments"), exist_ok=True)
-        res = asyncio.get_event_loop().run_until_complete(
-            orch.handle_request(task_text, [], job, DummyLogger())
-        )
+        res = _run(orch.handle_request(task_text, [], job, DummyLogger()))
     arr = fmt.json.loads(res)
     assert isinstance(arr, list) and len(arr) == 1
+
+class ListLogger(DummyLogger):
+    def __init__(self): self.entries = []
+    async def save(self, req_id, entry): self.entries.append(entry)
+
+def test_orchestrator_hedged_first_valid_wins(monkeypatch):
+    scripts = {
+        0.0: 'import time\ntime.sleep(30)\nprint("[\\"slow\\"]")',
+        0.5: 'print("[\\"fast\\"]")',
+        1.0: 'print("not json")',
+    }
+    async def codegen(task_text, spec, plan, repair_context=None, model=None, temperature=None, data_summary=""):
+        return scripts[temperature]
+
+    monkeypatch.setattr(orch, "plan_task", fake_plan)
+    monkeypatch.setattr(orch, "generate_code", codegen)
+    monkeypatch.setattr(orch, "HEDGE_K", 3)
+    monkeypatch.setattr(orch, "HEDGE_TEMPERATURES", "0,0.5,1")
+    monkeypatch.setattr(scheduler, "SANDBOX_MAX_CONCURRENCY", 3)  # one sandbox slot per candidate
+    monkeypatch.setattr(scheduler, "_sched", None)
+
+    logger = ListLogger()
+    task_text = "Respond with a JSON array of strings with one item."
+    with tempfile.TemporaryDirectory() as job:
+        os.makedirs(os.path.join(job, "attachments"), exist_ok=True)
+        res = _run(asyncio.wait_for(orch.handle_request(task_text, [], job, logger), timeout=15))
+    assert fmt.json.loads(res) == ["fast"]
+    outcomes = {e["candidate"]: e["result"] for e in logger.entries if e["phase"] == "hedge"}
+    assert outcomes[0] == "cancelled" and outcomes[1] == "win"
+    assert outcomes[2] in {"fail", "cancelled"}
+
+def test_hedged_candidates_get_private_attachments(monkeypatch):
+    scripts = {
+        0.0: 'open("attachments/data.csv", "w").close()\nimport time\ntime.sleep(30)',
+        0.5: 'import time, json\ntime.sleep(1)\nprint(json.dumps([open("attachments/data.csv").read()]))',
+    }
+    async def codegen(task_text, spec, plan, repair_context=None, model=None, temperature=None, data_summary=""):
+        return scripts[temperature]
+
+    monkeypatch.setattr(orch, "plan_task", fake_plan)
+    monkeypatch.setattr(orch, "generate_code", codegen)
+    monkeypatch.setattr(orch, "INGEST_ENABLED", False)
+    monkeypatch.setattr(orch, "HEDGE_K", 2)
+    monkeypatch.setattr(orch, "HEDGE_TEMPERATURES", "0,0.5")
+    monkeypatch.setattr(scheduler, "SANDBOX_MAX_CONCURRENCY", 2)
+    monkeypatch.setattr(scheduler, "_sched", None)
+
+    task_text = "Respond with a JSON array of strings with one item."
+    with tempfile.TemporaryDirectory() as job:
+        os.makedirs(os.path.join(job, "attachments"), exist_ok=True)
+        with open(os.path.join(job, "attachments", "data.csv"), "w") as f:
+            f.write("a,b\n1,2\n")
+        res = _run(asyncio.wait_for(orch.handle_request(task_text, [], job, ListLogger()), timeout=15))
+        with open(os.path.join(job, "attachments", "data.csv")) as f:
+            original = f.read()
+    assert fmt.json.loads(res) == ["a,b\n1,2\n"] and original == "a,b\n1,2\n"
+
+def test_repair_context_carries_run_profile(monkeypatch):
+    slow = 'import time\ndef work():\n    time.sleep(1.3)\nwork()\nprint("not json")'
+    seen = {}
+    async def codegen(task_text, spec, plan, repair_context=None, data_summary=""):
+        if repair_context:
+            seen.update(repair_context)
+            return 'print("[\\"ok\\"]")'
+        return slow
+    monkeypatch.setattr(orch, "plan_task", fake_plan)
+    monkeypatch.setattr(orch, "generate_code", codegen)
+    monkeypatch.setattr(orch, "SANDBOX_PROFILE", True)
+
+    with tempfile.TemporaryDirectory() as job:
+        os.makedirs(os.path.join(job, "attachments"), exist_ok=True)
+        res = _run(orch.handle_request("Respond with a JSON array of strings with one item.", [], job, DummyLogger()))
+    assert fmt.json.loads(res) == ["ok"]
+    assert seen["run"].startswith("exit reason: ok")
+    assert "the run finished" in seen["profile"] and "line 3: time.sleep(1.3)" in seen["profile"]
@@ -0,0 +1,69 @@
+import base64
+import prompt_builder as pb
+
+def _code_prompt(model="m", **kw):
+    values = dict(task_text="Count rows.", spec_json="{}", plan_json="{}", data_summary="(none)", repair_context="")
+    values.update(kw)
+    return pb.build("code_prompt.txt", model, **values)
+
+def test_templates_are_read_once(monkeypatch):
+    pb._templates.clear()
+    opened = []
+    real_open = open
+    def counting_open(path, *a, **kw):
+        opened.append(path)
+        return real_open(path, *a, **kw)
+    monkeypatch.setattr("builtins.open", counting_open)
+    for _ in range(3):
+        _code_prompt()
+    assert len([p for p in opened if p.endswith("code_prompt.txt")]) == 1
+
+def test_static_instructions_come_first():
+    a = _code_prompt(task_text="Task A").text
+    b = _code_prompt(task_text="Task B", repair_context={"stdout": "x", "stderr": "y"}).text
+    tpl = pb.load_template("code_prompt.txt")
+    prefix = tpl.parts[0][1]
+    assert a.startswith(prefix) and b.startswith(prefix) and "Allowed libs" in prefix
+    for name in ("code_prompt.txt", "loader_prompt.txt", "plan_prompt.txt", "answer_prompt.txt"):
+        # after the instruction block only one-line section headings remain
+        assert all("\n" not in v.strip() for kind, v in pb.load_template(name).parts[1:] if kind == "text"), name
+
+def test_per_question_prompts_share_all_but_the_task():
+    q1 = _code_prompt(task_text="question 1 of 2", spec_json='{"type": "json_array"}').text
+    q2 = _code_prompt(task_text="question 2 of 2", spec_json='{"type": "json_array"}').text
+    shared = q1[:q1.index("question 1")]
+    assert q2.startswith(shared) and "DATA SUMMARY" in shared and "Plan:" in shared
+
+def test_repair_sections_are_cut_to_budget(monkeypatch):
+    monkeypatch.setattr(pb, "PROMPT_SECTION_MAX_TOKENS", 300)
+    blob = "data:image/png;base64," + base64.b64encode(b"\x89PNG" + b"\0" * 300000).decode()
+    stderr = "\n".join(f"  line {i}" for i in range(5000)) + "\nValueError: the real error"
+    p = _code_prompt(repair_context={"stdout": f'["a", "{blob}"]', "stderr": stderr})
+    assert set(p.cut) == {"repair_context.stdout", "repair_context.stderr"}
+    assert p.sections["repair_context.stdout"] <= 300 and p.sections["repair_context.stderr"] <= 300
+    assert "<base64 blob, " in p.text and "ValueError: the real error" in p.text
+    assert "PREVIOUS STDOUT:" in p.text and "PREVIOUS STDERR:" in p.text
+    assert p.tokens == sum(p.sections.values()) < 2000
+
+def test_model_budget_shares_room_between_sections(monkeypatch):
+    monkeypatch.setattr(pb, "_BUDGETS", pb._parse_budgets("small=1200, big=100000"))
+    monkeypatch.setattr(pb, "PROMPT_SECTION_MIN_TOKENS", 50)
+    big = "x" * 40000
+    small = _code_prompt("small", repair_context={"stdout": big, "stderr": "short"}, data_summary=big)
+    assert small.tokens <= 1200 and "repair_context.stderr" not in small.cut
+    assert set(small.cut) == {"repair_context.stdout", "data_summary"}
+    roomy = _code_prompt("big", repair_context={"stdout": "ok", "stderr": ""}, data_summary="d" * 4000)
+    assert roomy.cut == {} and "PREVIOUS STDERR:\n(empty)" in roomy.text
+
+def test_sink_collects_stats_per_prompt():
+    sink = []
+    token = pb.set_sink(sink)
+    try:
+        _code_prompt()
+        pb.build("plan_prompt.txt", "m", task_text="t", spec_json="{}", data_summary="(none)")
+        stats = pb.drain()
+    finally:
+        pb.reset_sink(token)
+    assert [s["prompt"] for s in stats] == ["code_prompt.txt", "plan_prompt.txt"]
+    assert stats[0]["sections"]["static"] > 0 and stats[0]["tokens"] > stats[0]["sections"]["static"]
+    assert sink == [] and pb.drain() == []
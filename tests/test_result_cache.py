@@ -0,0 +1,104 @@
+import asyncio, tempfile, os, time
+import orchestrator as orch
+import result_cache as rc
+from result_cache import ResultCache, cache_key
+from conftest import run as _run
+
+def test_cache_key_normalizes_text_and_hashes_attachments():
+    with tempfile.TemporaryDirectory() as d:
+        p = os.path.join(d, "data.csv")
+        with open(p, "w") as f: f.write("a,b\n1,2\n")
+        atts = [{"field": "data.csv", "filename": "data.csv", "path": p}]
+        k1 = _run(cache_key("1. What is  x?\r\n\n2. y", {"container": "text"}, atts))
+        k2 = _run(cache_key("1. What is x?\n2. y  ", {"container": "text"}, atts))
+        assert k1 == k2
+        with open(p, "w") as f: f.write("a,b\n1,3\n")
+        assert _run(cache_key("1. What is x?\n2. y", {"container": "text"}, atts)) != k1
+
+def test_memory_lru_and_disk_tier_with_ttl():
+    with tempfile.TemporaryDirectory() as d:
+        c = ResultCache(mem_items=1, disk_dir=d, ttl_sec=60, disk_max_bytes=10 ** 6)
+        _run(c.update("a" * 64, plan={"steps": []}))
+        _run(c.update("b" * 64, payload="[1]"))
+        assert "a" * 64 not in c._mem
+        entry, tier = _run(c.get("a" * 64))
+        assert tier == "disk" and entry["plan"] == {"steps": []}
+        entry, tier = _run(c.get("a" * 64))
+        assert tier == "memory"
+
+        c2 = ResultCache(mem_items=4, disk_dir=d, ttl_sec=0, disk_max_bytes=10 ** 6)
+        time.sleep(0.01)
+        assert _run(c2.get("b" * 64)) == ({}, "miss")
+        assert c2.stats["misses"] == 1
+
+def test_disk_size_eviction_drops_oldest():
+    with tempfile.TemporaryDirectory() as d:
+        c = ResultCache(mem_items=8, disk_dir=d, ttl_sec=60, disk_max_bytes=300)
+        _run(c.update("a" * 64, payload="x" * 200))
+        old = c._disk_path("a" * 64)
+        os.utime(old, (time.time() - 10, time.time() - 10))
+        _run(c.update("b" * 64, payload="y" * 200))
+        assert not os.path.exists(old)
+        assert os.path.exists(c._disk_path("b" * 64))
+
+def test_coalesce_runs_pipeline_once():
+    c = ResultCache(mem_items=8, disk_dir=None, ttl_sec=60, disk_max_bytes=0)
+    calls = 0
+
+    async def pipeline():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.1)
+        return "[42]"
+
+    async def go():
+        return await asyncio.gather(*[c.coalesce("k", pipeline) for _ in range(4)])
+
+    results = _run(go())
+    assert calls == 1
+    assert [r for r, _ in results] == ["[42]"] * 4
+    assert sum(co for _, co in results) == 3
+
+class DummyLogger:
+    def __init__(self): self.entries = []
+    async def init(self): pass
+    async def save(self, req_id, entry): self.entries.append(entry)
+
+def test_orchestrator_reuses_cached_payload(monkeypatch):
+    calls = {"plan": 0, "code": 0}
+    async def fake_plan(task_text, spec, data_summary=""):
+        calls["plan"] += 1
+        return {"steps": []}
+    async def fake_codegen(task_text, spec, plan, repair_context=None, **kw):
+        calls["code"] += 1
+        return 'print("[\\"cached\\"]")'
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        monkeypatch.setattr(orch, "plan_task", fake_plan)
+        monkeypatch.setattr(orch, "generate_code", fake_codegen)
+        monkeypatch.setattr(rc, "CACHE_REUSE", "plan,code,payload")
+        monkeypatch.setattr(rc, "CACHE_DIR", cache_dir)
+        monkeypatch.setattr(rc, "_cache", None)
+
+        task_text = "Respond with a JSON array of strings with one item about caching."
+        loggers = []
+        for _ in range(2):
+            logger = DummyLogger()
+            with tempfile.TemporaryDirectory() as job:
+                os.makedirs(os.path.join(job, "attachments"), exist_ok=True)
+                res = _run(orch.handle_request(task_text, [], job, logger))
+            assert res == '["cached"]'
+            loggers.append(logger)
+
+    assert calls == {"plan": 1, "code": 1}
+    hits = [e["hit"] for e in loggers[1].entries if e["phase"] == "cache"]
+    assert hits == ["payload"]
+
+def test_disk_writes_keep_a_running_total_instead_of_walking():
+    with tempfile.TemporaryDirectory() as d:
+        c = ResultCache(mem_items=8, disk_dir=d, ttl_sec=60, disk_max_bytes=10 ** 6)
+        for i in range(20):
+            _run(c.update(f"{i:064d}", payload="x" * 100))
+        _run(c.update(f"{0:064d}", payload="y" * 300))  # overwrite: counted as the size change
+        on_disk = sum(os.path.getsize(os.path.join(r, n)) for r, _, ns in os.walk(d) for n in ns)
+        assert c._budget.scans == 1 and c._budget.total == on_disk
@@ -0,0 +1,68 @@
+import json, os, tempfile, time
+import pytest
+import executor_b64
+import sandbox_io
+from sandbox_io import BoundedBuffer
+from sandbox_pool import SandboxPool
+from conftest import run as _run
+
+def test_bounded_buffer_keeps_head_and_tail():
+    b = BoundedBuffer(4, 6, "stderr")
+    for chunk in (b"abc", b"defgh", b"ij", b"klmnopqrstu", b"vw"):
+        b.feed(chunk)
+    assert b.total == 23 and b.truncated
+    assert b.getvalue() == b"abcd\n...[13 bytes truncated]...\nrstuvw"
+    small = BoundedBuffer(4, 6)
+    small.feed(b"hello")
+    assert small.getvalue() == b"hello" and not small.truncated
+
+FLOOD = 'import sys\nfor _ in range(2000):\n    sys.stdout.write("x" * 1000 + "\\n")\nsys.stderr.write("E" * 100000 + "END")\nprint("[1]")'
+LINGER = 'import time\nprint("[\\"done\\"]", flush=True)\ntime.sleep(20)'
+
+def _is_done(out):
+    return out.rstrip().endswith('["done"]')
+
+@pytest.mark.parametrize("pooled", [False, True])
+def test_output_is_capped_and_early_completion_skips_teardown(monkeypatch, pooled):
+    monkeypatch.setattr(sandbox_io, "SANDBOX_STDOUT_MAX_BYTES", 64 * 1024)
+    monkeypatch.setattr(sandbox_io, "SANDBOX_STDERR_HEAD_BYTES", 1000)
+    monkeypatch.setattr(sandbox_io, "SANDBOX_STDERR_TAIL_BYTES", 1000)
+
+    async def go(d):
+        pool = None
+        if pooled:
+            pool = SandboxPool(1, [])
+            await pool.wait_ready()
+        monkeypatch.setattr(executor_b64, "get_pool", lambda: pool)
+        try:
+            flood = await executor_b64.run_user_code(FLOOD, d, timeout=20)
+            t0 = time.monotonic()
+            early = await executor_b64.run_user_code(LINGER, d, timeout=20, complete=_is_done)
+            early_sec = time.monotonic() - t0
+            again = await executor_b64.run_user_code('print("[2]")', d, timeout=10)
+        finally:
+            if pool is not None:
+                pool.close()
+        return flood, early, early_sec, again
+
+    with tempfile.TemporaryDirectory() as d:
+        (ok, out, err), early, early_sec, again = _run(go(d))
+    assert ok and len(out) < 70 * 1024 and "bytes truncated" in out
+    assert out.rstrip().endswith("[1]")
+    assert err.startswith("E" * 1000) and err.endswith("END") and len(err) < 2100
+    assert early[0] and _is_done(early[1]) and early_sec < 5
+    assert again[0] and again[1].strip() == "[2]"
+
+BURST = 'import time\nprint("loading", flush=True)\ntime.sleep(0.01)\nprint("[\\"done\\"]", flush=True)\ntime.sleep(20)'
+
+def test_check_inside_interval_is_deferred_not_dropped(monkeypatch):
+    monkeypatch.setattr(executor_b64, "get_pool", lambda: None)
+
+    async def go(d):
+        return await executor_b64.run_user_code(BURST, d, timeout=20, complete=_is_done)
+
+    with tempfile.TemporaryDirectory() as d:
+        t0 = time.monotonic()
+        res = _run(go(d))
+        sec = time.monotonic() - t0
+    assert res.usage["reason"] == "early" and _is_done(res[1]) and sec < 5
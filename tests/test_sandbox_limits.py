@@ -0,0 +1,96 @@
+import os, signal, tempfile, time
+import pytest
+import config
+import executor_b64
+import sandbox_limits
+from sandbox_limits import MB, classify, describe
+from sandbox_pool import SandboxPool
+from conftest import run as _run
+
+LIMITS = {"as": 512 * MB, "cpu": 2, "nofile": 64, "fsize": MB, "nproc": 0}
+
+def test_classify_exit_reasons():
+    assert classify(0, None, "", {}, LIMITS) == "ok"
+    assert classify(None, signal.SIGXCPU, "", {}, LIMITS) == "cpu_limit"
+    assert classify(None, signal.SIGKILL, "", {"cpu": 2.1}, LIMITS) == "cpu_limit"
+    assert classify(None, signal.SIGKILL, "", {"cpu": 0.3}, LIMITS) == "signal:SIGKILL"
+    assert classify(None, signal.SIGKILL, "", {"cpu": 0.3, "oom_kill": 1}, LIMITS) == "oom"
+    assert classify(None, signal.SIGSEGV, "", {}, LIMITS) == "signal:SIGSEGV"
+    assert classify(1, None, "Traceback...\nMemoryError", {}, LIMITS) == "memory_limit"
+    assert classify(1, None, "OSError: [Errno 27] File too large", {}, LIMITS) == "fsize_limit"
+    assert classify(1, None, "ValueError: bad", {}, LIMITS) == "error"
+    assert classify(137, None, "", {"oom_kill": 1}, LIMITS) == "oom"
+
+def test_describe_is_one_line():
+    line = describe({"reason": "memory_limit", "cpu": 1.234, "maxrss": 300 * MB, "wall": 2.5}, LIMITS)
+    assert line == "exit reason: memory_limit (address space limit 512 MB); cpu 1.23 s; peak RSS 300 MB; wall 2.50 s"
+
+HOG = 'x = bytearray(1024 * 1024 * 1024)\nprint("[1]")'
+BIG_FILE = 'with open("big.bin", "wb") as f:\n    f.write(b"0" * (4 * 1024 * 1024))\nprint("[1]")'
+SPIN = 'while True:\n    pass'
+
+@pytest.mark.parametrize("pooled", [False, True])
+def test_limits_are_enforced_and_reported(monkeypatch, pooled):
+    monkeypatch.setattr(config, "SANDBOX_RLIMIT_AS_MB", 512)
+    monkeypatch.setattr(config, "SANDBOX_RLIMIT_FSIZE_MB", 1)
+    monkeypatch.setattr(config, "SANDBOX_RLIMIT_CPU_SEC", 1)
+
+    async def go(d):
+        pool = None
+        if pooled:
+            pool = SandboxPool(1, [])
+            await pool.wait_ready()
+        monkeypatch.setattr(executor_b64, "get_pool", lambda: pool)
+        try:
+            return [await executor_b64.run_user_code(code, d, timeout=20) for code in (HOG, BIG_FILE, SPIN, 'print("[2]")')]
+        finally:
+            if pool is not None:
+                pool.close()
+
+    with tempfile.TemporaryDirectory() as d:
+        hog, big, spin, fine = _run(go(d))
+    assert not hog[0] and hog.usage["reason"] == "memory_limit" and "MemoryError" in hog[2]
+    assert not big[0] and big.usage["reason"] == "fsize_limit"
+    assert not spin[0] and spin.usage["reason"] == "cpu_limit"
+    if pooled:  # the zygote reports rusage even for killed children; the cold wrapper can't
+        assert spin.usage["cpu"] >= 0.9
+    assert fine[0] and fine[1].strip() == "[2]" and fine.usage["reason"] == "ok" and fine.usage["maxrss"] > 0
+    assert "exit reason: memory_limit" in describe(hog.usage, sandbox_limits.job_limits())
+
+# leaves a CPU spinner behind that does not hold the output pipes open
+ORPHAN = ('import subprocess, sys\n'
+          'child = subprocess.Popen([sys.executable, "-c", "while True: pass"], stdout=subprocess.DEVNULL,\n'
+          '                         stderr=subprocess.DEVNULL)\n'
+          'open("child.pid", "w").write(str(child.pid))\n'
+          'print("[1]")')
+
+def _gone(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] == "Z"
+    except FileNotFoundError:
+        return True
+
+@pytest.mark.parametrize("pooled", [False, True])
+def test_children_do_not_outlive_the_run(monkeypatch, pooled):
+    async def go(d):
+        pool = None
+        if pooled:
+            pool = SandboxPool(1, [])
+            await pool.wait_ready()
+        monkeypatch.setattr(executor_b64, "get_pool", lambda: pool)
+        try:
+            return await executor_b64.run_user_code(ORPHAN, d, timeout=20)
+        finally:
+            if pool is not None:
+                pool.close()
+
+    with tempfile.TemporaryDirectory() as d:
+        res = _run(go(d))
+        with open(os.path.join(d, "child.pid")) as f:
+            pid = int(f.read())
+    for _ in range(50):
+        if _gone(pid):
+            break
+        time.sleep(0.05)
+    assert res[0] and res[1].strip() == "[1]" and _gone(pid)
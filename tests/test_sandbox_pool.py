@@ -0,0 +1,58 @@
+import tempfile, os
+import pytest
+from sandbox_pool import SandboxPool, allowed_modules_from_prompt
+from conftest import run as _run
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+
+def test_allowed_modules_from_prompt():
+    mods = allowed_modules_from_prompt()
+    assert "pandas" in mods and "bs4" in mods and "PIL" in mods
+    assert "matplotlib.pyplot" in mods
+
+def test_pool_runs_in_job_dir_with_scrubbed_env(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-secret")
+    code = 'import os, json\nprint(json.dumps([os.getcwd(), os.environ.get("OPENAI_API_KEY")]))'
+
+    async def go(d):
+        pool = SandboxPool(1, ["json"])
+        assert await pool.wait_ready() == 1
+        try:
+            first = await pool.run(code, d, timeout=10)
+            second = await pool.run('import sys; sys.stderr.write("boom"); sys.exit(3)', d, timeout=10)
+        finally:
+            pool.close()
+        return first, second
+
+    with tempfile.TemporaryDirectory() as d:
+        (ok, out, err), (ok2, out2, err2) = _run(go(d))
+        assert ok, err
+        assert out.strip() == '["%s", ""]' % os.path.realpath(d)
+        assert not ok2 and err2 == "boom"
+
+def test_pool_timeout_kills_and_worker_is_reused():
+    async def go(d):
+        pool = SandboxPool(1, [])
+        await pool.wait_ready()
+        try:
+            slow = await pool.run("import time\ntime.sleep(30)", d, timeout=1)
+            again = await pool.run('print("[1]")', d, timeout=10)
+        finally:
+            pool.close()
+        return slow, again
+
+    with tempfile.TemporaryDirectory() as d:
+        slow, again = _run(go(d))
+    assert slow == (False, "", "timeout")
+    assert again[0] and again[1].strip() == "[1]"
+
+def test_pool_returns_none_when_busy():
+    async def go(d):
+        pool = SandboxPool(0, [])
+        try:
+            return await pool.run('print(1)', d, timeout=5)
+        finally:
+            pool.close()
+
+    with tempfile.TemporaryDirectory() as d:
+        assert _run(go(d)) is None
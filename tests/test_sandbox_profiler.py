@@ -0,0 +1,59 @@
+import tempfile
+import pytest
+import config
+import executor_b64
+import sandbox_profiler
+from sandbox_pool import SandboxPool
+from conftest import run as _run
+
+SLOW = '''\
+def slow_row(i):
+    total = 0
+    for j in range(2000):
+        total += (i * j) % 7
+    return total
+
+rows = [slow_row(i) for i in range(10 ** 6)]
+print(len(rows))
+'''
+ALLOC = 'import time\nblocks = [bytes(1024 * 1024) for _ in range(64)]\ntime.sleep(1.5)\nprint("[1]")'
+
+@pytest.mark.parametrize("pooled", [False, True])
+def test_profile_survives_timeout_and_names_the_hot_line(monkeypatch, pooled):
+    monkeypatch.setattr(executor_b64, "SANDBOX_PROFILE_MEMORY", True)
+
+    async def go(d):
+        pool = None
+        if pooled:
+            pool = SandboxPool(1, [])
+            await pool.wait_ready()
+        monkeypatch.setattr(executor_b64, "get_pool", lambda: pool)
+        try:
+            slow = await executor_b64.run_user_code(SLOW, d, timeout=2.5, profile=True)
+            alloc = await executor_b64.run_user_code(ALLOC, d, timeout=20, profile=True)
+            plain = await executor_b64.run_user_code('print("[2]")', d, timeout=10)
+        finally:
+            if pool is not None:
+                pool.close()
+        return slow, alloc, plain
+
+    with tempfile.TemporaryDirectory() as d:
+        slow, alloc, plain = _run(go(d))
+    assert slow[2] == "timeout" and slow.usage["reason"] == "timeout"
+    prof = slow.usage["profile"]
+    assert prof["samples"] > 20 and not prof["finished"]
+    hot = prof["lines"][0]
+    assert hot["func"] in ("slow_row", "<listcomp>", "<module>") and hot["cum"] > 0.8 * prof["samples"]
+    assert any(r["func"] == "slow_row" and "total +=" in r["code"] for r in prof["lines"])
+    text = sandbox_profiler.summarize(prof, top=5)
+    assert "did not finish" in text and "total += (i * j) % 7" in text
+
+    assert alloc[0] and alloc.usage["profile"]["finished"]
+    mem = alloc.usage["profile"]["memory"]
+    assert mem["peak"] > 60 * 1024 * 1024 and mem["top"][0]["where"] == "line 2"
+    assert "Peak traced memory" in sandbox_profiler.summarize(alloc.usage["profile"])
+    assert "profile" not in plain.usage
+
+def test_summary_without_samples():
+    assert sandbox_profiler.summarize({"samples": 0, "elapsed": 0.2, "finished": True}) == \
+        "0 stack samples over 0.2 s; the run finished."
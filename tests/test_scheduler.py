@@ -0,0 +1,84 @@
+import asyncio, time
+import orchestrator as orch
+import format_handler as fmt
+import scheduler
+from scheduler import EDFLimiter, Scheduler
+from conftest import run as _run
+
+def test_waiters_are_served_earliest_deadline_first():
+    order = []
+
+    async def job(lim, name, deadline):
+        async with lim.slot(deadline):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    async def go():
+        lim = EDFLimiter("t", 1)
+        first = asyncio.ensure_future(job(lim, "first", 100))
+        await asyncio.sleep(0)
+        later = [asyncio.ensure_future(job(lim, n, d)) for n, d in (("late", 30), ("soon", 10), ("mid", 20))]
+        await asyncio.sleep(0)
+        assert lim.depth == 3 and lim.in_use == 1
+        await asyncio.gather(first, *later)
+        return lim
+
+    lim = _run(go())
+    assert order == ["first", "soon", "mid", "late"]
+    assert lim.in_use == 0 and lim.depth == 0 and lim.hold_sec > 0
+
+def test_cancelled_waiter_leaves_queue():
+    async def go():
+        lim = EDFLimiter("t", 1)
+        await lim.acquire(1)
+        w = asyncio.ensure_future(lim.acquire(2))
+        await asyncio.sleep(0)
+        w.cancel()
+        await asyncio.gather(w, return_exceptions=True)
+        assert lim.depth == 0
+        lim.release()
+        assert lim.in_use == 0
+    _run(go())
+
+def test_admission_accounts_for_queueing():
+    s = Scheduler(sandbox_slots=1, llm_slots=1)
+    s.llm.hold_sec, s.sandbox.hold_sec = 2.0, 3.0
+    deadline = time.monotonic() + 6.5
+    assert s.expected_sec(deadline) == 7.0
+    assert not s.admit(deadline)[0]
+    assert s.admit(deadline, skip=["plan"])[0]
+    s.sandbox.in_use = 1  # a run in progress adds one run's worth of waiting
+    assert s.expected_sec(deadline, skip=["plan"]) == 8.0
+
+def test_hold_estimate_is_seeded_before_any_history():
+    s = Scheduler(sandbox_slots=1, llm_slots=1, seed_fraction=0.5)
+    assert s.sandbox.hold_sec == 0.5 * scheduler.RUN1_SEC
+    assert s.llm.hold_sec == 0.25 * (scheduler.PLAN_SEC + scheduler.CODEGEN1_SEC)
+    deadline = time.monotonic() + 10
+    assert not s.admit(deadline)[0]  # a fresh process does not admit everything
+    assert Scheduler(1, 1, seed_fraction=0.0).admit(deadline)[0]
+
+class ListLogger:
+    def __init__(self): self.entries = []
+    async def init(self): pass
+    async def save(self, req_id, entry): self.entries.append(entry)
+
+def test_request_without_budget_gets_early_dummy(monkeypatch):
+    calls = []
+    async def plan(task_text, spec, data_summary=""):
+        calls.append("plan")
+        return {}
+    monkeypatch.setattr(orch, "plan_task", plan)
+
+    async def go():
+        sched = scheduler.get_scheduler()
+        monkeypatch.setattr(sched.llm, "hold_sec", 10_000.0)
+        logger = ListLogger()
+        res = await orch.handle_request("Respond with a JSON array of strings with one item.", [], ".", logger)
+        return res, logger
+
+    res, logger = _run(go())
+    assert isinstance(fmt.json.loads(res), list) and calls == []
+    adm = next(e for e in logger.entries if e["phase"] == "admission")
+    assert adm["result"] == "reject" and adm["expected"] > adm["remaining"]
+    assert any(e["phase"] == "fallback_dummy" for e in logger.entries)
@@ -0,0 +1,77 @@
+import hashlib, os, tempfile
+import pytest
+from fastapi.testclient import TestClient
+import app as app_module
+import jobs
+from uploads import ingest_multipart, UploadLimitError
+from conftest import run as _run
+
+def _body(parts, boundary="XyZ"):
+    out = b""
+    for field, filename, data in parts:
+        out += (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; "
+                f"filename=\"{filename}\"\r\nContent-Type: text/plain\r\n\r\n").encode() + data + b"\r\n"
+    out += f"--{boundary}--\r\n".encode()
+    return {"content-type": f"multipart/form-data; boundary={boundary}"}, out
+
+async def _chunks(data, size=7):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+def test_streams_hashes_and_dedups_into_cas():
+    payload = b"a,b\n" + b"1,2\n" * 1000
+    headers, body = _body([("questions.txt", "q.txt", b"1. hi"), ("data.csv", "../data.csv", payload)])
+    with tempfile.TemporaryDirectory() as root:
+        cas = os.path.join(root, "cas")
+        jobs = [os.path.join(root, "j1"), os.path.join(root, "j2")]
+        results = []
+        for j in jobs:
+            os.makedirs(j)
+            results.append(_run(ingest_multipart(headers, _chunks(body), j, 10 ** 6, 10 ** 7, cas)))
+        first, second = results
+        csv1 = next(i for i in first if i["field"] == "data.csv")
+        csv2 = next(i for i in second if i["field"] == "data.csv")
+        assert csv1["path"] == os.path.join(jobs[0], "data.csv")
+        assert csv1["sha256"] == hashlib.sha256(payload).hexdigest() and csv1["size"] == len(payload)
+        assert not csv1["deduped"] and csv2["deduped"]
+        blob = os.path.join(cas, csv1["sha256"][:2], csv1["sha256"])
+        assert os.stat(blob).st_mode & 0o777 == 0o444
+        # every job owns a separate, writable inode; the blob is not shared with any
+        inodes = {os.stat(p).st_ino for p in (csv1["path"], csv2["path"], blob)}
+        assert len(inodes) == 3
+        with open(csv1["path"], "ab") as f:
+            f.write(b"tampered")
+        for p in (csv2["path"], blob):
+            with open(p, "rb") as f:
+                assert f.read() == payload
+        assert sorted(os.listdir(jobs[1])) == ["data.csv", "q.txt"]
+
+def test_per_file_and_per_request_limits():
+    headers, body = _body([("questions.txt", "q.txt", b"x" * 100)])
+    with tempfile.TemporaryDirectory() as d:
+        with pytest.raises(UploadLimitError):
+            _run(ingest_multipart(headers, _chunks(body), d, 50, 10 ** 6, None))
+        with pytest.raises(UploadLimitError):
+            _run(ingest_multipart({**headers, "content-length": "999999"}, _chunks(body), d, 10 ** 6, 1000, None))
+
+def test_api_entry_streams_uploads(monkeypatch):
+    seen = {}
+    async def fake_handle(task_text, attachments, job_dir, logger):
+        seen["task"] = task_text
+        seen["files"] = {a["field"]: sorted(a) for a in attachments}
+        return "[]"
+    monkeypatch.setattr(jobs, "handle_request", fake_handle)
+    client = TestClient(app_module.app)
+
+    r = client.post("/api/", files={"questions.txt": ("q.txt", b"1. what?"), "data.csv": ("data.csv", b"a\n1\n")})
+    assert r.status_code == 200 and r.text == "[]"
+    assert seen["task"] == "1. what?"
+    assert "sha256" in seen["files"]["data.csv"]
+
+    monkeypatch.setattr(app_module, "ingest_multipart",
+                        lambda h, s, d: ingest_multipart(h, s, d, max_file_bytes=4))
+    r = client.post("/api/", files={"questions.txt": ("q.txt", b"1. too long")})
+    assert r.status_code == 413
+
+    r = client.post("/api/", files={"data.csv": ("data.csv", b"a")})
+    assert r.status_code == 400
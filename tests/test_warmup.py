@@ -0,0 +1,92 @@
+import asyncio, os, subprocess, sys, time
+from fastapi.testclient import TestClient
+import app as app_module
+import warmup
+from conftest import run as _run
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+from import_profile import parse_importtime, report
+
+class _Logger:
+    async def init(self): pass
+    async def save(self, req_id, entry): pass
+    async def recent(self, limit): return []
+    async def close(self): pass
+
+def test_app_import_leaves_heavy_modules_lazy():
+    out = subprocess.run([sys.executable, "-c", "import sys, app; print(sorted(m for m in ('openai', 'PIL') if m in sys.modules))"],
+                         cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    assert out.strip() == "[]"
+
+def test_prewarm_reports_failures_and_timeouts(monkeypatch):
+    async def ok(): pass
+    async def broken(): raise ConnectionError("no route")
+    async def stuck(): await asyncio.sleep(30)
+    monkeypatch.setattr(warmup, "STEPS", {"llm": broken, "sandbox": stuck, "dummy_png": ok})
+    try:
+        state = _run(warmup.prewarm(timeout=0.2))
+    finally:
+        warmup.reset()
+    assert not state["ready"] and state["sec"] < 5
+    assert state["steps"]["dummy_png"]["ok"]
+    assert state["steps"]["llm"] == {"ok": False, "sec": state["steps"]["llm"]["sec"], "error": "no route"}
+    assert state["steps"]["sandbox"]["error"] == "timeout"
+
+def test_ready_flips_after_prewarm(monkeypatch):
+    async def slow(): await asyncio.sleep(0.3)
+    monkeypatch.setattr(warmup, "STEPS", {"llm": slow, "dummy_png": warmup._warm_dummy_png})
+    monkeypatch.setattr(app_module, "get_log_store", lambda: _Logger())
+    with TestClient(app_module.app) as client:
+        assert client.get("/health").status_code == 200
+        assert client.get("/ready").status_code == 503
+        for _ in range(100):
+            r = client.get("/ready")
+            if r.status_code == 200:
+                break
+            time.sleep(0.02)
+        assert r.status_code == 200 and set(r.json()["steps"]) == {"llm", "dummy_png"}
+    assert not warmup.status()["ready"]
+
+def test_ready_stays_503_when_a_step_fails(monkeypatch):
+    async def broken(): raise ConnectionError("no route")
+    monkeypatch.setattr(warmup, "STEPS", {"llm": broken, "dummy_png": warmup._warm_dummy_png})
+    monkeypatch.setattr(app_module, "get_log_store", lambda: _Logger())
+    with TestClient(app_module.app) as client:
+        for _ in range(100):
+            if warmup.status()["sec"] is not None:
+                break
+            time.sleep(0.02)
+        r = client.get("/ready")
+        assert r.status_code == 503 and r.json()["steps"]["llm"]["error"] == "no route"
+
+def test_lazy_sandbox_warmup_leaves_the_pool_down(monkeypatch):
+    class _Pool:
+        started = False
+        async def wait_ready(self):
+            self.started = True
+            return True
+    pool = _Pool()
+    monkeypatch.setattr(warmup.sandbox_pool, "get_pool", lambda: pool)
+    monkeypatch.setattr(warmup, "SANDBOX_WARMUP", "lazy")
+    monkeypatch.setattr(warmup, "STEPS", {"sandbox": warmup._warm_sandbox})
+    try:
+        state = _run(warmup.prewarm(timeout=5))
+    finally:
+        warmup.reset()
+    assert state["ready"] and not pool.started
+    assert state["steps"]["sandbox"]["skipped"] == "SANDBOX_WARMUP=lazy"
+
+def test_import_profile_report():
+    stderr = ("import time: self [us] | cumulative | imported package\n"
+              "import time:       100 |        100 |     json.decoder\n"
+              "import time:       400 |        500 |   json\n"
+              "import time:      1000 |       1000 |     openai.types\n"
+              "import time:       200 |       1200 |   openai\n"
+              "import time:       300 |       2000 | app\n")
+    rows = parse_importtime(stderr)
+    assert rows["json"] == {"self_us": 400, "cumulative_us": 500, "depth": 1}
+    rep = report(rows, "app", 2, ["openai", "PIL"])
+    assert rep["total_ms"] == 2.0 and [r["module"] for r in rep["top_cumulative"]] == ["app", "openai"]
+    assert rep["top_self"][0] == {"module": "openai.types", "ms": 1.0}
+    assert rep["lazy_imported"] == {"openai": True, "PIL": False}
@@ -0,0 +1,204 @@
+# uploads.py
+# Streaming multipart ingestion: file parts go straight from the request body to
+# the job's attachments dir in chunks, hashed (SHA-256) on the fly, with per-file
+# and per-request byte limits enforced as data arrives. Disk writes run in a
+# worker thread. Identical content is deduplicated through a content-addressed
+# store (CAS) of read-only blobs. Jobs never link to a blob: they get a
+# copy-on-write clone of it where the filesystem has reflinks, a plain private
+# copy otherwise, so sandboxed code that rewrites its input only changes its own.
+import asyncio, hashlib, os, shutil, time
+from typing import Any, AsyncIterator, Dict, List, Mapping, Optional, Tuple
+from multipart.multipart import MultipartParser, parse_options_header
+from config import UPLOAD_MAX_FILE_BYTES, UPLOAD_MAX_REQUEST_BYTES, UPLOAD_CAS_DIR, UPLOAD_CAS_TTL_SEC
+
+class UploadLimitError(Exception):
+    """Upload exceeded UPLOAD_MAX_FILE_BYTES or UPLOAD_MAX_REQUEST_BYTES."""
+
+class _Part:
+    def __init__(self):
+        self.headers: Dict[str, bytes] = {}
+        self.field = ""
+        self.filename: Optional[str] = None
+        self.content_type: Optional[str] = None
+        self.path = ""
+        self.tmp = ""
+        self.fh = None
+        self.hasher = hashlib.sha256()
+        self.size = 0
+
+def _safe_name(name: str) -> str:
+    name = os.path.basename(name.replace("\\", "/")).strip()
+    return name if name not in {"", ".", ".."} else "upload.bin"
+
+def _write(fh, hasher, data: bytes) -> None:
+    hasher.update(data)
+    fh.write(data)
+
+FICLONE = 0x40049409  # linux/fs.h: _IOW(0x94, 9, int)
+
+def _clone(src: str, dst: str) -> bool:
+    """Copy-on-write clone of src to dst (reflink); False where unsupported."""
+    try:
+        import fcntl
+        with open(src, "rb") as s, open(dst, "wb") as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        return True
+    except (ImportError, OSError):
+        try:
+            os.remove(dst)
+        except OSError:
+            pass
+        return False
+
+def _finalize(tmp: str, dest: str, digest: str, cas_dir: Optional[str]) -> bool:
+    """Move tmp into place at dest, via the CAS when enabled. Returns True if deduplicated.
+    On a hit dest is a clone of the blob; without reflinks the freshly written tmp is
+    kept instead, being byte-identical and already private. On a miss a read-only
+    copy of tmp becomes the blob (blobs are never modified, so never re-hashed)."""
+    if os.path.exists(dest):
+        os.remove(dest)
+    if cas_dir:
+        cas = os.path.join(cas_dir, digest[:2], digest)
+        try:
+            if os.path.exists(cas):
+                if _clone(cas, dest):
+                    os.remove(tmp)
+                else:
+                    os.replace(tmp, dest)
+                os.utime(cas)
+                return True
+            os.makedirs(os.path.dirname(cas), exist_ok=True)
+            cas_tmp = f"{cas}.{os.getpid()}.{id(tmp)}.tmp"
+            if not _clone(tmp, cas_tmp):
+                shutil.copyfile(tmp, cas_tmp)
+            os.chmod(cas_tmp, 0o444)
+            os.replace(cas_tmp, cas)
+        except OSError:
+            pass  # e.g. CAS dir not writable: the job keeps its private copy
+    os.replace(tmp, dest)
+    return False
+
+def gc_cas(cas_dir: str, ttl_sec: float) -> int:
+    """Drop CAS blobs not reused for ttl_sec (jobs hold clones, not links, of them)."""
+    removed = 0
+    now = time.time()
+    for root, _dirs, names in os.walk(cas_dir):
+        for n in names:
+            p = os.path.join(root, n)
+            try:
+                if now - os.stat(p).st_mtime > ttl_sec:
+                    os.remove(p)
+                    removed += 1
+            except OSError:
+                pass
+    return removed
+
+_last_gc = 0.0
+
+def maybe_gc_cas() -> None:
+    global _last_gc
+    if not UPLOAD_CAS_DIR or time.time() - _last_gc < UPLOAD_CAS_TTL_SEC / 4:
+        return
+    _last_gc = time.time()
+    asyncio.get_running_loop().run_in_executor(None, gc_cas, UPLOAD_CAS_DIR, UPLOAD_CAS_TTL_SEC)
+
+async def ingest_multipart(
+    headers: Mapping[str, str],
+    stream: AsyncIterator[bytes],
+    attach_dir: str,
+    max_file_bytes: int = UPLOAD_MAX_FILE_BYTES,
+    max_request_bytes: int = UPLOAD_MAX_REQUEST_BYTES,
+    cas_dir: Optional[str] = UPLOAD_CAS_DIR,
+) -> List[Dict[str, Any]]:
+    """Stream the file parts of a multipart/form-data body into attach_dir.
+    Returns one dict per file part: field, filename, path, content_type, sha256, size, deduped.
+    Non-file fields are skipped. Raises UploadLimitError as soon as a limit is crossed."""
+    ctype, params = parse_options_header(headers.get("content-type", ""))
+    if ctype != b"multipart/form-data" or b"boundary" not in params:
+        return []
+    declared = headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_request_bytes:
+        raise UploadLimitError(f"request body {declared} bytes exceeds limit {max_request_bytes}")
+
+    events: List[Tuple[str, bytes]] = []
+    hname = bytearray()
+    hvalue = bytearray()
+
+    def on_header_field(data, start, end): hname.extend(data[start:end])
+    def on_header_value(data, start, end): hvalue.extend(data[start:end])
+    def on_header_end():
+        events.append(("header", bytes(hname) + b"\0" + bytes(hvalue)))
+        hname.clear(); hvalue.clear()
+
+    callbacks = {
+        "on_part_begin": lambda: events.append(("begin", b"")),
+        "on_part_data": lambda data, start, end: events.append(("data", data[start:end])),
+        "on_part_end": lambda: events.append(("end", b"")),
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": lambda: events.append(("headers_done", b"")),
+    }
+    parser = MultipartParser(params[b"boundary"], callbacks)
+
+    saved: List[Dict[str, Any]] = []
+    part: Optional[_Part] = None
+    total = 0
+    try:
+        async for chunk in stream:
+            total += len(chunk)
+            if total > max_request_bytes:
+                raise UploadLimitError(f"request body exceeds limit {max_request_bytes}")
+            parser.write(chunk)
+
+            pending: List[bytes] = []
+            for kind, data in events:
+                if kind == "data":
+                    if part is not None and part.fh is not None:
+                        part.size += len(data)
+                        if part.size > max_file_bytes:
+                            raise UploadLimitError(f"{part.filename}: exceeds per-file limit {max_file_bytes}")
+                        pending.append(data)
+                    continue
+                if pending:
+                    await asyncio.to_thread(_write, part.fh, part.hasher, b"".join(pending))
+                    pending = []
+                if kind == "begin":
+                    part = _Part()
+                elif kind == "header":
+                    k, v = data.split(b"\0", 1)
+                    part.headers[k.decode("latin-1").lower()] = v
+                elif kind == "headers_done":
+                    _, opts = parse_options_header(part.headers.get("content-disposition", b""))
+                    part.field = opts.get(b"name", b"").decode("utf-8", "replace")
+                    if b"filename" in opts:
+                        part.filename = opts[b"filename"].decode("utf-8", "replace") or part.field
+                        part.content_type = part.headers.get("content-type", b"").decode("latin-1") or None
+                        part.path = os.path.join(attach_dir, _safe_name(part.filename))
+                        part.tmp = os.path.join(attach_dir, f".{len(saved)}.part")
+                        part.fh = await asyncio.to_thread(open, part.tmp, "wb")
+                elif kind == "end" and part is not None:
+                    if part.fh is not None:
+                        await asyncio.to_thread(part.fh.close)
+                        part.fh = None
+                        digest = part.hasher.hexdigest()
+                        deduped = await asyncio.to_thread(_finalize, part.tmp, part.path, digest, cas_dir)
+                        saved.append({
+                            "field": part.field,
+                            "filename": part.filename,
+                            "path": part.path,
+                            "content_type": part.content_type,
+                            "sha256": digest,
+                            "size": part.size,
+                            "deduped": deduped,
+                        })
+                    part = None
+            if pending:
+                await asyncio.to_thread(_write, part.fh, part.hasher, b"".join(pending))
+            events.clear()
+        parser.finalize()
+    finally:
+        if part is not None and part.fh is not None:
+            await asyncio.to_thread(part.fh.close)
+    maybe_gc_cas()
+    return saved
@@ -0,0 +1,95 @@
+# warmup.py
+# Startup pre-warm and readiness. After the app starts, prewarm() runs its steps
+# concurrently in the background: the LLM client (SDK import + a pooled
+# connection to the API host), the sandbox interpreter (zygotes ready, or one
+# throwaway cold run that pulls the interpreter and the allowed libs into the page
+# cache) and the dummy PNG payload. GET /ready reports status(): 503 until every
+# step has succeeded (or was skipped); a failed or timed-out step is reported and
+# keeps the worker unready, so a load balancer only routes traffic to warm workers.
+import asyncio, shutil, tempfile, time
+from typing import Any, Awaitable, Callable, Dict, Optional
+import format_handler, llm_client, sandbox_pool
+from config import SANDBOX_WARMUP, STARTUP_PREWARM, STARTUP_PREWARM_TIMEOUT_SEC
+
+class Skipped(Exception):
+    """Raised by a step that deliberately does nothing; counts as ok for /ready."""
+
+async def _warm_sandbox() -> None:
+    pool = sandbox_pool.get_pool()
+    if pool is not None:
+        if SANDBOX_WARMUP != "eager":
+            raise Skipped(f"SANDBOX_WARMUP={SANDBOX_WARMUP}")
+        if not await pool.wait_ready():
+            raise RuntimeError("no sandbox worker came up")
+        return
+    from executor_b64 import run_user_code
+    cwd = tempfile.mkdtemp(prefix="warm_")
+    try:
+        imports = "".join(f"try:\n    import {m}\nexcept Exception:\n    pass\n" for m in sandbox_pool.warm_modules())
+        ok, _out, err = await run_user_code(imports + "print('[]')", cwd, timeout=STARTUP_PREWARM_TIMEOUT_SEC)
+        if not ok:
+            raise RuntimeError(err.strip()[-200:] or "warm-up run failed")
+    finally:
+        shutil.rmtree(cwd, ignore_errors=True)
+
+async def _warm_dummy_png() -> None:
+    # the first call imports PIL; keep that off the loop so /health stays responsive
+    await asyncio.to_thread(format_handler.prewarm)
+
+STEPS: Dict[str, Callable[[], Awaitable[None]]] = {
+    "llm": llm_client.prewarm,
+    "sandbox": _warm_sandbox,
+    "dummy_png": _warm_dummy_png,
+}
+
+_state: Dict[str, Any] = {"ready": False, "started": None, "sec": None, "steps": {}}
+
+def status() -> Dict[str, Any]:
+    return {"ready": _state["ready"], "sec": _state["sec"], "steps": dict(_state["steps"])}
+
+def reset() -> None:
+    _state.update(ready=False, started=None, sec=None, steps={})
+
+async def _step(name: str, fn: Callable[[], Awaitable[None]]) -> None:
+    t0 = time.monotonic()
+    try:
+        await fn()
+        _state["steps"][name] = {"ok": True, "sec": round(time.monotonic() - t0, 3)}
+    except Skipped as e:
+        _state["steps"][name] = {"ok": True, "sec": round(time.monotonic() - t0, 3), "skipped": str(e)}
+    except asyncio.CancelledError:
+        _state["steps"][name] = {"ok": False, "sec": round(time.monotonic() - t0, 3), "error": "timeout"}
+        raise
+    except Exception as e:
+        _state["steps"][name] = {"ok": False, "sec": round(time.monotonic() - t0, 3),
+                                 "error": str(e) or type(e).__name__}
+
+async def prewarm(timeout: float = STARTUP_PREWARM_TIMEOUT_SEC) -> Dict[str, Any]:
+    """Run every step (bounded by timeout); the process is ready only if all were ok."""
+    reset()
+    _state["started"] = time.monotonic()
+    if STARTUP_PREWARM:
+        tasks = [asyncio.ensure_future(_step(name, fn)) for name, fn in STEPS.items()]
+        _done, pending = await asyncio.wait(tasks, timeout=timeout)
+        for t in pending:
+            t.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    _state["sec"] = round(time.monotonic() - _state["started"], 3)
+    _state["ready"] = all(st["ok"] for st in _state["steps"].values())
+    return status()
+
+_task: Optional[asyncio.Task] = None
+
+def start() -> asyncio.Task:
+    """Startup hook: pre-warm in the background so /health answers right away."""
+    global _task
+    _task = asyncio.ensure_future(prewarm())
+    return _task
+
+async def stop() -> None:
+    global _task
+    if _task is not None and not _task.done():
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+    _task = None
+    reset()